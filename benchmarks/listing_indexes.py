@@ -0,0 +1,159 @@
+"""
+Benchmark the hot listing queries with and without the secondary indexes.
+
+This seeds a scratch PostgreSQL database with listings, user info and expiration
+checks, then reports the query plan and latency of each query before and after
+creating the indexes declared on the models::
+
+    CLAPBOT_ENVIRON=dev python benchmarks/listing_indexes.py \\
+        --url postgresql://postgres:postgres@db:5432/clapbot_bench --rows 1000000
+
+All tables in the target database are dropped and re-created!
+"""
+import argparse
+import json
+import statistics
+import time
+
+from sqlalchemy import and_, func, or_, text
+from sqlalchemy.dialects import postgresql
+
+from clapbot.application import create_app
+from clapbot.core import db
+from clapbot.model import UserListingInfo
+from clapbot.cl.model import Listing
+from clapbot.queries import listing_list_query
+from clapbot.views import filter_rejected
+
+SEED = [
+    "INSERT INTO clsite (name, enabled) VALUES ('sfbay', true)",
+    "INSERT INTO clarea (site_id, name) SELECT 1, 'area' || i FROM generate_series(1, 10) i",
+    "INSERT INTO clcategory (name, description) VALUES ('apa', ''), ('hhh', ''), ('swp', '')",
+    """INSERT INTO transitstop (stop_id, agency, name, lat, lon)
+       SELECT 's' || i, 'TEST', 'Stop ' || i, 37.5 + random(), -122.5 + random() FROM generate_series(1, 100) i""",
+    """INSERT INTO listing (url, created, expired, lat, lon, name, price, cl_id, cl_site, cl_area, cl_category,
+                           transit_stop_id, notified)
+       SELECT 'http://sfbay.craigslist.org/eby/apa/' || i || '.html',
+              now() - random() * interval '365 days',
+              CASE WHEN random() < 0.8 THEN now() END,
+              37.5 + random(), -122.5 + random(), 'Listing ' || i,
+              500 + floor(random() * 5000), i, 1,
+              1 + floor(random() * 10)::int, 1 + floor(random() * 3)::int,
+              CASE WHEN random() < 0.9 THEN 1 + floor(random() * 100)::int END,
+              random() < 0.98
+       FROM generate_series(1, :rows) i""",
+    """INSERT INTO userlistinginfo (listing_id, rejected, starred, contacted, score, notes)
+       SELECT id, random() < 0.1, random() < 0.01, false, floor(random() * 4000 - 2000), '' FROM listing""",
+    """INSERT INTO listingexpirationcheck (listing_id, created, response_status)
+       SELECT id, now() - random() * interval '30 days', 200 FROM listing, generate_series(1, 2)""",
+    """UPDATE listing SET last_checked_at = c.created, last_status = c.response_status
+       FROM (SELECT DISTINCT ON (listing_id) listing_id, created, response_status FROM listingexpirationcheck
+             ORDER BY listing_id, created DESC) c
+       WHERE c.listing_id = listing.id""",
+]
+
+
+def hot_queries():
+    """The listing queries used by views and tasks, keyed by name."""
+    queries = {}
+
+    home = filter_rejected(listing_list_query().order_by(Listing.created.desc()))
+    queries['home'] = home.order_by(UserListingInfo.score.desc()).limit(20)
+
+    queries['latest'] = listing_list_query().order_by(Listing.created.desc()).limit(20)
+
+    # pylint: disable=singleton-comparison
+    notify = Listing.query.filter(Listing.transit_stop_id != None).order_by(Listing.created.desc())  # noqa: E711
+    notify = notify.filter_by(notified=False).from_self().join(UserListingInfo, isouter=True).filter(
+        or_(~UserListingInfo.rejected, UserListingInfo.rejected == None))  # noqa: E711
+    queries['notify'] = notify.order_by(UserListingInfo.score.desc()).filter(UserListingInfo.score > 0).limit(10)
+
+    search = and_(Listing.price.between(1500, 2500), Listing.cl_area == 3, Listing.cl_category == 2)
+    queries['search'] = listing_list_query().filter(search).order_by(Listing.created.desc()).limit(20)
+
+    expirations = db.session.query(Listing.id).filter(Listing.expired == None)  # noqa: E711
+    expirations = expirations.filter(
+        or_(Listing.last_checked_at == None,  # noqa: E711
+            Listing.last_checked_at < func.now() - text("interval '2 days'")))
+    expirations = expirations.order_by(Listing.last_checked_at.isnot(None), Listing.last_checked_at)
+    queries['expirations'] = expirations.limit(100)
+
+    queries['userinfo'] = UserListingInfo.query.filter(UserListingInfo.listing_id == 4242)
+    return queries
+
+
+def compile_query(query):
+    """Render a query as literal PostgreSQL."""
+    statement = query.statement.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True})
+    return str(statement)
+
+
+def measure(sql, repeat):
+    """Return the text plan, and the median execution time in ms, for a query."""
+    plan = db.session.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {sql}")).fetchall()
+    timings = []
+    for _ in range(repeat):
+        result = db.session.execute(text(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}")).scalar()
+        result = json.loads(result) if isinstance(result, str) else result
+        timings.append(result[0]['Execution Time'])
+    return "\n".join(line for (line, ) in plan), statistics.median(timings)
+
+
+def run(queries, repeat):
+    results = {}
+    for name, sql in queries.items():
+        plan, latency = measure(sql, repeat)
+        print(f"--- {name} ({latency:.2f} ms)")
+        print(plan)
+        results[name] = latency
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', required=True, help="URL of a scratch PostgreSQL database.")
+    parser.add_argument('--rows', type=int, default=1000000, help="Number of listings to seed.")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of timed runs per query.")
+    args = parser.parse_args()
+
+    app = create_app()
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.url
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        indexes = [index for table in db.metadata.sorted_tables for index in table.indexes]
+        for index in indexes:
+            index.drop(db.engine)
+
+        start = time.monotonic()
+        for statement in SEED:
+            db.session.execute(text(statement), {'rows': args.rows})
+        db.session.commit()
+        print(f"Seeded {args.rows} listings in {time.monotonic() - start:.1f}s")
+
+        queries = {name: compile_query(query) for name, query in hot_queries().items()}
+
+        db.session.execute(text("ANALYZE"))
+        print("=== Without indexes")
+        before = run(queries, args.repeat)
+
+        start = time.monotonic()
+        for index in indexes:
+            index.create(db.engine)
+        db.session.commit()
+        db.session.execute(text("ANALYZE"))
+        print(f"Created {len(indexes)} indexes in {time.monotonic() - start:.1f}s")
+
+        print("=== With indexes")
+        after = run(queries, args.repeat)
+
+        print("=== Summary (median ms)")
+        print(f"{'query':<12} {'before':>10} {'after':>10} {'speedup':>8}")
+        for name in queries:
+            print(f"{name:<12} {before[name]:>10.2f} {after[name]:>10.2f} {before[name] / after[name]:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Benchmark the listing page parser backends against a full BeautifulSoup parse::
+
+    python benchmarks/listing_parse.py --number 200 tests/cl/listing.html
+
+Every backend must extract the same fields as the full parse, or the benchmark fails.
+"""
+import argparse
+import timeit
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+from clapbot.cl import parse
+
+DEFAULT_PAGE = Path(__file__).parent.parent / 'tests' / 'cl' / 'listing.html'
+
+
+def full_soup(content):
+    """The original approach, which builds the whole tree."""
+    return parse.parse_soup(BeautifulSoup(content, 'html.parser'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pages', nargs='*', type=Path, default=[DEFAULT_PAGE], help="Listing pages to parse.")
+    parser.add_argument('--number', type=int, default=200, help="Number of parses per timing.")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of timings, the best is reported.")
+    args = parser.parse_args()
+
+    pages = [page.read_bytes() for page in args.pages]
+    backends = {'full soup': full_soup}
+    for name, backend in parse.PARSERS.items():
+        if name == 'lxml' and parse.lxml is None:
+            print("Skipping lxml, which is not installed.")
+            continue
+        backends[name] = backend
+
+    for page in pages:
+        expected = full_soup(page)
+        for name, backend in backends.items():
+            assert backend(page) == expected, f"{name} extracted different fields"
+
+    baseline = None
+    print(f"{'backend':<12} {'ms/page':>10} {'speedup':>8}")
+    for name, backend in backends.items():
+        best = min(
+            timeit.repeat(lambda: [backend(page) for page in pages], number=args.number, repeat=args.repeat))
+        per_page = best / (args.number * len(pages)) * 1000
+        baseline = baseline or per_page
+        print(f"{name:<12} {per_page:>10.3f} {baseline / per_page:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
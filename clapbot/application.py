@@ -103,7 +103,11 @@ def create_app():
         """
         Add headers to both force latest IE rendering engine or Chrome Frame,
         and also to cache the rendered page for 10 minutes.
+
+        Responses which are marked as immutable (e.g. images) keep their own cache headers.
         """
+        if r.cache_control.immutable:
+            return r
         r.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
         r.headers["Pragma"] = "no-cache"
         r.headers["Expires"] = "0"
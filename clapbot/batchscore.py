@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Score listings in batches, with vectorized versions of the score functions in
+:mod:`clapbot.score`.
+"""
+import datetime as dt
+from typing import NamedTuple, Dict
+
+import numpy as np
+
+from flask import current_app as app
+from sqlalchemy import func, case
+
+from .core import db
+from .model import TransitStop, UserListingInfo
+from .cl.model import Listing
+from .cl.model.image import images
+from .cl.model.listing import Tag, tags as listing_tags
+from .spatial import EARTH_RADIUS_KM
+from . import score
+
+_batchfuncs = {}
+
+#: Tag names which are used by the tags score function.
+SCORE_TAGS = ("w/d in unit", "laundry on site", "laundry in bldg", "w/d hookups", "no laundry on site", "furnished",
+              "no smoking", "house", "condo", "apartment")
+
+
+def batch_scorer(f):
+    """Decorator marking a vectorized score function, which replaces the function of the same name."""
+    _batchfuncs[f.__name__] = f
+    return f
+
+
+class ListingColumns(NamedTuple):
+    """The columns used for scoring a batch of listings."""
+    ids: np.ndarray
+    created: np.ndarray
+    available: np.ndarray
+    lat: np.ndarray
+    lon: np.ndarray
+    price: np.ndarray
+    bedrooms: np.ndarray
+    bathrooms: np.ndarray
+    size: np.ndarray
+    name: np.ndarray
+    stop_lat: np.ndarray
+    stop_lon: np.ndarray
+    nimages: np.ndarray
+    tags: Dict[str, np.ndarray]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def has_tag(self, name):
+        """Boolean array marking listings with a given tag."""
+        return self.tags[name]
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, dt.datetime) else value
+
+
+def load_columns(listing_ids):
+    """Load scoring columns for listings into arrays, ordered by listing id."""
+    query = db.session.query(Listing.id, Listing.created, Listing.available, Listing.lat, Listing.lon, Listing.price,
+                             Listing.bedrooms, Listing.bathrooms, Listing.size, Listing.name, TransitStop.lat,
+                             TransitStop.lon)
+    query = query.outerjoin(TransitStop, Listing.transit_stop_id == TransitStop.id)
+    rows = query.filter(Listing.id.in_(listing_ids)).order_by(Listing.id).all()
+    (ids, created, available, lat, lon, price, bedrooms, bathrooms, size, name, stop_lat,
+     stop_lon) = zip(*rows) if rows else ([], ) * 12
+    ids = np.array(ids, dtype=np.int64)
+
+    image_counts = db.session.query(images.c.listing_id, func.count(images.c.image_id)).filter(
+        images.c.listing_id.in_(listing_ids)).group_by(images.c.listing_id)
+    nimages = np.zeros(len(ids), dtype=np.int64)
+    for listing_id, count in image_counts:
+        nimages[np.searchsorted(ids, listing_id)] = count
+
+    tag_query = db.session.query(listing_tags.c.listing_id, Tag.name).join(Tag, Tag.id == listing_tags.c.tag_id).filter(
+        listing_tags.c.listing_id.in_(listing_ids), Tag.name.in_(SCORE_TAGS))
+    tags = {tag: np.zeros(len(ids), dtype=bool) for tag in SCORE_TAGS}
+    for listing_id, tag in tag_query:
+        tags[tag][np.searchsorted(ids, listing_id)] = True
+
+    return ListingColumns(
+        ids=ids,
+        created=np.array([_as_date(value) for value in created], dtype='datetime64[D]'),
+        available=np.array(available, dtype='datetime64[D]'),
+        lat=np.array(lat, dtype=float),
+        lon=np.array(lon, dtype=float),
+        price=np.array(price, dtype=float),
+        bedrooms=np.array(bedrooms, dtype=float),
+        bathrooms=np.array(bathrooms, dtype=float),
+        size=np.array(size, dtype=float),
+        name=np.array([value or '' for value in name], dtype=str),
+        stop_lat=np.array(stop_lat, dtype=float),
+        stop_lon=np.array(stop_lon, dtype=float),
+        nimages=nimages,
+        tags=tags)
+
+
+def coord_distance(lat1, lon1, lat2, lon2):
+    """Vectorized version of :func:`clapbot.utils.coord_distance`."""
+    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(a))
+
+
+def score_columns(columns):
+    """Evaluate every score function over a batch of listings, returning a dictionary of score arrays."""
+    info = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for sf in score._scorefuncs:
+            if sf.__name__ not in _batchfuncs:
+                raise ValueError(f"Score function {sf.__name__} has no batch version.")
+            result = np.broadcast_to(_batchfuncs[sf.__name__](columns), (len(columns), ))
+            info[sf.__name__] = np.nan_to_num(result.astype(float))
+    return info
+
+
+def save_scores(ids, scores):
+    """Write scores to user listing info, creating missing rows."""
+    values = {int(listing_id): int(round(value)) for listing_id, value in zip(ids, scores)}
+    if not values:
+        return
+    existing = set(listing_id for (listing_id, ) in db.session.query(UserListingInfo.listing_id).filter(
+        UserListingInfo.listing_id.in_(values.keys())))
+    if existing:
+        db.session.query(UserListingInfo).filter(UserListingInfo.listing_id.in_(existing)).update(
+            {
+                UserListingInfo.score: case({listing_id: values[listing_id]
+                                             for listing_id in existing}, value=UserListingInfo.listing_id)
+            },
+            synchronize_session=False)
+    missing = [{
+        'listing_id': listing_id,
+        'score': value
+    } for listing_id, value in values.items() if listing_id not in existing]
+    if missing:
+        db.session.execute(UserListingInfo.__table__.insert(), missing)
+
+
+def score_listings(listing_ids):
+    """Score a batch of listings, and save the results. Returns the number of listings scored."""
+    columns = load_columns(listing_ids)
+    info = score_columns(columns)
+    total = sum(info.values()) if info else np.zeros(len(columns))
+    save_scores(columns.ids, total)
+    return len(columns)
+
+
+def rescore_all(batch_size=None):
+    """Score every listing, committing after each batch."""
+    batch_size = batch_size if batch_size is not None else app.config['CRAIGSLIST_SCORE_BATCH_SIZE']
+    listing_ids = [listing_id for (listing_id, ) in db.session.query(Listing.id).order_by(Listing.id)]
+    n = 0
+    for start in range(0, len(listing_ids), batch_size):
+        n += score_listings(listing_ids[start:start + batch_size])
+        db.session.commit()
+    return n
+
+
+@batch_scorer
+def age(columns):
+    """Score against listing age."""
+    listing_age = np.abs((np.datetime64(dt.date.today(), 'D') - columns.created).astype('timedelta64[D]').astype(float))
+    listing_age[np.isnat(columns.created)] = np.inf
+    return np.select([listing_age < 1, listing_age < 4, listing_age < 7], [20, 0, -20], -3000)
+
+
+@batch_scorer
+def transit(columns):
+    """Score a listing's transit options."""
+    if not app.config['CRAIGSLIST_SCORE_TRANSIT']:
+        return 0
+    distance = coord_distance(columns.lat, columns.lon, columns.stop_lat, columns.stop_lon)
+    return np.select([np.isnan(columns.stop_lat), distance < 1.0, distance < 1.5, distance < 3.0],
+                     [-200, 500, (2.0 - distance) * 500, (3.0 - distance) * 100], 0)
+
+
+@batch_scorer
+def location(columns):
+    """Score location"""
+    lat = app.config['CRAIGSLIST_SCORE_WORK_LAT']
+    lon = app.config['CRAIGSLIST_SCORE_WORK_LON']
+    to_berk = coord_distance(columns.lat, columns.lon, lat, lon)
+
+    dwork_close = app.config['CRAIGSLIST_SCORE_WORK_CLOSE']
+    dwork_medium = app.config['CRAIGSLIST_SCORE_WORK_MEDIUM']
+
+    return np.select([to_berk < dwork_close, to_berk < dwork_medium], [
+        1000 * ((dwork_close - to_berk) / dwork_close),
+        250 * ((dwork_medium - to_berk) / dwork_medium),
+    ], 0.0)
+
+
+@batch_scorer
+def title(columns):
+    """Suspicious title scoring."""
+    studio = np.char.find(np.char.lower(columns.name), "studio") >= 0
+    return np.where(studio, app.config['CRAIGSLIST_SCORE_STUDIO_PENALTY'], 0.0)
+
+
+@batch_scorer
+def pictures(columns):
+    """Score by number of images."""
+    nimages = columns.nimages
+    return np.select([nimages == 0, nimages == 1, nimages < 4], [-500, -200, 0], 200)
+
+
+@batch_scorer
+def tags(columns):
+    """Score tags"""
+    has = columns.has_tag
+    laundry = np.select([
+        has("w/d in unit"),
+        has("laundry on site"),
+        has("laundry in bldg"),
+        has("w/d hookups"),
+        has("no laundry on site")
+    ], [500, 150, 150, 150, -300], 0.0)
+    kind = np.select([has("house"), has("condo"), has("apartment")], [300, 150, 5], 0.0)
+    return laundry + np.where(has("furnished"), -250, 0) + np.where(has("no smoking"), 100, 0) + kind
+
+
+@batch_scorer
+def availability(columns):
+    """Score based on availability date."""
+    target = np.datetime64(dt.datetime.strptime(app.config['SCORE_TARGET_DATE'], '%Y-%m-%d').date(), 'D')
+    missing = np.isnat(columns.available)
+    delta = (target - columns.available).astype('timedelta64[D]').astype(float)
+    delta[missing] = 0.0
+    multiplier = np.where(columns.available < columns.created, 0.2, 0.5)
+    result = np.select([delta > 32, delta > 0, delta < 0], [
+        -0.5 * multiplier * (columns.price / 30.0) * delta,
+        -0.1 * multiplier * (columns.price / 30.0) * delta,
+        -0.25 * multiplier * 2000.0 / 3.0 * np.abs(delta),
+    ], 0.0)
+    return np.where(missing, -500, result)
+
+
+@batch_scorer
+def bd_ba(columns):
+    """Score based on number of bedrooms."""
+    bedrooms = columns.bedrooms
+    size = np.where(np.isnan(columns.size), 250 * bedrooms, columns.size)
+    bathrooms = np.where(np.isnan(columns.bathrooms), 1.5, columns.bathrooms)
+    penalty = np.where((bathrooms > 2) & (bathrooms > bedrooms), -3000, 0.0)
+    result = penalty + np.minimum(bedrooms, 3) * 500 + 0.75 * size + np.minimum(bathrooms, 3) * 250
+    return np.where(np.isnan(bedrooms), 0.0, result)
+
+
+@batch_scorer
+def price(columns):
+    """Score based on number of bedrooms."""
+    bedrooms = np.where(np.isnan(columns.bedrooms), 1.0, columns.bedrooms)
+    # A price of zero (or less) is a placeholder, and would make the penalty infinite.
+    missing = np.isnan(columns.price) | (columns.price <= 0)
+    price = np.where(missing, 1.0, columns.price)
+    penalty = np.where((bedrooms * 1000.0) > price, -1000 - ((bedrooms * 750.0) / price - 1.0) * 1000, 0.0)
+    return np.where(missing, -4000, -1.0 * price + penalty)
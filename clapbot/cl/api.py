@@ -1,13 +1,13 @@
-import io
-
 from flask import Blueprint
-from flask import request, redirect, url_for, send_file
+from flask import request, redirect, url_for
 
 from werkzeug.urls import url_parse
+from werkzeug.exceptions import NotFound
 from flask_login import login_required
 
 from . import tasks as t
 from . import model as m
+from .blobstore import send_blob
 
 from ..core import db
 from ..utils import next_url
@@ -84,17 +84,21 @@ def download_all():
 def image(identifier):
     """Serve an image from the local database."""
     img = m.image.Image.query.get_or_404(identifier)
-    if img.full is not None and img.full:
-        return send_file(io.BytesIO(img.full), mimetype='image/jpeg')
-    else:
-        return redirect(img.url)
+    if img.full_digest is not None and img.full_size:
+        try:
+            return send_blob(img.full_digest, mimetype='image/jpeg')
+        except NotFound:
+            pass
+    return redirect(img.url)
 
 
 @bp.route("/image/<int:identifier>/thumbnail.jpg")
 def thumbnail(identifier):
     """docstring for thumbnail"""
     img = m.image.Image.query.get_or_404(identifier)
-    if img.thumbnail is not None and img.thumbnail:
-        return send_file(io.BytesIO(img.thumbnail), mimetype='image/jpeg')
-    else:
-        return redirect(img.thumbnail_url)
+    if img.thumbnail_digest is not None and img.thumbnail_size:
+        try:
+            return send_blob(img.thumbnail_digest, mimetype='image/jpeg')
+        except NotFound:
+            pass
+    return redirect(img.thumbnail_url)
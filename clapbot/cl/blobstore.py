@@ -0,0 +1,146 @@
+"""
+Content-addressed storage for downloaded image data.
+"""
+import abc
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+from flask import current_app as app
+from flask import request, send_file, abort
+
+__all__ = ['BlobStore', 'FileSystemBlobStore', 'get_blob_store', 'send_blob']
+
+logger = logging.getLogger(__name__)
+
+
+class BlobStore(abc.ABC):
+    """A content-addressed store of binary data, keyed by SHA-256 digest."""
+
+    @staticmethod
+    def digest(data):
+        """Compute the digest for some data."""
+        return hashlib.sha256(data).hexdigest()
+
+    @classmethod
+    @abc.abstractmethod
+    def from_config(cls, config):
+        """Construct this store from application configuration."""
+
+    @abc.abstractmethod
+    def put(self, data):
+        """Store data, returning its digest."""
+
+    @abc.abstractmethod
+    def open(self, digest):
+        """Open a stored blob for reading."""
+
+    @abc.abstractmethod
+    def exists(self, digest):
+        """Check whether a blob is stored."""
+
+    def local_path(self, digest):
+        """The path of a blob on local disk, or None if it isn't stored on local disk."""
+        return None
+
+    def get(self, digest):
+        """Read a stored blob."""
+        with self.open(digest) as f:
+            return f.read()
+
+
+class FileSystemBlobStore(BlobStore):
+    """Store blobs as files, sharded by the leading characters of their digest."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def __repr__(self):
+        return f"FileSystemBlobStore(root={str(self.root)!r})"
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(Path(config['CRAIGSLIST_CACHE_PATH']) / 'blobs')
+
+    def path(self, digest):
+        """The path to a blob."""
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    def put(self, data):
+        digest = self.digest(data)
+        path = self.path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file and then move it into place, so that
+            # concurrent readers never see a partial blob.
+            fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp, str(path))
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        return digest
+
+    def open(self, digest):
+        return self.path(digest).open('rb')
+
+    def exists(self, digest):
+        return self.path(digest).exists()
+
+    def local_path(self, digest):
+        return self.path(digest)
+
+
+#: Blob store backends, by name, for the ``CRAIGSLIST_BLOB_STORE`` setting.
+BACKENDS = {
+    'filesystem': FileSystemBlobStore,
+}
+
+
+def get_blob_store():
+    """The blob store for the current application."""
+    store = app.extensions.get('clapbot.blobstore')
+    if store is None:
+        backend = BACKENDS[app.config['CRAIGSLIST_BLOB_STORE']]
+        store = app.extensions['clapbot.blobstore'] = backend.from_config(app.config)
+        logger.debug(f"Using blob store {store!r}")
+    return store
+
+
+def send_blob(digest, mimetype='application/octet-stream'):
+    """Respond with a stored blob.
+
+    Digests are content hashes, so they serve as strong ETags, and the response
+    is marked as immutable. Blobs on local disk are sent by path, so that the WSGI
+    server can use its file wrapper, or handed to nginx with X-Accel-Redirect when
+    ``CRAIGSLIST_BLOB_ACCEL_PREFIX`` is set.
+
+    Aborts with a 404 when a blob which is sent directly is missing from the store, so
+    that views can fall back to the original URL. Handed off blobs are checked by nginx.
+    """
+    store = get_blob_store()
+    path = store.local_path(digest)
+    prefix = app.config['CRAIGSLIST_BLOB_ACCEL_PREFIX']
+
+    if request.if_none_match.contains(digest):
+        response = app.response_class(status=304)
+    elif path is not None and prefix:
+        response = app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + path.relative_to(store.root).as_posix()
+    elif not store.exists(digest):
+        logger.warning(f"Blob {digest} is missing from {store!r}")
+        abort(404)
+    elif path is not None:
+        response = send_file(str(path.resolve()), mimetype=mimetype, add_etags=False)
+    else:
+        response = send_file(store.open(digest), mimetype=mimetype, add_etags=False)
+
+    response.set_etag(digest)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['CRAIGSLIST_BLOB_MAX_AGE']
+    response.cache_control.immutable = True
+    return response
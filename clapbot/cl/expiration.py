@@ -0,0 +1,158 @@
+"""
+Check whether many craigslist listings still exist, without downloading them.
+
+Only the status code of a listing page is needed to tell whether it has expired,
+so :func:`check_listings` sends ``HEAD`` requests (falling back to a streamed
+``GET`` which is closed once the headers arrive) for a batch of listings at once,
+and records every result in a single transaction.
+
+The latest check is also kept on the listing itself, so that choosing which
+listings to check next doesn't need the check history. Old checks are rolled up
+into a :class:`~clapbot.cl.model.listing.ListingExpirationSummary` per listing by
+:func:`compact_checks`.
+"""
+import datetime as dt
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app as app
+from sqlalchemy import bindparam, case, func
+
+from ..core import db
+from .model.listing import Listing, ListingExpirationCheck, ListingExpirationSummary
+from .model.keys import CHUNK_SIZE
+from .utils import chunked
+from . import http
+from .ratelimit import RateLimited
+
+__all__ = ['listing_status', 'check_listings', 'record_checks', 'compact_checks']
+
+logger = logging.getLogger(__name__)
+
+#: Status codes which mean a server won't answer a HEAD request, so a GET is needed instead.
+HEAD_UNSUPPORTED = frozenset((405, 501))
+
+
+def listing_status(url):
+    """The status code of a listing page, or None if it couldn't be requested.
+
+    Raises :class:`~clapbot.cl.ratelimit.RateLimited` when the request would wait too long.
+    """
+    try:
+        response = http.head(url, allow_redirects=True)
+        if response.status_code not in HEAD_UNSUPPORTED:
+            return response.status_code
+        with http.get(url, stream=True) as response:
+            return response.status_code
+    except RateLimited:
+        raise
+    except Exception as exc:    # pylint: disable=broad-except
+        logger.warning(f"Can't check listing at {url}: {exc!r}")
+        return None
+
+
+def _statuses(app, urls, workers):
+    def status(url):
+        with app.app_context():
+            try:
+                return listing_status(url)
+            except RateLimited as exc:
+                return exc
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(status, urls))
+
+
+def check_listings(listing_ids, workers=None):
+    """Check whether listings still exist, and record the results.
+
+    Every check is inserted, and every expired listing is marked, in one transaction.
+    Listings which couldn't be requested aren't recorded, so they are checked again
+    next time. Returns ``(expired, deferred, wait)``: the ids of listings which have
+    expired, the ids of listings which were skipped because of the rate limiter, and
+    the number of seconds to wait before checking those.
+    """
+    workers = workers or app.config['CRAIGSLIST_EXPIRATION_WORKERS']
+    listings = db.session.query(Listing.id, Listing.url).filter(Listing.id.in_(listing_ids)).all()
+    statuses = _statuses(app._get_current_object(), [url for _, url in listings], workers)
+
+    limited = [(listing_id, status) for (listing_id, _), status in zip(listings, statuses)
+               if isinstance(status, RateLimited)]
+    deferred = [listing_id for listing_id, _ in limited]
+    wait = min((status.wait for _, status in limited), default=0)
+    statuses = [None if isinstance(status, RateLimited) else status for status in statuses]
+
+    now = dt.datetime.now()
+    checks = [{
+        'listing_id': listing_id,
+        'created': now,
+        'response_status': status
+    } for (listing_id, _), status in zip(listings, statuses) if status is not None]
+    expired = record_checks(checks, now)
+    db.session.commit()
+    logger.info(f"Checked {len(checks)} of {len(listings)} listings, {len(expired)} have expired, "
+                f"{len(deferred)} deferred")
+    return expired, deferred, wait
+
+
+def record_checks(checks, now=None):
+    """Insert expiration checks, given as mappings, and update the checked listings.
+
+    Every listing's latest check is set with one statement, and listings which
+    weren't found are marked as expired with another. Returns the ids of expired listings.
+    """
+    if not checks:
+        return []
+    now = now or dt.datetime.now()
+    db.session.execute(ListingExpirationCheck.__table__.insert(), checks)
+
+    table = Listing.__table__
+    latest = table.update().where(table.c.id == bindparam('_id')).values(
+        last_checked_at=bindparam('_created'), last_status=bindparam('_status'))
+    db.session.execute(latest, [{
+        '_id': check['listing_id'],
+        '_created': check['created'],
+        '_status': check['response_status']
+    } for check in checks])
+
+    expired = [check['listing_id'] for check in checks if check['response_status'] == 404]
+    for chunk in chunked(expired, CHUNK_SIZE):
+        db.session.execute(table.update().where(table.c.id.in_(chunk)).values(expired=now))
+    return expired
+
+
+def compact_checks(before):
+    """Roll expiration checks made before a time up into per-listing summaries, and delete them.
+
+    Returns the number of checks which were compacted.
+    """
+    check = ListingExpirationCheck
+    rolled_up = db.session.query(check.listing_id, func.min(check.created), func.max(check.created),
+                                 func.count(check.id), func.sum(case([(check.response_status == 404, 1)], else_=0)))
+    rolled_up = rolled_up.filter(check.created < before).group_by(check.listing_id).all()
+
+    compacted = 0
+    for chunk in chunked(rolled_up, CHUNK_SIZE):
+        summaries = {
+            summary.listing_id: summary
+            for summary in ListingExpirationSummary.query.filter(
+                ListingExpirationSummary.listing_id.in_([row[0] for row in chunk]))
+        }
+        for listing_id, first_checked_at, last_checked_at, count, missing in chunk:
+            summary = summaries.get(listing_id)
+            if summary is None:
+                summary = ListingExpirationSummary(listing_id=listing_id, checks=0, missing=0,
+                                                   first_checked_at=first_checked_at)
+                db.session.add(summary)
+            summary.first_checked_at = min(summary.first_checked_at or first_checked_at, first_checked_at)
+            summary.last_checked_at = max(summary.last_checked_at or last_checked_at, last_checked_at)
+            summary.checks += count
+            summary.missing += missing or 0
+            compacted += count
+        db.session.flush()
+
+    check_table = check.__table__
+    db.session.execute(check_table.delete().where(check_table.c.created < before))
+    db.session.commit()
+    logger.info(f"Compacted {compacted} expiration checks for {len(rolled_up)} listings")
+    return compacted
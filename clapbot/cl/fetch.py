@@ -0,0 +1,124 @@
+"""
+Concurrent image downloads with asyncio.
+
+:func:`fetch_images` downloads every missing full image and thumbnail for a batch
+of images at once, rather than with one task (and two serial requests) per image.
+It requires :mod:`aiohttp`, and is used when ``CRAIGSLIST_IMAGE_FETCHER`` is
+set to ``'asyncio'``.
+"""
+import asyncio
+import logging
+from pathlib import Path
+from typing import NamedTuple, Any
+
+from flask import current_app as app
+
+from ..core import db
+from .ratelimit import get_limiter, acquire_async
+
+try:
+    import aiohttp
+except ImportError:    # pragma: no cover
+    aiohttp = None
+
+__all__ = ['fetch_images', 'ImageFetchError']
+
+logger = logging.getLogger(__name__)
+
+
+class ImageFetchError(Exception):
+    """Raised when some images in a batch could not be downloaded."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        urls = ", ".join(url for url, _ in failures)
+        super().__init__(f"Failed to download {len(failures)} images: {urls}")
+
+
+class FetchJob(NamedTuple):
+    """A single image file to download."""
+    image: Any
+    kind: str
+    url: str
+    path: Path
+
+
+def _jobs(images, force=False):
+    for image in images:
+        if image.full_digest is None or force:
+            yield FetchJob(image, 'full', image.url, image.cache_path / f"{image.cl_id}.full.jpg")
+        if image.thumbnail_digest is None or force:
+            yield FetchJob(image, 'thumbnail', image.thumbnail_url, image.cache_path / f"{image.cl_id}.thumbnail.jpg")
+
+
+async def _fetch(session, semaphore, limiter, url):
+    async with semaphore:
+        await acquire_async(limiter, url)
+        async with session.get(url) as response:
+            response.raise_for_status()
+            return await response.read()
+
+
+async def _fetch_all(urls, session=None, limiter=None, concurrency=8, limit_per_host=4, timeout=5):
+    """Fetch URLs concurrently, returning the content or the exception for each one."""
+    if session is None:
+        connector = aiohttp.TCPConnector(limit_per_host=limit_per_host)
+        async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+            return await _fetch_all(urls, session=session, limiter=limiter, concurrency=concurrency)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*[_fetch(session, semaphore, limiter, url) for url in urls], return_exceptions=True)
+
+
+def _run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def fetch_images(images, force=False, session=None):
+    """Download images and thumbnails concurrently, and save them in a single transaction.
+
+    Images which downloaded successfully are committed even if others failed, in
+    which case :class:`ImageFetchError` is raised afterwards. Returns the number of
+    files downloaded.
+    """
+    save = app.config['CRAIGSLIST_CACHE_ENABLE']
+
+    pending = []
+    for job in _jobs(images, force=force):
+        if save and job.path.exists():
+            logger.info(f"Loading image ({job.kind}) {job.image.cl_id} from cached file.")
+            setattr(job.image, job.kind, job.path.read_bytes())
+        else:
+            pending.append(job)
+
+    results = []
+    if pending:
+        if session is None and aiohttp is None:
+            raise RuntimeError("The asyncio image fetcher requires aiohttp")
+        logger.info(f"Requesting {len(pending)} images.")
+        results = _run(
+            _fetch_all([job.url for job in pending],
+                       session=session,
+                       limiter=get_limiter(),
+                       concurrency=app.config['CRAIGSLIST_IMAGE_FETCH_CONCURRENCY'],
+                       limit_per_host=app.config['CRAIGSLIST_HTTP_POOL_MAXSIZE'],
+                       timeout=app.config.get("REQUESTS_TIMEOUT", 5)))
+
+    failures = []
+    for job, result in zip(pending, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Failed to download image ({job.kind}) from {job.url}: {result!r}")
+            failures.append((job.url, result))
+            continue
+        if save:
+            job.path.write_bytes(result)
+        setattr(job.image, job.kind, result)
+
+    db.session.commit()
+    if failures:
+        raise ImageFetchError(failures)
+    return len(pending)
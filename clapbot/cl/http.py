@@ -0,0 +1,88 @@
+"""
+Pooled HTTP sessions for requests to craigslist.
+
+Every outbound request in :mod:`clapbot.cl` goes through a single
+:class:`requests.Session` per process, so that connections (and their DNS
+lookups and TLS handshakes) are kept alive and reused between tasks.
+"""
+import logging
+import os
+from collections import Counter
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from flask import current_app as app
+
+from .ratelimit import acquire
+
+__all__ = ['get_session', 'get', 'head', 'pool_stats']
+
+logger = logging.getLogger(__name__)
+
+
+def make_session(config):
+    """Create a session with connection pools sized from application configuration.
+
+    ``CRAIGSLIST_HTTP_POOL_CONNECTIONS`` is the number of hosts to keep pools for,
+    and ``CRAIGSLIST_HTTP_POOL_MAXSIZE`` is the number of connections kept open to
+    each host. When ``CRAIGSLIST_HTTP_POOL_BLOCK`` is set, that is also a hard limit
+    on concurrent connections to a single host.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=config['CRAIGSLIST_HTTP_POOL_CONNECTIONS'],
+        pool_maxsize=config['CRAIGSLIST_HTTP_POOL_MAXSIZE'],
+        pool_block=config['CRAIGSLIST_HTTP_POOL_BLOCK'])
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session():
+    """The HTTP session for the current application and process.
+
+    Sessions are never shared across a fork, since the connections in the pool
+    would then be shared by two processes.
+    """
+    pid, session = app.extensions.get('clapbot.http', (None, None))
+    if pid != os.getpid():
+        session = make_session(app.config)
+        app.extensions['clapbot.http'] = (os.getpid(), session)
+        logger.debug(f"Created HTTP session for process {os.getpid()}")
+    return session
+
+
+def get(url, **kwargs):
+    """Send a GET request with the pooled session, once the rate limiter allows it."""
+    kwargs.setdefault('timeout', app.config.get("REQUESTS_TIMEOUT", 5))
+    acquire(url)
+    return get_session().get(url, **kwargs)
+
+
+def head(url, **kwargs):
+    """Send a HEAD request with the pooled session, once the rate limiter allows it."""
+    kwargs.setdefault('timeout', app.config.get("REQUESTS_TIMEOUT", 5))
+    acquire(url)
+    return get_session().head(url, **kwargs)
+
+
+def pool_stats():
+    """Connection pool statistics for the current process, by host.
+
+    A request is a pool hit when it reuses an open connection, and a miss when
+    a new connection has to be made.
+    """
+    stats = {}
+    session = get_session()
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = stats.setdefault(f"{pool.scheme}://{pool.host}:{pool.port}", Counter())
+            host['requests'] += pool.num_requests
+            host['misses'] += pool.num_connections
+            host['hits'] += max(pool.num_requests - pool.num_connections, 0)
+    return {host: dict(counts) for host, counts in stats.items()}
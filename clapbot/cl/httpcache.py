@@ -0,0 +1,113 @@
+"""
+Conditional HTTP requests, with response bodies and validators kept on disk.
+
+Each cached body is stored with a small JSON sidecar holding the ``ETag`` and
+``Last-Modified`` headers it was served with. Later requests for the same URL
+send ``If-None-Match`` and ``If-Modified-Since``, and a ``304 Not Modified``
+response is answered from the stored body, without transferring it again.
+
+Pages which change rarely can also be given a time to live, during which the
+stored body is used without making a request at all.
+
+Nothing evicts stored bodies, so the cache is off unless ``CRAIGSLIST_HTTP_CACHE_ENABLE``
+is set. Without it, every request is made in full.
+"""
+import hashlib
+import json
+import logging
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from flask import current_app as app
+
+from . import http
+
+__all__ = ['CachedPage', 'get', 'cache_path_for']
+
+logger = logging.getLogger(__name__)
+
+
+class CachedPage(NamedTuple):
+    """A response answered from the cache.
+
+    The status code is 304 when the page was revalidated, and 200 when it was still fresh.
+    The content is None when the caller didn't need the stored body.
+    """
+    content: bytes
+    status_code: int
+
+    def raise_for_status(self):
+        pass
+
+
+def cache_path_for(url):
+    """A location for the cached body of a URL which doesn't have one of its own."""
+    digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return Path(app.config['CRAIGSLIST_CACHE_PATH']) / 'http' / digest[:2] / digest
+
+
+def _meta_path(path):
+    return path.with_name(path.name + '.http.json')
+
+
+def _load_meta(path):
+    meta_path = _meta_path(path)
+    if not (path.exists() and meta_path.exists()):
+        return None
+    try:
+        return json.loads(meta_path.read_text())
+    except ValueError:
+        logger.warning(f"Ignoring corrupt HTTP cache metadata at {meta_path}")
+        return None
+
+
+def _save(path, response):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(response.content)
+    meta = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'fetched_at': time.time(),
+    }
+    _meta_path(path).write_text(json.dumps(meta))
+
+
+def _touch(path, meta):
+    meta['fetched_at'] = time.time()
+    _meta_path(path).write_text(json.dumps(meta))
+
+
+def get(url, path=None, ttl=None, description="page", read_body=True):
+    """GET a URL, revalidating the body stored at ``path`` (if there is one).
+
+    Returns a :class:`CachedPage` when the stored body can be used, and otherwise the
+    response, whose body (if successful) is stored for next time. When ``ttl`` is given,
+    a body fetched less than ``ttl`` seconds ago is used without a request. Callers which
+    only need the status code can pass ``read_body=False`` to skip reading the stored body.
+    """
+    if not app.config['CRAIGSLIST_HTTP_CACHE_ENABLE']:
+        return http.get(url)
+
+    path = Path(path) if path is not None else cache_path_for(url)
+    meta = _load_meta(path)
+
+    headers = {}
+    if meta is not None:
+        if ttl is not None and time.time() - meta['fetched_at'] < ttl:
+            logger.info(f"Using fresh cached {description} for {url}.")
+            return CachedPage(path.read_bytes() if read_body else None, 200)
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    response = http.get(url, headers=headers)
+    if response.status_code == 304 and meta is not None:
+        logger.info(f"Cached {description} for {url} is unchanged.")
+        _touch(path, meta)
+        return CachedPage(path.read_bytes() if read_body else None, 304)
+
+    if response.ok:
+        _save(path, response)
+    return response
@@ -6,7 +6,10 @@ from pathlib import Path
 
 from flask import current_app as app
 
+import sqlalchemy as sa
+
 from ...core import db
+from ..blobstore import get_blob_store
 
 __all__ = ['images', 'Image']
 
@@ -16,6 +19,7 @@ images = db.Table(
     'images',
     db.Column('image_id', db.Integer, db.ForeignKey('image.id')),
     db.Column('listing_id', db.Integer, db.ForeignKey('listing.id')),
+    db.Index('ix_images_listing_id', 'listing_id'),
 )
 
 
@@ -24,8 +28,35 @@ class Image(db.Model):
     __tablename__ = 'image'
     id = db.Column(db.Integer, primary_key=True)
     url = db.Column(db.String, unique=True)
-    full = db.Column(db.LargeBinary)
-    thumbnail = db.Column(db.LargeBinary)
+
+    full_digest = db.Column(db.String(64))
+    full_size = db.Column(db.Integer)
+    thumbnail_digest = db.Column(db.String(64))
+    thumbnail_size = db.Column(db.Integer)
+
+    @property
+    def full(self):
+        """Full image data, from the blob store."""
+        if self.full_digest is None:
+            return None
+        return get_blob_store().get(self.full_digest)
+
+    @full.setter
+    def full(self, data):
+        self.full_digest = get_blob_store().put(data)
+        self.full_size = len(data)
+
+    @property
+    def thumbnail(self):
+        """Thumbnail image data, from the blob store."""
+        if self.thumbnail_digest is None:
+            return None
+        return get_blob_store().get(self.thumbnail_digest)
+
+    @thumbnail.setter
+    def thumbnail(self, data):
+        self.thumbnail_digest = get_blob_store().put(data)
+        self.thumbnail_size = len(data)
 
     @property
     def cache_path(self):
@@ -66,3 +97,60 @@ class Image(db.Model):
             scheme, netloc, path, query, fragment = url
             path = self.cl_id + "_50x50c.jpg"
             return urllib.parse.urlunsplit((scheme, netloc, path, query, fragment))
+
+
+#: The image table including the columns which held image data before the blob store.
+legacy_image_table = sa.table(
+    'image',
+    sa.column('id', sa.Integer),
+    sa.column('full', sa.LargeBinary),
+    sa.column('thumbnail', sa.LargeBinary),
+    sa.column('full_digest', sa.String),
+    sa.column('full_size', sa.Integer),
+    sa.column('thumbnail_digest', sa.String),
+    sa.column('thumbnail_size', sa.Integer),
+)
+
+
+def migrate_legacy_image_data(batch_size=100):
+    """Stream image data stored in the database into the blob store.
+
+    Rows are read with a server-side cursor, and the legacy columns are cleared as each
+    batch is written. Returns the number of images migrated.
+    """
+    table = legacy_image_table
+    store = get_blob_store()
+    query = sa.select([table.c.id, table.c.full, table.c.thumbnail]).where(
+        sa.or_(
+            sa.and_(table.c.full_digest.is_(None), table.c.full.isnot(None)),
+            sa.and_(table.c.thumbnail_digest.is_(None), table.c.thumbnail.isnot(None)),
+        ))
+    update = table.update().where(table.c.id == sa.bindparam('_id')).values(
+        full=None,
+        thumbnail=None,
+        full_digest=sa.func.coalesce(sa.bindparam('_full_digest'), table.c.full_digest),
+        full_size=sa.func.coalesce(sa.bindparam('_full_size'), table.c.full_size),
+        thumbnail_digest=sa.func.coalesce(sa.bindparam('_thumbnail_digest'), table.c.thumbnail_digest),
+        thumbnail_size=sa.func.coalesce(sa.bindparam('_thumbnail_size'), table.c.thumbnail_size))
+
+    n = 0
+    with db.engine.connect() as connection:
+        rows = connection.execution_options(stream_results=True).execute(query)
+        while True:
+            batch = rows.fetchmany(batch_size)
+            if not batch:
+                break
+            params = []
+            for (image_id, full, thumbnail) in batch:
+                params.append({
+                    '_id': image_id,
+                    '_full_digest': store.put(full) if full is not None else None,
+                    '_full_size': len(full) if full is not None else None,
+                    '_thumbnail_digest': store.put(thumbnail) if thumbnail is not None else None,
+                    '_thumbnail_size': len(thumbnail) if thumbnail is not None else None,
+                })
+            db.session.execute(update, params)
+            db.session.commit()
+            n += len(params)
+            logger.info(f"Migrated {n} images to {store!r}")
+    return n
@@ -0,0 +1,205 @@
+"""
+Bulk inserts for rows identified by unique columns, and get-or-create for tag names and image URLs.
+
+Ids are cached per worker process, so parsing a listing only touches the database
+for tags and images it hasn't seen before. Ids created in a transaction are only
+cached once it commits, so a rollback never leaves ids in the cache which don't exist.
+"""
+import collections
+import logging
+import os
+
+from flask import current_app as app
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm.util import identity_key
+
+from ...core import db
+from ..utils import chunked
+
+__all__ = ['KeyCache', 'get_or_create_ids', 'get_or_create_all', 'insert_ignore', 'upsert']
+
+logger = logging.getLogger(__name__)
+
+#: The most values to put in a single statement, which keeps under SQLite's bound parameter limit.
+CHUNK_SIZE = 500
+
+
+class KeyCache:
+    """A bounded cache of unique column values to row ids, for a single model."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._ids = collections.OrderedDict()
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get(self, values):
+        """Cached ids for values, skipping values which aren't cached."""
+        found = {}
+        for value in values:
+            if value in self._pending:
+                found[value] = self._pending[value]
+            elif value in self._ids:
+                self._ids.move_to_end(value)
+                found[value] = self._ids[value]
+        return found
+
+    def add(self, ids, pending=False):
+        """Cache ids. Pending ids are held until the transaction which created them commits."""
+        if pending:
+            self._pending.update(ids)
+            return
+        self._ids.update(ids)
+        while len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+
+    def commit(self):
+        """The transaction committed, so pending ids can be cached."""
+        self.add(self._pending)
+        self._pending = {}
+
+    def rollback(self):
+        """The transaction rolled back, so pending ids are discarded."""
+        self._pending = {}
+
+
+def _caches():
+    pid, caches = app.extensions.get('clapbot.keys', (None, None))
+    if pid != os.getpid():
+        caches = {}
+        app.extensions['clapbot.keys'] = (os.getpid(), caches)
+    return caches
+
+
+def get_cache(model):
+    """The id cache for a model, in the current application and process."""
+    caches = _caches()
+    cache = caches.get(model.__tablename__)
+    if cache is None:
+        cache = caches[model.__tablename__] = KeyCache(app.config['CRAIGSLIST_KEY_CACHE_SIZE'])
+    return cache
+
+
+def _select_ids(model, column, values):
+    found = {}
+    for chunk in chunked(values, CHUNK_SIZE):
+        found.update(db.session.query(column, model.id).filter(column.in_(chunk)))
+    return found
+
+
+def insert_ignore(table, rows, index_elements, returning=()):
+    """Insert rows, skipping those which conflict with an existing row on ``index_elements``.
+
+    On PostgreSQL, the ``returning`` columns of inserted rows are returned. Other databases
+    return nothing, so callers have to query for inserted rows themselves.
+    """
+    dialect = db.session.get_bind().dialect.name
+    inserted = []
+    for chunk in chunked(rows, CHUNK_SIZE):
+        if dialect == 'postgresql':
+            insert = postgresql.insert(table).values(chunk).on_conflict_do_nothing(index_elements=index_elements)
+            if returning:
+                inserted.extend(db.session.execute(insert.returning(*returning)))
+            else:
+                db.session.execute(insert)
+            continue
+        insert = table.insert()
+        if dialect == 'sqlite':
+            insert = insert.prefix_with('OR IGNORE')
+        db.session.execute(insert.values(chunk))
+    return inserted
+
+
+def upsert(table, rows, index_elements, update_columns):
+    """Insert rows, updating ``update_columns`` of rows which conflict with an existing row on ``index_elements``.
+
+    PostgreSQL does this with ``INSERT ... ON CONFLICT DO UPDATE``. Other databases insert the
+    new rows, then update every row with ``executemany``.
+    """
+    dialect = db.session.get_bind().dialect.name
+    key = sa.and_(*(table.c[column] == sa.bindparam(f"_{column}") for column in index_elements))
+    update = table.update().where(key).values({column: sa.bindparam(f"_{column}") for column in update_columns})
+    for chunk in chunked(rows, CHUNK_SIZE):
+        if dialect == 'postgresql':
+            insert = postgresql.insert(table).values(chunk)
+            excluded = {column: insert.excluded[column] for column in update_columns}
+            db.session.execute(insert.on_conflict_do_update(index_elements=index_elements, set_=excluded))
+            continue
+        insert_ignore(table, chunk, index_elements)
+        db.session.execute(update, [{f"_{column}": value for column, value in row.items()} for row in chunk])
+
+
+def _insert_missing(table, column, values):
+    """Insert rows for values, ignoring those which already exist. Returns ids where the database can."""
+    rows = [{column.key: value} for value in values]
+    return dict(insert_ignore(table, rows, [column.key], returning=(table.c[column.key], table.c.id)))
+
+
+def get_or_create_ids(model, column, values):
+    """Map values of a unique column to row ids, inserting rows for values which don't exist yet.
+
+    This takes at most three queries (per :data:`CHUNK_SIZE` values) however many values are given:
+    one to find existing rows, one to insert the missing rows, and one to find ids for inserted rows.
+    """
+    values = set(values)
+    if not values:
+        return {}
+    cache = get_cache(model)
+    found = cache.get(values)
+
+    missing = values - found.keys()
+    if missing:
+        existing = _select_ids(model, column, missing)
+        cache.add(existing, pending=True)
+        found.update(existing)
+        missing -= existing.keys()
+
+    if missing:
+        inserted = _insert_missing(model.__table__, column, missing)
+        missing -= inserted.keys()
+        if missing:
+            # Another worker may have inserted some of these rows at the same time.
+            inserted.update(_select_ids(model, column, missing))
+        logger.debug(f"Created {len(inserted)} {model.__tablename__} rows")
+        cache.add(inserted, pending=True)
+        found.update(inserted)
+    return found
+
+
+def get_or_create_all(model, column, values):
+    """Map values of a unique column to instances, creating rows for values which don't exist yet."""
+    ids = get_or_create_ids(model, column, values)
+    if not ids:
+        return {}
+    # Instances already in the session don't need to be loaded again.
+    instances = {}
+    for row_id in ids.values():
+        instance = db.session.identity_map.get(identity_key(model, row_id))
+        if instance is not None:
+            instances[row_id] = instance
+    missing = [row_id for row_id in ids.values() if row_id not in instances]
+    for chunk in chunked(missing, CHUNK_SIZE):
+        instances.update((instance.id, instance) for instance in model.query.filter(model.id.in_(chunk)))
+    return {value: instances[row_id] for value, row_id in ids.items()}
+
+
+def _commit(session):
+    # pylint: disable=unused-argument
+    if app:
+        for cache in _caches().values():
+            cache.commit()
+
+
+def _rollback(session, previous_transaction):
+    # pylint: disable=unused-argument
+    if app:
+        for cache in _caches().values():
+            cache.rollback()
+
+
+sa.event.listen(db.session, 'after_commit', _commit)
+sa.event.listen(db.session, 'after_soft_rollback', _rollback)
@@ -5,12 +5,13 @@ from pathlib import Path
 
 from flask import current_app as app
 
-from bs4 import BeautifulSoup
-
-from sqlalchemy.orm import validates
+from sqlalchemy.orm import validates, deferred
 from sqlalchemy.types import BigInteger
 
 from . import site, image
+from .types import CompressedText
+from .keys import get_or_create_all
+from ..parse import parse_listing
 
 from ...utils import coord_distance
 from ...core import db
@@ -23,9 +24,24 @@ tags = db.Table(
     'tags',
     db.Column('tag_id', db.Integer, db.ForeignKey('tag.id')),
     db.Column('listing_id', db.Integer, db.ForeignKey('listing.id')),
+    db.Index('ix_tags_listing_id', 'listing_id'),
 )
 
 
+def parse_datetime(value):
+    """Parse a craigslist datetime."""
+    if isinstance(value, dt.datetime):
+        return value
+    return dt.datetime.strptime(value, "%Y-%m-%d %H:%M")
+
+
+def parse_price(value):
+    """Parse a craigslist price."""
+    if value is None or isinstance(value, float):
+        return value
+    return float(value.replace("$", ""))
+
+
 class Tag(db.Model):
     """A simple craigslist tag."""
     __tablename__ = 'tag'
@@ -82,13 +98,39 @@ class Listing(db.Model):
     size = db.Column(db.Float)
 
     text = db.Column(db.Text)
-    page = db.Column(db.Text)
+
+    #: The raw page is only needed for parsing, so it is never loaded with the listing.
+    page = deferred(db.Column(CompressedText('CRAIGSLIST_COMPRESS_PAGES')))
 
     tags = db.relationship(Tag, secondary=tags, backref=db.backref('listings', lazy='dynamic'))
     images = db.relationship(image.Image, secondary=image.images, backref=db.backref('listings', lazy='dynamic'))
 
     notified = db.Column(db.Boolean, default=False)
 
+    #: When this listing was last checked for expiration, and the status code of that check.
+    last_checked_at = db.Column(db.DateTime)
+    last_status = db.Column(db.Integer)
+
+    __table_args__ = (
+        # Listing feeds, sorted by creation time.
+        db.Index('ix_listing_created', created),
+        # Housing search predicates: equality on area and category, range on price.
+        db.Index('ix_listing_area_category_price', cl_area, cl_category, price),
+        # Geographic predicates: range on latitude, then longitude.
+        db.Index('ix_listing_lat_lon', lat, lon),
+        # Listings which haven't expired, never checked and then least recently checked first, for expiration checks.
+        db.Index(
+            'ix_listing_unexpired_last_checked',
+            last_checked_at.isnot(None),
+            last_checked_at,
+            postgresql_where=expired.is_(None)),
+        # Listings which still need a notification.
+        db.Index(
+            'ix_listing_unnotified_created',
+            created,
+            postgresql_where=db.and_(~notified, transit_stop_id.isnot(None))),
+    )
+
     def __init__(self, **kwargs):
         super().__init__(**site.Area._handle_kwargs(kwargs))
 
@@ -103,7 +145,12 @@ class Listing(db.Model):
     @property
     def cache_path(self):
         """Where to find cached listings"""
-        path = Path(app.config['CRAIGSLIST_CACHE_PATH']) / 'listings' / '{}'.format(self.cl_id)[:3]
+        return self.cache_path_for(self.cl_id)
+
+    @staticmethod
+    def cache_path_for(cl_id):
+        """Where to find cached listings for a craigslist identifier."""
+        path = Path(app.config['CRAIGSLIST_CACHE_PATH']) / 'listings' / '{}'.format(cl_id)[:3]
         path.mkdir(parents=True, exist_ok=True)
         return path
 
@@ -128,10 +175,10 @@ class Listing(db.Model):
         """Validate a craigslist site"""
         # pylint: disable=unused-argument
         if value is not None and not isinstance(value, site.Site):
-            value = site.Site.query.filter_by(name=value.lower()).one_or_none()
+            value = site.get_registry().site(value)
         if value is None:
             raise ValueError("Invalid craigslist site")
-        if self.area is not None and self.area not in value.areas:
+        if self.area is not None and self.area.site_id != value.id:
             raise ValueError(f"Invalid area, must be a member of {value}")
         return value
 
@@ -140,12 +187,12 @@ class Listing(db.Model):
         """Validate a craigslist area"""
         # pylint: disable=unused-argument
         if not isinstance(value, site.Area):
-            value = site.Area.query.filter_by(name=value.lower(), site=self.site).one_or_none()
+            value = site.get_registry().area(value, site=self.site) if self.site is not None else None
             if value is None:
                 raise ValueError("Invalid craigslist area")
         if self.site is None:
             self.site = value.site
-        elif value not in self.site.areas:
+        elif value.site_id != self.site.id:
             raise ValueError(f"Invalid area, must be a member of {self.site}")
         return value
 
@@ -155,7 +202,7 @@ class Listing(db.Model):
         # pylint: disable=unused-argument
         if isinstance(value, site.Category):
             return value
-        value = site.Category.query.filter_by(name=value.lower()).one_or_none()
+        value = site.get_registry().category(value)
         if value is None:
             raise ValueError("Invalid craigslist category")
         return value
@@ -164,9 +211,7 @@ class Listing(db.Model):
     def validate_datetime(self, key, value):
         """Validate a datetime"""
         # pylint: disable=unused-argument
-        if isinstance(value, dt.datetime):
-            return value
-        return dt.datetime.strptime(value, "%Y-%m-%d %H:%M")
+        return parse_datetime(value)
 
     @validates("available")
     def validate_date(self, key, value):
@@ -180,9 +225,7 @@ class Listing(db.Model):
     def validate_price(self, key, value):
         """Validate price."""
         # pylint: disable=unused-argument
-        if isinstance(value, float):
-            return value
-        return float(value.replace("$", ""))
+        return parse_price(value)
 
     @validates('images')
     def validate_images(self, key, url):
@@ -190,12 +233,7 @@ class Listing(db.Model):
         # pylint: disable=unused-argument
         if isinstance(url, image.Image):
             return url
-        img = image.Image.query.filter_by(url=url).one_or_none()
-        if img is not None:
-            return img
-        img = image.Image(url=url)
-        db.session.add(img)
-        return img
+        return get_or_create_all(image.Image, image.Image.url, [url])[url]
 
     @validates('tags')
     def validate_tags(self, key, name):
@@ -203,12 +241,7 @@ class Listing(db.Model):
         # pylint: disable=unused-argument
         if isinstance(name, Tag):
             return name
-        tag = Tag.query.filter_by(name=name).one_or_none()
-        if tag is not None:
-            return tag
-        tag = Tag(name=name)
-        db.session.add(tag)
-        return tag
+        return get_or_create_all(Tag, Tag.name, [name])[name]
 
     def to_json(self):
         """Return the JSON-compatible structure which could create this object."""
@@ -227,8 +260,8 @@ class Listing(db.Model):
         return result
 
     @classmethod
-    def from_result(cls, result):
-        """Construct this object from a result."""
+    def _result_kwargs(cls, result):
+        """Translate a scraped result into keyword arguments for this object."""
         kwargs = dict(**result)
         if kwargs.get('geotag', None) is not None:
             kwargs['lat'], kwargs['lon'] = result['geotag']
@@ -238,63 +271,76 @@ class Listing(db.Model):
         for key in list(kwargs.keys()):
             if not hasattr(cls, key):
                 del kwargs[key]
-        return cls(**kwargs)
+        return kwargs
+
+    @classmethod
+    def from_result(cls, result):
+        """Construct this object from a result."""
+        return cls(**cls._result_kwargs(result))
+
+    @classmethod
+    def mapping_from_result(cls, result, registry=None):
+        """Construct column values for a bulk insert from a result.
+
+        Sites, areas and categories are resolved with the site registry. Results without
+        an area get a NULL area.
+        """
+        registry = registry or site.get_registry()
+        kwargs = cls._result_kwargs(result)
+        cl_site = registry.site(kwargs.pop('site', None) or '')
+        if cl_site is None:
+            raise ValueError("Invalid craigslist site")
+        kwargs['cl_site'] = cl_site.id
+        area = kwargs.pop('area', None)
+        kwargs['cl_area'] = None
+        if area:
+            cl_area = registry.area(area, site=cl_site)
+            if cl_area is None:
+                raise ValueError("Invalid craigslist area")
+            kwargs['cl_area'] = cl_area.id
+        category = registry.category(kwargs.pop('category', None) or '')
+        if category is None:
+            raise ValueError("Invalid craigslist category")
+        kwargs['cl_category'] = category.id
+        kwargs['cl_id'] = int(kwargs['cl_id'])
+        kwargs['created'] = parse_datetime(kwargs['created'])
+        if 'price' in kwargs:
+            kwargs['price'] = parse_price(kwargs['price'])
+        return kwargs
 
     def parse_html(self, content):
         """Parse HTML content from a CL page."""
-        soup = BeautifulSoup(content, 'html.parser')
+        fields = parse_listing(content, app.config['CRAIGSLIST_HTML_PARSER'])
         self.page = content
 
-        # Extract geotag:
-        map_tag = soup.find('div', {'id': 'map'})
-        if map_tag:
-            self.lat, self.lon = (float(map_tag.attrs['data-latitude']), float(map_tag.attrs['data-longitude']))
-
-        # Extract images:
-        images_div = soup.find("div", {'id': 'thumbs'})
-        if images_div is not None:
-            for img in images_div.find_all('a', {'class', 'thumb'}):
-                url = img.attrs['href']
-                if not any(url == image.url for image in self.images):
-                    self.images.append(url)
-        if not self.images:
-            gallery_image = soup.find("div", {'class': 'gallery'})
-            for img in gallery_image.find_all('img'):
-                url = img.attrs['src']
-                if not any(url == image.url for image in self.images):
-                    self.images.append(url)
+        if fields.lat is not None:
+            self.lat, self.lon = fields.lat, fields.lon
+
+        # Prefer thumbnail links, and fall back to gallery images.
+        known = {image.url for image in self.images}
+        urls = [url for url in fields.thumbnails if url not in known]
+        if not urls and not known:
+            urls = list(fields.gallery)
+        if urls:
+            by_url = get_or_create_all(image.Image, image.Image.url, urls)
+            self.images.extend(by_url[url] for url in urls)
         if not self.images:
             logger.warning("No images found for {0}".format(self))
         else:
             logger.info("Added {} images to {}".format(len(self.images), self))
 
-        # Extract text
-        self.text = soup.find("section", {'id': 'postingbody'}).text
-
-        # Extract tags
-        for attrgroup in soup.find('div', {'class': 'mapAndAttrs'}).find_all('p', {'class': 'attrgroup'}):
-            for attr in attrgroup.find_all('span'):
-                if 'class' in attr.attrs and 'property_date' in attr['class']:
-                    self.available = dt.datetime.strptime(attr['data-date'], "%Y-%m-%d").date()
-                    continue
-
-                if attr.text.endswith('ft2'):
-                    try:
-                        self.size = float(attr.text[:-3])
-                    except ValueError:
-                        logger.warning("Can't parse size tag {0}.".format(attr.text), exc_info=True)
-                elif all(s in attr.text.lower() for s in ("/", "br", "ba")):
-                    bedrooms, baths = attr.text.split("/", 1)
-                    try:
-                        self.bedrooms = int(bedrooms.lower().replace("br", "").strip())
-                    except ValueError:
-                        logger.warning("Can't parse bedroom tag {0}.".format(attr.text), exc_info=True)
-                    try:
-                        self.bathrooms = float(baths.lower().replace("ba", "").strip())
-                    except ValueError:
-                        logger.warning("Can't parse bathroom tag {0}.".format(attr.text), exc_info=True)
-                elif not any(attr.text == tag.name for tag in self.tags):
-                    self.tags.append(attr.text)
+        self.text = fields.text
+
+        for name in ('available', 'size', 'bedrooms', 'bathrooms'):
+            value = getattr(fields, name)
+            if value is not None:
+                setattr(self, name, value)
+
+        known = {tag.name for tag in self.tags}
+        names = [name for name in fields.tags if name not in known]
+        if names:
+            by_name = get_or_create_all(Tag, Tag.name, names)
+            self.tags.extend(by_name[name] for name in names)
 
 
 class ListingExpirationCheck(db.Model):
@@ -306,3 +352,17 @@ class ListingExpirationCheck(db.Model):
 
     created = db.Column(db.DateTime)
     response_status = db.Column(db.Integer)
+
+    __table_args__ = (db.Index('ix_listingexpirationcheck_listing_created', listing_id, created), )
+
+
+class ListingExpirationSummary(db.Model):
+    """Expiration checks for a listing which have been compacted, rolled up into counts."""
+    __tablename__ = 'listingexpirationsummary'
+
+    listing_id = db.Column(db.Integer, db.ForeignKey('listing.id'), primary_key=True)
+
+    first_checked_at = db.Column(db.DateTime)
+    last_checked_at = db.Column(db.DateTime)
+    checks = db.Column(db.Integer, default=0)
+    missing = db.Column(db.Integer, default=0)
@@ -2,13 +2,16 @@ import logging
 import enum
 import datetime as dt
 
+from sqlalchemy import and_, or_, bindparam
 from sqlalchemy.orm import validates
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.types import BigInteger
 
 from . import site
+from .keys import insert_ignore
 from ...core import db
 
-__all__ = ['Status', 'Record']
+__all__ = ['Status', 'Record', 'ScrapeMark']
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +43,9 @@ class Record(db.Model):
     result = db.Column(db.String(255))
     records = db.Column(db.Integer(), default=0)
 
+    #: Where the mark can move to after a scrape, see :meth:`scraper`.
+    mark = None
+
     def __init__(self, **kwargs):
         super().__init__(**site.Area._handle_kwargs(kwargs))
 
@@ -47,13 +53,34 @@ class Record(db.Model):
         return "Record(id={}, stie={}, area={}, category={}, status={})".format(self.id, self.site.name, self.area.name,
                                                                                 self.category.name, self.status)
 
-    def scraper(self, filters=None, limit=None):
-        from ..scrape import make_scraper
+    def scraper(self, filters=None, limit=None, incremental=True):
+        """Scrape results for this record.
+
+        Incremental scrapes stop at the newest listing already seen in this area and category
+        by a scrape with the same filters.
+        Once every result has been taken, :attr:`mark` is the ``(posted_at, cl_id)`` position
+        which the mark can move forward to, or None when it has to stay where it is: when the
+        scrape stopped at ``limit`` before reaching the mark, listings in between weren't
+        scraped, and moving the mark past them would mean they never are.
+        """
+        from ..scrape import make_scraper, filters_key, position, reached
+        since = ScrapeMark.since(self.cl_area, self.cl_category, filters_key(filters)) if incremental else None
+        self.mark = newest = None
         for result in make_scraper(
-                site=self.site.name, area=self.area.name, category=self.category.name, filters=filters, limit=limit):
+                site=self.site.name, area=self.area.name, category=self.category.name, filters=filters,
+                limit=limit):
+            if since is not None and reached(result, since):
+                logger.info(f"Reached known listings in {self.area.name}/{self.category.name} at {result['id']}")
+                self.mark = newest
+                return
+            newest = max(newest, position(result)) if newest is not None else position(result)
             self.records += 1
             yield result
 
+        if incremental and since is None:
+            # Scrapes without a mark never get past the limit either, so this loses nothing.
+            self.mark = newest
+
     def mark_celery_result(self, result):
         result.save()
         self.scraped_at = dt.datetime.now()
@@ -66,7 +93,84 @@ class Record(db.Model):
         # pylint: disable=unused-argument
         if isinstance(value, site.Category):
             return value
-        value = site.Category.query.filter_by(name=value.lower()).one_or_none()
+        value = site.get_registry().category(value)
         if value is None:
             raise ValueError("Invalid craigslist category")
-        return value
\ No newline at end of file
+        return value
+
+
+class ScrapeMark(db.Model):
+    """The newest listing seen in an area and category, where incremental scrapes stop.
+
+    Each set of filters has its own mark, since a scrape only sees the listings which pass
+    its filters. Otherwise a narrow scrape would move the mark past listings which only a
+    wider scrape would have found.
+    """
+    __tablename__ = 'scrapemark'
+    id = db.Column(db.Integer(), primary_key=True)
+
+    cl_area = db.Column(db.Integer(), db.ForeignKey('clarea.id'), nullable=False)
+    cl_category = db.Column(db.Integer(), db.ForeignKey('clcategory.id'), nullable=False)
+    filters = db.Column(db.String(255), nullable=False)
+
+    cl_id = db.Column(BigInteger, nullable=False)
+    posted_at = db.Column(db.DateTime(), nullable=False)
+    updated_at = db.Column(db.DateTime(), default=dt.datetime.now, onupdate=dt.datetime.now)
+
+    __table_args__ = (db.UniqueConstraint('cl_area', 'cl_category', 'filters',
+                                          name='uq_scrapemark_area_category_filters'), )
+
+    def __repr__(self):
+        return f"ScrapeMark(area={self.cl_area}, category={self.cl_category}, filters={self.filters}, " \
+               f"cl_id={self.cl_id}, posted_at={self.posted_at})"
+
+    @classmethod
+    def since(cls, area_id, category_id, filters):
+        """The ``(posted_at, cl_id)`` where scrapes of an area and category with some filters stop, or None."""
+        row = db.session.query(cls.posted_at, cls.cl_id).filter_by(cl_area=area_id, cl_category=category_id,
+                                                                   filters=filters).first()
+        return tuple(row) if row is not None else None
+
+    @classmethod
+    def advance(cls, listings, filters):
+        """Move the marks for scrapes with some filters forward past listings.
+
+        Listings are given as mappings with area, category, created and cl_id. Marks only
+        ever move forward, so concurrent scrapes can't move a mark back.
+        """
+        newest = {}
+        for listing in listings:
+            if listing['cl_area'] is None:
+                continue
+            key = (listing['cl_area'], listing['cl_category'])
+            position = (listing['created'], listing['cl_id'])
+            if key not in newest or position > newest[key]:
+                newest[key] = position
+        if not newest:
+            return
+
+        now = dt.datetime.now()
+        table = cls.__table__
+        insert_ignore(table, [{
+            'cl_area': area_id,
+            'cl_category': category_id,
+            'filters': filters,
+            'cl_id': cl_id,
+            'posted_at': posted_at,
+            'updated_at': now
+        } for (area_id, category_id), (posted_at, cl_id) in newest.items()], ['cl_area', 'cl_category', 'filters'])
+
+        update = table.update().where(
+            and_(
+                table.c.cl_area == bindparam('_area'), table.c.cl_category == bindparam('_category'),
+                table.c.filters == filters,
+                or_(
+                    table.c.posted_at < bindparam('_posted_at'),
+                    and_(table.c.posted_at == bindparam('_posted_at'), table.c.cl_id < bindparam('_cl_id'))))).values(
+                        cl_id=bindparam('_cl_id'), posted_at=bindparam('_posted_at'), updated_at=now)
+        db.session.execute(update, [{
+            '_area': area_id,
+            '_category': category_id,
+            '_cl_id': cl_id,
+            '_posted_at': posted_at
+        } for (area_id, category_id), (posted_at, cl_id) in newest.items()])
@@ -1,10 +1,18 @@
+import collections
 import logging
+import time
 
+from flask import current_app as app
+
+from sqlalchemy import inspect
 from sqlalchemy.orm import validates
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.exc import MultipleResultsFound
+from sqlalchemy.orm.session import make_transient_to_detached
 
 from ...core import db
 
-__all__ = ['Site', 'Area', 'Category']
+__all__ = ['Site', 'Area', 'Category', 'SiteRegistry', 'get_registry', 'invalidate_registry']
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +23,8 @@ class Site(db.Model):
     name = db.Column(db.String(255))
     enabled = db.Column(db.Boolean())
 
+    __table_args__ = (db.UniqueConstraint('name', name='uq_clsite_name'), )
+
     def __str__(self):
         return self.name.upper()
 
@@ -31,7 +41,7 @@ class Site(db.Model):
         # pylint: disable=unused-argument
         if isinstance(name, Area):
             return name
-        area = Area.query.filter_by(name=name, site=self).one_or_none()
+        area = get_registry().area(name, site=self)
         if area is not None:
             return area
         area = Area(name=name, site=self)
@@ -46,11 +56,13 @@ class Area(db.Model):
     site = db.relationship('Site', backref=db.backref('areas', uselist=True))
     name = db.Column(db.String(255))
 
+    __table_args__ = (db.UniqueConstraint('site_id', 'name', name='uq_clarea_site_id_name'), )
+
     def __str__(self):
         return self.name.upper()
 
     def __repr__(self):
-        return f"Area(name={self.name.upper()!r}, site={self.stie.name.upper()!r})"
+        return f"Area(name={self.name.upper()!r}, site={self.site.name.upper()!r})"
 
     @classmethod
     def _handle_kwargs(cls, kwargs):
@@ -64,12 +76,7 @@ class Area(db.Model):
 
     @classmethod
     def _lookup(cls, name, site=None):
-        q = cls.query.filter_by(name=name)
-        if isinstance(site, Site):
-            q = q.filter(cls.site_id == site.id)
-        elif site is not None:
-            q = q.join(Site).filter(Site.name == site)
-        return q.one_or_none()
+        return get_registry().area(name, site=site)
 
 
 class Category(db.Model):
@@ -83,3 +90,121 @@ class Category(db.Model):
 
     def __repr__(self):
         return f"Category(name={self.name!r}, description={self.description!r})"
+
+
+def _detached(model, row):
+    """A detached instance with loaded columns, which can be merged into any session without a query."""
+    instance = model(**row)
+    make_transient_to_detached(instance)
+    return instance
+
+
+class SiteRegistry:
+    """Sites, areas and categories by name, loaded together and shared by every session in a process.
+
+    The registry holds detached instances, and merges them into the current session on lookup,
+    so resolving a name doesn't touch the database. Names which aren't in the registry fall back
+    to a query, and invalidate the registry when they turn out to exist.
+    """
+
+    def __init__(self, sites, areas, categories, ttl=300):
+        self.loaded_at = time.monotonic()
+        self.ttl = ttl
+        self.sites = {site.name: site for site in sites}
+        self.sites_by_id = {site.id: site for site in sites}
+        self.areas = {(area.site_id, area.name): area for area in areas}
+        self.areas_by_name = collections.defaultdict(list)
+        for area in areas:
+            self.areas_by_name[area.name].append(area)
+        self.categories = {category.name: category for category in categories}
+
+    def __repr__(self):
+        return (f"SiteRegistry(sites={len(self.sites)}, areas={len(self.areas)}, "
+                f"categories={len(self.categories)})")
+
+    @classmethod
+    def load(cls, ttl=300):
+        """Load every site, area and category."""
+        sites = [_detached(Site, row._asdict()) for row in db.session.query(Site.id, Site.name, Site.enabled)]
+        areas = [_detached(Area, row._asdict()) for row in db.session.query(Area.id, Area.site_id, Area.name)]
+        categories = [
+            _detached(Category, row._asdict())
+            for row in db.session.query(Category.id, Category.name, Category.description)
+        ]
+        return cls(sites, areas, categories, ttl=ttl)
+
+    @property
+    def expired(self):
+        """Whether the registry should be reloaded."""
+        return time.monotonic() - self.loaded_at > self.ttl
+
+    @staticmethod
+    def _merge(instance):
+        if instance is None:
+            return None
+        return db.session.merge(instance, load=False)
+
+    def site(self, name):
+        """Find a site by name."""
+        name = name.lower()
+        site = self.sites.get(name)
+        if site is None:
+            return self._miss(Site.query.filter_by(name=name).one_or_none())
+        return self._merge(site)
+
+    def area(self, name, site=None):
+        """Find an area by name, optionally in a site (given as a name or :class:`Site`)."""
+        name = name.lower()
+        if site is None:
+            areas = self.areas_by_name.get(name, [])
+            if len(areas) > 1:
+                raise MultipleResultsFound(f"Area {name} is in more than one site, and no site was given")
+            area = areas[0] if areas else None
+        else:
+            site_id = site.id if isinstance(site, Site) else getattr(self.sites.get(site.lower()), 'id', None)
+            area = self.areas.get((site_id, name))
+
+        if area is None:
+            query = Area.query.filter_by(name=name)
+            if isinstance(site, Site):
+                query = query.filter(Area.site_id == site.id)
+            elif site is not None:
+                query = query.join(Site).filter(Site.name == site.lower())
+            return self._miss(query.one_or_none())
+        area = self._merge(area)
+        if 'site' in inspect(area).unloaded:
+            # Load the site from the registry too, so that ``area.site`` doesn't need a query.
+            set_committed_value(area, 'site', self._merge(self.sites_by_id.get(area.site_id)))
+        return area
+
+    def category(self, name):
+        """Find a category by name."""
+        name = name.lower()
+        category = self.categories.get(name)
+        if category is None:
+            return self._miss(Category.query.filter_by(name=name).one_or_none())
+        return self._merge(category)
+
+    @staticmethod
+    def _miss(instance):
+        if instance is not None:
+            logger.debug(f"{instance!r} was missing from the site registry")
+            invalidate_registry()
+        return instance
+
+
+def get_registry():
+    """The site registry for the current application, reloaded once it is older than its TTL."""
+    registry = app.extensions.get('clapbot.sites')
+    if registry is None or registry.expired:
+        registry = app.extensions['clapbot.sites'] = SiteRegistry.load(app.config['CRAIGSLIST_SITE_REGISTRY_TTL'])
+        logger.debug(f"Loaded {registry!r}")
+    return registry
+
+
+def invalidate_registry():
+    """Discard the site registry for the current application, after sites, areas or categories change.
+
+    Other processes will pick up the change when their registry expires.
+    """
+    app.extensions.pop('clapbot.sites', None)
@@ -0,0 +1,46 @@
+import base64
+import zlib
+
+from flask import current_app as app, has_app_context
+from sqlalchemy.types import TypeDecorator, Text
+
+__all__ = ['CompressedText']
+
+
+class CompressedText(TypeDecorator):
+    """Text which is optionally stored compressed.
+
+    Values are compressed on write when the ``setting`` configuration value is enabled,
+    and are stored as base64 with a marker prefix, so that compressed and plain values
+    can live in the same column. Reads handle both.
+
+    Pages are downloaded as bytes, which are stored as UTF-8 text. Rows written as bytes
+    (as SQLite does when given them) are decoded when they are read.
+    """
+
+    impl = Text
+
+    #: Prefix which marks a compressed value.
+    marker = 'zlib+base64:'
+
+    def __init__(self, setting, *args, **kwargs):
+        self.setting = setting
+        super().__init__(*args, **kwargs)
+
+    @staticmethod
+    def _text(value):
+        if isinstance(value, bytes):
+            return value.decode('utf-8', errors='replace')
+        return value
+
+    def process_bind_param(self, value, dialect):
+        value = self._text(value)
+        if value is None or not (has_app_context() and app.config.get(self.setting, False)):
+            return value
+        return self.marker + base64.b64encode(zlib.compress(value.encode('utf-8'))).decode('ascii')
+
+    def process_result_value(self, value, dialect):
+        value = self._text(value)
+        if value is None or not value.startswith(self.marker):
+            return value
+        return zlib.decompress(base64.b64decode(value[len(self.marker):])).decode('utf-8')
@@ -0,0 +1,192 @@
+"""
+Extract listing fields from craigslist listing pages.
+
+Parsing is done by a backend, chosen with ``CRAIGSLIST_HTML_PARSER``:
+
+- ``html.parser``: BeautifulSoup with the standard library parser, which only
+  builds the parts of the tree which hold listing fields.
+- ``lxml``: lxml with XPath queries, which is much faster, but needs lxml.
+
+Every backend returns the same :class:`ListingFields`.
+"""
+import datetime as dt
+import logging
+from typing import NamedTuple, Optional, List
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml.html
+except ImportError:    # pragma: no cover
+    lxml = None
+
+__all__ = ['ListingFields', 'parse_listing', 'PARSERS']
+
+logger = logging.getLogger(__name__)
+
+#: Element ids and classes which contain the fields we extract.
+FIELD_IDS = frozenset(('map', 'thumbs', 'postingbody'))
+FIELD_CLASSES = frozenset(('gallery', 'mapAndAttrs'))
+
+
+class ListingFields(NamedTuple):
+    """Fields extracted from a listing page."""
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    thumbnails: List[str] = []
+    gallery: List[str] = []
+    text: Optional[str] = None
+    available: Optional[dt.date] = None
+    size: Optional[float] = None
+    bedrooms: Optional[int] = None
+    bathrooms: Optional[float] = None
+    tags: List[str] = []
+
+
+def _unique(items):
+    return list(dict.fromkeys(items))
+
+
+def _parse_attributes(spans):
+    """Parse the attribute spans in the map and attributes box.
+
+    Spans are given as ``(text, classes, attributes)``.
+    """
+    fields = {'tags': []}
+    for text, classes, attrs in spans:
+        if 'property_date' in classes:
+            fields['available'] = dt.datetime.strptime(attrs['data-date'], "%Y-%m-%d").date()
+            continue
+
+        if text.endswith('ft2'):
+            try:
+                fields['size'] = float(text[:-3])
+            except ValueError:
+                logger.warning("Can't parse size tag {0}.".format(text), exc_info=True)
+        elif all(s in text.lower() for s in ("/", "br", "ba")):
+            bedrooms, baths = text.split("/", 1)
+            try:
+                fields['bedrooms'] = int(bedrooms.lower().replace("br", "").strip())
+            except ValueError:
+                logger.warning("Can't parse bedroom tag {0}.".format(text), exc_info=True)
+            try:
+                fields['bathrooms'] = float(baths.lower().replace("ba", "").strip())
+            except ValueError:
+                logger.warning("Can't parse bathroom tag {0}.".format(text), exc_info=True)
+        else:
+            fields['tags'].append(text)
+    fields['tags'] = _unique(fields['tags'])
+    return fields
+
+
+def _has_field(name, attrs):
+    """Match elements which contain listing fields, for :class:`SoupStrainer`."""
+    if attrs.get('id') in FIELD_IDS:
+        return True
+    classes = attrs.get('class') or ()
+    if isinstance(classes, str):
+        classes = classes.split()
+    return not FIELD_CLASSES.isdisjoint(classes)
+
+
+def parse_soup(soup):
+    """Extract listing fields from a BeautifulSoup tree."""
+    fields = {}
+
+    map_tag = soup.find('div', {'id': 'map'})
+    if map_tag:
+        fields['lat'] = float(map_tag.attrs['data-latitude'])
+        fields['lon'] = float(map_tag.attrs['data-longitude'])
+
+    thumbs = soup.find("div", {'id': 'thumbs'})
+    if thumbs is not None:
+        fields['thumbnails'] = _unique(a.attrs['href'] for a in thumbs.find_all('a', {'class': 'thumb'}))
+
+    gallery = soup.find("div", {'class': 'gallery'})
+    if gallery is not None:
+        fields['gallery'] = _unique(img.attrs['src'] for img in gallery.find_all('img'))
+
+    body = soup.find("section", {'id': 'postingbody'})
+    if body is not None:
+        fields['text'] = body.text
+
+    attrs = soup.find('div', {'class': 'mapAndAttrs'})
+    if attrs is not None:
+        spans = (
+            (span.text, span.attrs.get('class', []), span.attrs)
+            for attrgroup in attrs.find_all('p', {'class': 'attrgroup'})
+            for span in attrgroup.find_all('span'))
+        fields.update(_parse_attributes(spans))
+
+    return ListingFields(**fields)
+
+
+def parse_html_parser(content):
+    """Parse with BeautifulSoup and the standard library parser, building only the field elements."""
+    return parse_soup(BeautifulSoup(content, 'html.parser', parse_only=SoupStrainer(_has_field)))
+
+
+#: Characters which BeautifulSoup treats as whitespace.
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+
+def _collapse(text):
+    if text.strip(ASCII_SPACES):
+        return text
+    return '\n' if '\n' in text else ' '
+
+
+def _text(element):
+    """The text of an element, with whitespace-only strings collapsed the same way as BeautifulSoup."""
+    return "".join(_collapse(text) for text in element.itertext())
+
+
+def _xpath_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def parse_lxml(content):
+    """Parse with lxml, using XPath to find the field elements."""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    tree = lxml.html.document_fromstring(content, parser=lxml.html.HTMLParser(encoding='utf-8'))
+    fields = {}
+
+    map_tag = tree.xpath("(//div[@id='map'])[1]")
+    if map_tag:
+        fields['lat'] = float(map_tag[0].get('data-latitude'))
+        fields['lon'] = float(map_tag[0].get('data-longitude'))
+
+    thumbs = tree.xpath("(//div[@id='thumbs'])[1]")
+    if thumbs:
+        fields['thumbnails'] = _unique(thumbs[0].xpath(f".//a[{_xpath_class('thumb')}]/@href"))
+
+    gallery = tree.xpath(f"(//div[{_xpath_class('gallery')}])[1]")
+    if gallery:
+        fields['gallery'] = _unique(gallery[0].xpath(".//img/@src"))
+
+    body = tree.xpath("(//section[@id='postingbody'])[1]")
+    if body:
+        fields['text'] = _text(body[0])
+
+    attrs = tree.xpath(f"(//div[{_xpath_class('mapAndAttrs')}])[1]")
+    if attrs:
+        spans = ((_text(span), span.get('class', '').split(), span.attrib)
+                 for span in attrs[0].xpath(f".//p[{_xpath_class('attrgroup')}]//span"))
+        fields.update(_parse_attributes(spans))
+
+    return ListingFields(**fields)
+
+
+#: Parser backends, by name, for the ``CRAIGSLIST_HTML_PARSER`` setting.
+PARSERS = {
+    'html.parser': parse_html_parser,
+    'lxml': parse_lxml,
+}
+
+
+def parse_listing(content, parser='html.parser'):
+    """Extract listing fields from a listing page."""
+    if parser == 'lxml' and lxml is None:
+        raise RuntimeError("The lxml listing parser requires lxml")
+    return PARSERS[parser](content)
@@ -0,0 +1,147 @@
+"""
+Rate limiting for requests to craigslist, shared between worker processes.
+
+Each host has a token bucket in redis. Taking a token reserves the next free slot
+in the bucket and returns how long to wait for it, so every worker sleeps exactly
+as long as it must and requests go out at the configured rate, without polling.
+
+Waits longer than ``CRAIGSLIST_RATE_LIMIT_MAX_WAIT`` seconds aren't slept through.
+The reservation is given back and :class:`RateLimited` is raised instead, so that
+tasks can retry later rather than hold a worker while they wait.
+"""
+import asyncio
+import logging
+import time
+import urllib.parse
+
+import redis
+
+from flask import current_app as app
+
+__all__ = ['RateLimited', 'TokenBucketLimiter', 'get_limiter', 'acquire', 'acquire_async']
+
+logger = logging.getLogger(__name__)
+
+#: Take tokens from a bucket, returning the time (in seconds) until they are available.
+#: Tokens can go negative, which reserves tokens from the future for waiting callers.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'timestamp')
+local tokens = tonumber(state[1])
+local timestamp = tonumber(state[2])
+if tokens == nil then
+    tokens = capacity
+    timestamp = now
+end
+
+tokens = math.min(capacity, tokens + math.max(0, now - timestamp) * rate) - requested
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'timestamp', math.max(now, timestamp))
+redis.call('EXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate) + 1)
+
+if tokens >= 0 then
+    return '0'
+end
+return tostring(-tokens / rate)
+"""
+
+
+class RateLimited(Exception):
+    """Raised when a request would have to wait longer than allowed for the rate limiter."""
+
+    def __init__(self, url, wait):
+        self.url = url
+        self.wait = wait
+        super().__init__(f"Rate limited for {wait:.1f}s on {url}")
+
+
+class TokenBucketLimiter:
+    """Per-host token buckets stored in redis.
+
+    ``limits`` maps host names to ``(rate, burst)`` pairs, where rate is in requests
+    per second and burst is the bucket capacity. Hosts without their own entry share
+    the ``'default'`` bucket.
+    """
+
+    def __init__(self, client, limits, prefix='clapbot:ratelimit:'):
+        self.client = client
+        self.limits = limits
+        self.prefix = prefix
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def __repr__(self):
+        return f"TokenBucketLimiter(limits={self.limits!r})"
+
+    @classmethod
+    def from_config(cls, config):
+        url = config['CRAIGSLIST_RATE_LIMIT_URL'] or config['CELERY_BROKER_URL']
+        return cls(redis.StrictRedis.from_url(url), config['CRAIGSLIST_RATE_LIMITS'])
+
+    def bucket(self, url):
+        """The name of the bucket for a URL."""
+        host = urllib.parse.urlsplit(url).hostname
+        return host if host in self.limits else 'default'
+
+    def reserve(self, url, tokens=1):
+        """Take tokens for a request, returning the number of seconds to wait before sending it."""
+        bucket = self.bucket(url)
+        rate, burst = self.limits[bucket]
+        wait = float(self._script(keys=[self.prefix + bucket], args=[rate, burst, time.time(), tokens]))
+        if wait > 0:
+            logger.debug(f"Rate limited on {bucket}, waiting {wait:.2f}s")
+        return wait
+
+    def release(self, url, tokens=1):
+        """Give back tokens which were reserved, but won't be used."""
+        bucket = self.bucket(url)
+        rate, burst = self.limits[bucket]
+        self._script(keys=[self.prefix + bucket], args=[rate, burst, time.time(), -tokens])
+
+    def acquire(self, url, tokens=1, max_wait=None):
+        """Wait until a request to a URL is allowed.
+
+        Raises :class:`RateLimited`, without waiting, when the wait would be longer than ``max_wait``.
+        """
+        wait = self.reserve(url, tokens)
+        if max_wait is not None and wait > max_wait:
+            self.release(url, tokens)
+            raise RateLimited(url, wait)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, url, tokens=1):
+        """Wait until a request to a URL is allowed, without blocking the event loop."""
+        wait = self.reserve(url, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+def get_limiter():
+    """The rate limiter for the current application, or None when rate limiting is disabled."""
+    if not app.config['CRAIGSLIST_RATE_LIMIT_ENABLE']:
+        return None
+    limiter = app.extensions.get('clapbot.ratelimit')
+    if limiter is None:
+        limiter = app.extensions['clapbot.ratelimit'] = TokenBucketLimiter.from_config(app.config)
+        logger.debug(f"Using rate limiter {limiter!r}")
+    return limiter
+
+
+def acquire(url):
+    """Wait until a request to a URL is allowed by the rate limiter, for at most ``CRAIGSLIST_RATE_LIMIT_MAX_WAIT``."""
+    limiter = get_limiter()
+    if limiter is None:
+        return 0
+    return limiter.acquire(url, max_wait=app.config['CRAIGSLIST_RATE_LIMIT_MAX_WAIT'])
+
+
+async def acquire_async(limiter, url):
+    """Wait until a request to a URL is allowed by a rate limiter, which may be None."""
+    if limiter is None:
+        return 0
+    return await limiter.acquire_async(url)
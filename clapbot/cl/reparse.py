@@ -0,0 +1,141 @@
+"""
+Re-parse stored listing pages in bulk, without going back to craigslist.
+
+Pages are streamed from the database with a server-side cursor, parsed in a
+process pool, and the extracted fields are written back one batch at a time.
+"""
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+
+from flask import current_app as app
+from sqlalchemy import select
+
+from ..core import db
+from .model.listing import Listing, Tag, tags
+from .model.image import Image, images
+from .model.keys import get_or_create_ids
+from .parse import parse_listing
+from .utils import chunked
+
+__all__ = ['reparse_listings']
+
+logger = logging.getLogger(__name__)
+
+#: Scalar listing columns which are set from parsed fields, when they are present on the page.
+SCALAR_FIELDS = ('lat', 'lon', 'available', 'size', 'bedrooms', 'bathrooms')
+
+_parser = None
+
+
+def _init_worker(parser):
+    global _parser    # pylint: disable=global-statement
+    _parser = parser
+
+
+def _parse_page(row):
+    """Parse a single page in a worker process, returning ``(listing_id, fields, page, error)``.
+
+    The page is only returned when it was read from the file cache, so that it can be stored.
+    """
+    listing_id, page, cache_file = row
+    loaded = False
+    try:
+        if page is None:
+            if cache_file is None or not Path(cache_file).exists():
+                return listing_id, None, None, None
+            page = Path(cache_file).read_text()
+            loaded = True
+        return listing_id, parse_listing(page, _parser), (page if loaded else None), None
+    except Exception as e:    # pylint: disable=broad-except
+        return listing_id, None, None, f"{type(e).__name__}: {e}"
+
+
+def _replace_associations(table, column, listing_ids, rows):
+    db.session.execute(table.delete().where(table.c.listing_id.in_(listing_ids)))
+    if rows:
+        db.session.execute(table.insert(), [{'listing_id': listing_id, column: value} for listing_id, value in rows])
+
+
+def save_fields(results):
+    """Write parsed fields for a batch of listings, returning the number of listings updated.
+
+    Scalar fields are written with one bulk update, and the tags and images of each
+    listing are replaced with those found on its page.
+    """
+    results = [(listing_id, fields, page) for listing_id, fields, page in results if fields is not None]
+    if not results:
+        return 0
+
+    mappings = []
+    for listing_id, fields, page in results:
+        mapping = {'id': listing_id, 'text': fields.text}
+        mapping.update((name, getattr(fields, name)) for name in SCALAR_FIELDS if getattr(fields, name) is not None)
+        if page is not None:
+            mapping['page'] = page
+        mappings.append(mapping)
+    db.session.bulk_update_mappings(Listing, mappings)
+
+    listing_ids = [listing_id for listing_id, _, _ in results]
+    tag_ids = get_or_create_ids(Tag, Tag.name, (name for _, fields, _ in results for name in fields.tags))
+    _replace_associations(tags, 'tag_id', listing_ids,
+                          [(listing_id, tag_ids[name]) for listing_id, fields, _ in results for name in fields.tags])
+
+    urls = {listing_id: (fields.thumbnails or fields.gallery) for listing_id, fields, _ in results}
+    image_ids = get_or_create_ids(Image, Image.url, (url for listing_urls in urls.values() for url in listing_urls))
+    _replace_associations(images, 'image_id', listing_ids,
+                          [(listing_id, image_ids[url]) for listing_id, listing_urls in urls.items()
+                           for url in listing_urls])
+    return len(results)
+
+
+def reparse_listings(batch_size=500, processes=None, from_cache=False, parser=None, progress=None):
+    """Re-parse stored listing pages, and write the extracted fields back to the database.
+
+    When ``from_cache`` is set, listings without a stored page are parsed from their
+    cached HTML file instead (and the page is stored). ``progress`` is called with the
+    number of listings handled after each batch. Returns the number of listings updated.
+    """
+    parser = parser or app.config['CRAIGSLIST_HTML_PARSER']
+    cache_root = Path(app.config['CRAIGSLIST_CACHE_PATH']) / 'listings'
+
+    table = Listing.__table__
+    query = select([table.c.id, table.c.cl_id, table.c.page]).order_by(table.c.id)
+    if not from_cache:
+        query = query.where(table.c.page.isnot(None))
+
+    def rows(result):
+        for listing_id, cl_id, page in result:
+            cache_file = None
+            if page is None and cl_id is not None:
+                cache_file = str(cache_root / str(cl_id)[:3] / f"{cl_id}.html")
+            yield listing_id, page, cache_file
+
+    processes = processes or os.cpu_count()
+    updated = 0
+    # The pool is started before connecting, so that workers don't inherit the connection. Pages
+    # are read on their own connection, since committing each batch would close a server-side cursor.
+    with multiprocessing.Pool(processes, _init_worker, (parser, )) as pool, db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(query)
+        pending = None
+        for batch in chunked(rows(result), batch_size):
+            # Parse the next batch while the previous one is written.
+            parsing = pool.map_async(_parse_page, batch, chunksize=max(1, len(batch) // (4 * processes)))
+            if pending is not None:
+                updated += _write_batch(pending.get(), progress)
+            pending = parsing
+        if pending is not None:
+            updated += _write_batch(pending.get(), progress)
+    return updated
+
+
+def _write_batch(results, progress=None):
+    for listing_id, _, _, error in results:
+        if error is not None:
+            logger.warning(f"Can't parse page for listing {listing_id}: {error}")
+    updated = save_fields([(listing_id, fields, page) for listing_id, fields, page, _ in results])
+    db.session.commit()
+    if progress is not None:
+        progress(len(results))
+    return updated
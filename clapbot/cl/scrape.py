@@ -1,22 +1,47 @@
 """
 Engine behind scraping craigslist for listings and adding them to the database.
 """
+import json
 import logging
 
 from .utils import safe_iterator
+from .model.listing import parse_datetime
 # from .model import Record
 
 # from ..search.model import HousingSearch
 
 logger = logging.getLogger(__name__)
 
-__all__ = ['make_scraper']
+__all__ = ['make_scraper', 'filters_key', 'position', 'reached']
+
+#: Filters for scrapes which aren't given any.
+DEFAULT_FILTERS = {'has_image': True}
+
+
+def filters_key(filters):
+    """A canonical string for the filters of a scrape, which picks the mark that the scrape uses."""
+    return json.dumps(filters if filters is not None else DEFAULT_FILTERS, sort_keys=True)
+
+
+def position(result):
+    """The ``(posted_at, cl_id)`` position of a result in a feed sorted newest first."""
+    return parse_datetime(result['datetime']), int(result['id'])
+
+
+def reached(result, since):
+    """Whether a result is at or before the ``(posted_at, cl_id)`` position of a known listing."""
+    return position(result) <= tuple(since)
 
 
 def make_scraper(site, area, category, filters=None, limit=None):
-    """Make a scraper"""
+    """Make a scraper
+
+    Results are fetched newest first, one page at a time as they are needed, so a
+    consumer which stops early (see :meth:`~clapbot.cl.model.scrape.Record.scraper`)
+    never requests later result pages.
+    """
     import craigslist
-    filters = filters if filters is not None else {'has_image': True}
+    filters = filters if filters is not None else DEFAULT_FILTERS
     query = craigslist.CraigslistHousing(site=site, area=area, category=category, filters=filters)
     for result in safe_iterator(query.get_results(sort_by='newest', geotagged=False, limit=limit), limit=limit):
         result['site'] = site
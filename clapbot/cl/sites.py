@@ -1,43 +1,110 @@
-from werkzeug.urls import url_parse
-from bs4 import BeautifulSoup
-import requests
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
 
 from flask import current_app as app
+from pkg_resources import resource_filename
+from werkzeug.urls import url_parse
+from bs4 import BeautifulSoup
 
 from ..core import db
-from .model.site import Site, Area
+from .model.site import Site, Area, Category, invalidate_registry
+from .model.keys import insert_ignore
+from . import httpcache
+
+logger = logging.getLogger(__name__)
 
 ALL_SITES_URL = 'http://www.craigslist.org/about/sites'
 
 
-def get_all_sites():
-    response = requests.get(ALL_SITES_URL, timeout=app.config.get("REQUESTS_TIMEOUT", 5))
-    response.raise_for_status()
-    soup = BeautifulSoup(response.content, 'html.parser')
+def parse_sites(content):
+    """Find site names on the craigslist sites page."""
+    soup = BeautifulSoup(content, 'html.parser')
     sites = set()
-
     for box in soup.findAll('div', {'class': 'box'}):
         for a in box.findAll('a'):
             # Remove protocol and get subdomain
-            site = url_parse(a.attrs['href']).netloc.split('.')[0]
-            sites.add(site)
+            sites.add(url_parse(a.attrs['href']).netloc.split('.')[0].lower())
+    return sites
+
+
+def parse_areas(content):
+    """Find area names on a craigslist site page."""
+    soup = BeautifulSoup(content, 'html.parser')
+    raw = soup.select('ul.sublinks li a')
+    return set(url_parse(a.attrs['href']).path.rsplit('/')[1].lower() for a in raw)
 
-    for site in sites:
-        obj = site.Site.query.filter_by(name=site.lower()).one_or_none()
-        if obj is None:
-            db.session.add(site.Site(name=site.lower()))
+
+def get_all_sites():
+    """Discover craigslist sites, and add any which are new. Returns the number of sites added."""
+    response = httpcache.get(ALL_SITES_URL, ttl=app.config['CRAIGSLIST_SITES_CACHE_TTL'], description="sites page")
+    response.raise_for_status()
+    sites = parse_sites(response.content)
+
+    missing = sites - set(name for (name, ) in db.session.query(Site.name))
+    if missing:
+        insert_ignore(Site.__table__, [{'name': name} for name in sorted(missing)], ['name'])
     db.session.commit()
+    invalidate_registry()
+    return len(missing)
 
 
-def get_all_areas(site):
-    site = site.Site.query.filter_by(name=site.lower()).one_or_none()
-    response = requests.get(site.url, timeout=app.config.get("REQUESTS_TIMEOUT", 5))
-    response.raise_for_status()    # Something failed?
-    soup = BeautifulSoup(response.content, 'html.parser')
-    raw = soup.select('ul.sublinks li a')
-    areas = set(url_parse(a.attrs['href']).path.rsplit('/')[1] for a in raw)
-    for area in areas:
-        obj = site.Area.query.filter_by(name=area.lower(), site=site).one_or_none()
-        if obj is None:
-            db.session.add(site.Area(name=area.lower(), site=site))
+def _fetch_areas(app, url):
+    with app.app_context():
+        response = httpcache.get(url, ttl=app.config['CRAIGSLIST_SITES_CACHE_TTL'], description="site page")
+        response.raise_for_status()    # Something failed?
+        return parse_areas(response.content)
+
+
+def save_areas(areas_by_site):
+    """Add areas which are new, given sets of area names by site id. Returns the number of areas added."""
+    existing = set(db.session.query(Area.site_id, Area.name).filter(Area.site_id.in_(areas_by_site.keys())))
+    rows = [{
+        'site_id': site_id,
+        'name': name
+    } for site_id, areas in areas_by_site.items() for name in sorted(areas) if (site_id, name) not in existing]
+    if rows:
+        insert_ignore(Area.__table__, rows, ['site_id', 'name'])
+    db.session.commit()
+    invalidate_registry()
+    return len(rows)
+
+
+def get_all_areas(site_name):
+    """Discover the areas in a craigslist site, and add any which are new. Returns the number of areas added."""
+    site = Site.query.filter_by(name=site_name.lower()).one()
+    return save_areas({site.id: _fetch_areas(app._get_current_object(), site.url)})
+
+
+def get_areas_for_sites(sites, workers=None):
+    """Discover areas for many sites, fetching site pages concurrently. Returns the number of areas added.
+
+    Sites whose pages can't be fetched are logged and skipped.
+    """
+    workers = workers or app.config['CRAIGSLIST_SITE_DISCOVERY_WORKERS']
+    areas_by_site = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_fetch_areas, app._get_current_object(), site.url): site for site in sites}
+        for future in as_completed(futures):
+            site = futures[future]
+            try:
+                areas_by_site[site.id] = future.result()
+            except Exception:    # pylint: disable=broad-except
+                logger.exception(f"Can't discover areas for {site!r}")
+    if not areas_by_site:
+        return 0
+    return save_areas(areas_by_site)
+
+
+def import_categories():
+    """Load craigslist categories from ``categories.sql``, if there aren't any yet.
+
+    Returns the number of categories added.
+    """
+    if db.session.query(Category.query.exists()).scalar():
+        return 0
+    script = Path(resource_filename('clapbot', 'data/categories.sql')).read_text()
+    db.session.execute(script)
     db.session.commit()
+    invalidate_registry()
+    return Category.query.count()
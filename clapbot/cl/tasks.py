@@ -5,19 +5,27 @@ from typing import NamedTuple, Optional
 
 import requests
 
-from sqlalchemy import func
-from sqlalchemy import not_
+from sqlalchemy import or_
 
 from flask import current_app as app
 
 from celery.utils.log import get_task_logger
-from celery.canvas import group
+from celery.canvas import group, chord
 
 from ..core import db, celery
-from .model.listing import Listing, ListingExpirationCheck
-from .model.image import Image
-from .model.scrape import Record
+from .model.listing import Listing, ListingExpirationCheck, parse_datetime
+from .model.image import Image, images
+from .model.scrape import Record, ScrapeMark
+from .model.site import Site, get_registry
+from .model.keys import insert_ignore
+from .utils import chunked
+from .scrape import filters_key
 from . import sites as cl_sites
+from . import http
+from . import httpcache
+from .fetch import fetch_images, ImageFetchError
+from .expiration import check_listings, compact_checks
+from . import ratelimit
 
 __all__ = ['download_listing', 'download_image']
 
@@ -25,11 +33,18 @@ logger = get_task_logger(__name__)
 
 
 class RequestsTask(celery.Task):
-    """A task which retries when requests times out, with some jitter."""
+    """A task which retries when requests times out, with some jitter.
+
+    Tasks which would wait too long for the rate limiter are retried once their
+    turn comes, rather than waiting in the worker.
+    """
 
     def __call__(self, *args, **kwargs):
         try:
             return super().__call__(*args, **kwargs)
+        except ratelimit.RateLimited as exc:
+            logger.info(f"{exc}, retrying later")
+            self.retry(exc=exc, countdown=exc.wait, max_retries=None)
         except requests.Timeout as exc:
             logger.exception("Caught timeout, retrying: {}/{}".format(self.request.retries, self.max_retries))
             self.retry(exc=exc, countdown=int(random.uniform(2, 4)**self.request.retries))
@@ -42,6 +57,16 @@ def requests_retry_task(**kwargs):
     return celery.task(**kwargs)
 
 
+def task_skew():
+    """Maximum random delay (in seconds) used to spread out tasks which make requests.
+
+    When requests are rate limited, tasks run straight away and wait for the limiter instead.
+    """
+    if app.config['CRAIGSLIST_RATE_LIMIT_ENABLE']:
+        return 0
+    return app.config['CRAIGSLIST_TASK_SKEW']
+
+
 class CachedResponse(NamedTuple):
     content: bytes
     status_code: Optional[int]
@@ -56,10 +81,10 @@ def get_cached_url(url, path, save=False, description="item"):
 
     logger.info(f"Requesting {description} from {url}.")
 
-    response = requests.get(url, timeout=app.config.get("REQUESTS_TIMEOUT", 5))
+    response = httpcache.get(url, path, description=description)
     response.raise_for_status()
 
-    if save:
+    if save and not path.exists():
         logger.info(f"Saving {description} to cacehd file.")
         path.write_bytes(response.content)
     return response
@@ -79,7 +104,10 @@ def download_listing(listing_id, force=False):
             listing_expiration_check(listing, exc.response.status_code)
             raise
         else:
-            listing.parse_html(response.content)
+            if response.status_code == 304 and listing.text is not None:
+                logger.info(f"Listing {listing.cl_id} is unchanged, skipping parse.")
+            else:
+                listing.parse_html(response.content)
             if not isinstance(response, CachedResponse):
                 listing_expiration_check(listing, response.status_code)
         finally:
@@ -90,13 +118,19 @@ def download_listing(listing_id, force=False):
 @celery.task()
 def download_images_for_listing(listing_id, force=False):
     """Return the image ids for image fetching"""
+    if app.config['CRAIGSLIST_IMAGE_FETCHER'] == 'asyncio':
+        result = download_images.delay([listing_id], force=force)
+        return result.id
+
     listing = Listing.query.get(listing_id)
-    image_ids = [image.id for image in listing.images if (image.full is None or image.thumbnail is None) or force]
+    image_ids = [
+        image.id for image in listing.images if (image.full_digest is None or image.thumbnail_digest is None) or force
+    ]
     image_group = group([download_image.si(img_id, force=force) for img_id in image_ids])
     if not image_group:
         logger.info("No images to download for lisitng {}".format(listing))
         return None
-    result = image_group.skew(start=0, stop=app.config['CRAIGSLIST_TASK_SKEW']).delay()
+    result = image_group.skew(start=0, stop=task_skew()).delay()
     result.save()
     return result.id
 
@@ -107,12 +141,12 @@ def download_image(image_id, force=False):
     image = Image.query.get(image_id)
     save = app.config['CRAIGSLIST_CACHE_ENABLE']
 
-    if image.full is None or force:
+    if image.full_digest is None or force:
         path = image.cache_path / f"{image.cl_id}.full.jpg"
         response = get_cached_url(image.url, path, save=save, description=f'image (full) {image.cl_id}')
         image.full = response.content
 
-    if image.thumbnail is None or force:
+    if image.thumbnail_digest is None or force:
         path = image.cache_path / f"{image.cl_id}.thumbnail.jpg"
         response = get_cached_url(image.thumbnail_url, path, save=save, description=f"image (thumbnail) {image.cl_id}")
         image.thumbnail = response.content
@@ -122,37 +156,117 @@ def download_image(image_id, force=False):
     return image_id
 
 
-@celery.task()
-def ingest_listing(listing_json, force=False):
-    listing = Listing.query.filter_by(cl_id=listing_json['id']).one_or_none()
-    if (listing is not None) and (not force):
-        # We've seen this lisitng before, don't ingest it.
-        return listing.id
+@celery.task(bind=True, max_retries=5)
+def download_images(self, listing_ids, force=False):
+    """Download all images for a batch of listings concurrently."""
+    query = Image.query.join(images, images.c.image_id == Image.id).filter(images.c.listing_id.in_(listing_ids))
+    try:
+        return fetch_images(query.distinct().all(), force=force)
+    except ImageFetchError as exc:
+        # Successful downloads have been saved, so only retry the missing ones.
+        logger.warning(f"{exc}, retrying: {self.request.retries}/{self.max_retries}")
+        countdown = int(random.uniform(2, 4)**self.request.retries)
+        raise self.retry(args=(listing_ids, ), kwargs={'force': False}, exc=exc, countdown=countdown)
+
 
-    if listing is None:
-        listing = Listing.from_result(listing_json)
+@celery.task()
+def ingest_listings(listing_jsons, force=False):
+    """Ingest a page of scraped listings at once, returning the ids of listings which need downloading."""
+    results = {int(result['id']): result for result in listing_jsons}
+    existing = dict(db.session.query(Listing.cl_id, Listing.id).filter(Listing.cl_id.in_(results.keys())))
 
-    save_listing_to_file(listing, save=app.config['CRAIGSLIST_CACHE_ENABLE'])
+    registry = get_registry()
 
-    db.session.add(listing)
-    app.logger.info("Added Craigslist entry for {0}".format(listing.cl_id))
+    rows = []
+    for cl_id, result in results.items():
+        try:
+            mapping = Listing.mapping_from_result(result, registry)
+        except Exception as e:    # pylint: disable=broad-except
+            logger.exception(f"Can't ingest craigslist result {cl_id}: {e}")
+            continue
+        if cl_id in existing:
+            continue
+        rows.append(mapping)
+        save_result_to_file(result, save=app.config['CRAIGSLIST_CACHE_ENABLE'])
+
+    if rows:
+        # Overlapping scrapes can insert the same listing, so rows which already exist are skipped.
+        columns = set().union(*rows)
+        insert_ignore(Listing.__table__, [{column: row.get(column) for column in columns} for row in rows], ['cl_id'])
+    new_ids = [row['cl_id'] for row in rows]
+    added = dict(db.session.query(Listing.cl_id, Listing.id).filter(Listing.cl_id.in_(new_ids))) if new_ids else {}
     db.session.commit()
-    return listing.id
+    app.logger.info("Added {0:d} Craigslist entries, skipped {1:d}".format(len(added), len(existing)))
+
+    listing_ids = list(added.values())
+    if force:
+        listing_ids.extend(existing.values())
+    return listing_ids
+
+
+@celery.task()
+def download_listings(listing_ids, force=False):
+    """Start download pipelines for a list of listings."""
+    skew = task_skew()
+    g = group([(download_listing.si(listing_id, force=force).set(countdown=int(random.uniform(0, skew)))
+                | download_images_for_listing.s(force=force)) for listing_id in listing_ids])
+    if not g.tasks:
+        return None
+    result = g.delay()
+    result.save()
+    return result.id
+
+
+@celery.task()
+def ingest_listing(listing_json, force=False):
+    """Ingest a single scraped listing, returning its id."""
+    # Forcing returns the id of a listing which was already ingested, as well as a new one.
+    listing_ids = ingest_listings([listing_json], force=True)
+    return listing_ids[0] if listing_ids else None
 
 
 def new_listing_pipeline(listing_json, force=False):
     """Task pipeline to transform new listing JSON into a listing record and associated images."""
     return (ingest_listing.s(listing_json, force=force)
-            | download_listing.s(force=force).set(countdown=int(random.uniform(0, app.config['CRAIGSLIST_TASK_SKEW'])))
+            | download_listing.s(force=force).set(countdown=int(random.uniform(0, task_skew())))
             | download_images_for_listing.s(force=force))
 
 
+def ingest_pipeline(listing_jsons, force=False):
+    """Task pipeline to ingest a page of listing JSON, and download only the new listings."""
+    return ingest_listings.s(listing_jsons, force=force) | download_listings.s(force=force)
+
+
+@celery.task()
+def advance_scrape_mark(area_id, category_id, filters, posted_at, cl_id):
+    """Move the mark for an area, category and filters forward, once every page of a scrape has been ingested."""
+    ScrapeMark.advance([{
+        'cl_area': area_id,
+        'cl_category': category_id,
+        'created': parse_datetime(posted_at),
+        'cl_id': cl_id
+    }], filters_key(filters))
+    db.session.commit()
+
+
 def scrape_pipeline(record, filters=None, limit=None, force=False):
-    """Using a scrape record, build a CL scraping pipeline for celery."""
-    g = group([new_listing_pipeline(result, force=force) for result in record.scraper(filters=filters, limit=limit)])
+    """Using a scrape record, build a CL scraping pipeline for celery.
+
+    When the scrape can move the record's mark forward, the mark is moved once every page
+    has been ingested, so a page which fails to ingest is scraped again next time.
+    """
+    scraper = record.scraper(filters=filters, limit=limit, incremental=not force)
+    pages = chunked(scraper, app.config['CRAIGSLIST_INGEST_BATCH_SIZE'])
+    g = group([ingest_pipeline(page, force=force) for page in pages])
     if not g.tasks:
         return None
-    result = g.delay()
+    if record.mark is None:
+        result = g.delay()
+    else:
+        posted_at, cl_id = record.mark
+        advance = advance_scrape_mark.si(record.cl_area, record.cl_category, filters,
+                                         posted_at.strftime('%Y-%m-%d %H:%M'), cl_id)
+        result = chord(g, advance).delay().parent
     record.mark_celery_result(result)
     return result
 
@@ -181,6 +295,19 @@ def save_listing_to_file(listing, save=False, force=False):
             json.dump(listing.to_json(), f)
 
 
+#: Keys used when exporting listings to JSON.
+RESULT_JSON_KEYS = ('id', 'datetime', 'where', 'url', 'price', 'name', 'geotag', 'site', 'area', 'category')
+
+
+def save_result_to_file(result, save=False, force=False):
+    """Save scraped result data as JSON to a file, in the same format as :func:`save_listing_to_file`"""
+    path = (Listing.cache_path_for(result['id']) / '{}.json'.format(result['id']))
+    if save and ((not path.exists()) or force):
+        logger.info(f"Saving result {result['id']} to cacehd file.")
+        with path.open('w') as f:
+            json.dump({key: result.get(key) for key in RESULT_JSON_KEYS}, f)
+
+
 @celery.task()
 def export_listing(listing_id, force=False):
     """Dump this listing to disk if needed."""
@@ -211,7 +338,7 @@ def ensure_downloaded(force=False):
 
     downloaders = group([(download_listing.si(listing.id, force=force)
                           | download_images_for_listing.s(force=force)) for listing in listings])
-    result = downloaders.skew(start=0, stop=app.config['CRAIGSLIST_TASK_SKEW']).delay()
+    result = downloaders.skew(start=0, stop=task_skew()).delay()
     result.save()
     return result.id
 
@@ -220,6 +347,8 @@ def listing_expiration_check(listing, status_code):
     """Performs the listing expiration check."""
     checkrecord = ListingExpirationCheck(listing_id=listing.id, created=dt.datetime.now())
     db.session.add(checkrecord)
+    listing.last_checked_at = checkrecord.created
+    listing.last_status = status_code
 
     if status_code == 404:
         listing.expired = dt.datetime.now()
@@ -232,7 +361,9 @@ def check_expiration(listing_id):
     """Check whether a craigslist listing still exists."""
     listing = Listing.query.get(listing_id)
 
-    response = requests.get(listing.url, timeout=app.config.get("REQUESTS_TIMEOUT", 5))
+    # Revalidating the downloaded page only transfers it again when it has changed.
+    response = httpcache.get(listing.url, listing.cache_path / f"{listing.cl_id}.html",
+                             description=f"listing for {listing.cl_id}", read_body=False)
 
     listing_expiration_check(listing, response.status_code)
 
@@ -252,25 +383,55 @@ def get_craigslist_site_info(site):
     cl_sites.get_all_areas(site)
 
 
+@celery.task()
+def get_all_areas_for_enabled_sites():
+    """Discover areas for every enabled site, fetching site pages concurrently."""
+    return cl_sites.get_areas_for_sites(Site.query.filter(Site.enabled.is_(True)).all())
+
+
+@celery.task()
+def http_pool_stats():
+    """Report HTTP connection pool hits and misses for a worker process."""
+    return http.pool_stats()
+
+
+@celery.task(bind=True)
+def check_expiration_batch(self, listing_ids):
+    """Check whether a batch of craigslist listings still exist, returning the ids of expired listings.
+
+    Listings which would wait too long for the rate limiter are checked by a retry, once they can be.
+    """
+    expired, deferred, wait = check_listings(listing_ids)
+    if deferred:
+        logger.info(f"Deferring {len(deferred)} expiration checks for {wait:.1f}s")
+        raise self.retry(args=(deferred, ), countdown=wait, max_retries=None)
+    return expired
+
+
+@celery.task()
+def compact_expiration_checks(days=None):
+    """Roll up expiration checks older than ``CRAIGSLIST_EXPIRATION_CHECK_RETENTION`` days into summaries."""
+    days = days if days is not None else app.config['CRAIGSLIST_EXPIRATION_CHECK_RETENTION']
+    return compact_checks(dt.datetime.now() - dt.timedelta(days=days))
+
+
 @celery.task()
 def check_expirations(limit=100, force=False):
-    """Check whether a bunch of craigslist listing still exist."""
-    listings = Listing.query
+    """Check whether a bunch of craigslist listing still exist, in batches."""
+    listings = db.session.query(Listing.id)
     if not force:
         # pylint: disable=singleton-comparison
         listings = listings.filter(Listing.expired == None)    # noqa: E711
-
-    last_checked = func.max(ListingExpirationCheck.created).label('last_checked')
-    checks = db.session.query(ListingExpirationCheck.listing_id,
-                              last_checked).group_by(ListingExpirationCheck.listing_id).subquery()
-
-    listings = listings.join(checks, isouter=True)
-    listings = listings.order_by(checks.c.last_checked)
-    if not force:
-        listings = listings.filter(not_(dt.datetime.now() - checks.c.last_checked <= dt.timedelta(days=2)))
-    listings = listings.limit(limit)
-
-    g = group([check_expiration.si(listing.id) for listing in listings])
+        cutoff = dt.datetime.now() - dt.timedelta(days=2)
+        listings = listings.filter(or_(Listing.last_checked_at == None, Listing.last_checked_at < cutoff))  # noqa: E711
+    # Never checked listings first, in the order of ix_listing_unexpired_last_checked.
+    listings = listings.order_by(Listing.last_checked_at.isnot(None), Listing.last_checked_at).limit(limit)
+
+    listing_ids = [listing_id for (listing_id, ) in listings]
+    g = group([
+        check_expiration_batch.si(batch)
+        for batch in chunked(listing_ids, app.config['CRAIGSLIST_EXPIRATION_BATCH_SIZE'])
+    ])
     if not g.tasks:
         return None
     result = g.delay()
@@ -15,4 +15,14 @@ def safe_iterator(iterable, limit):
         except Exception as e:    # pylint: disable=broad-except
             logger.exception(f"Exception in craigslist result: {e}")
         else:
-            yield gen
\ No newline at end of file
+            yield gen
+
+
+def chunked(iterable, size):
+    """Split an iterable into lists of at most *size* items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            break
+        yield chunk
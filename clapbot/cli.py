@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
 
 from .application import create_app, db
-from . import scrape
-from .model import Listing
+from .cl import scrape
+from .cl import sites as cl_sites
+from .cl.model import Listing
 from . import tasks
 from . import location
+from . import batchscore
+from .cl.model.image import migrate_legacy_image_data
+from .cl.reparse import reparse_listings
+from .cl.parse import PARSERS
+from .cl.utils import chunked
 
 import os
 import io
@@ -56,22 +62,58 @@ def download_command(save, force, images):
 
 
 @app.cli.command("score")
-def score_command():
+@click.option("--batch-size", type=int, default=app.config['CRAIGSLIST_SCORE_BATCH_SIZE'], help="Listings per batch.")
+def score_command(batch_size):
     """Score listings"""
-    q = Listing.query
-    n = q.count()
-    click.echo("Adding location info for {n:d} listings.".format(n=n))
-    group = celery.group([tasks.score.si(listing.id) for listing in q])
-    group()
+    n = batchscore.rescore_all(batch_size=batch_size)
+    click.echo("Scored {n:d} listings.".format(n=n))
+
+
+@app.cli.command("migrate-images")
+@click.option("--batch-size", type=int, default=100, help="Images per batch.")
+def migrate_images_command(batch_size):
+    """Move image data out of the database and into the blob store."""
+    n = migrate_legacy_image_data(batch_size=batch_size)
+    click.echo("Migrated {n:d} images.".format(n=n))
+
+
+@app.cli.command("reparse")
+@click.option("--batch-size", type=int, default=500, help="Listings per batch.")
+@click.option("--processes", type=int, default=None, help="Parser processes (defaults to one per core).")
+@click.option("--from-cache/--no-from-cache", help="Parse cached page files for listings without a stored page.")
+@click.option("--parser", type=click.Choice(list(PARSERS)), default=None, help="HTML parser backend.")
+def reparse_command(batch_size, processes, from_cache, parser):
+    """Re-parse stored listing pages, without downloading them again."""
+    with tqdm(unit='listing') as pbar:
+        n = reparse_listings(
+            batch_size=batch_size, processes=processes, from_cache=from_cache, parser=parser, progress=pbar.update)
+    click.echo("Re-parsed {n:d} listings.".format(n=n))
+
+
+@app.cli.command("import-categories")
+def import_categories_command():
+    """Load the craigslist category list."""
+    n = cl_sites.import_categories()
+    click.echo("Imported {n:d} categories.".format(n=n))
+
+
+@app.cli.command("import-transit")
+@click.argument("agency")
+@click.argument("path", required=False, type=click.Path(exists=True, dir_okay=False))
+@click.option("--batch-size", type=int, default=1000, help="Stops per batch.")
+def import_transit_command(agency, path, batch_size):
+    """Import transit stops for an agency from a GTFS stops.txt or zip file."""
+    n = location.import_transit(agency, path=path, batch_size=batch_size)
+    click.echo("Imported {n:d} new stops for {agency}.".format(n=n, agency=agency))
 
 
 @app.cli.command("locate")
-def locate_command():
+@click.option("--batch-size", type=int, default=500, help="Listings per batch.")
+def locate_command(batch_size):
     """Add location info to listings."""
-    q = Listing.query
-    n = q.count()
-    click.echo("Adding location info for {n:d} listings.".format(n=n))
-    group = celery.group([tasks.location_info.si(listing.id) for listing in q])
+    ids = [listing_id for (listing_id, ) in db.session.query(Listing.id)]
+    click.echo("Adding location info for {n:d} listings.".format(n=len(ids)))
+    group = celery.group([tasks.location_info_batch.si(batch) for batch in chunked(ids, batch_size)])
     result = group()
 
 
@@ -7,7 +7,15 @@ CRAIGSLIST_CATEGORY = 'apa'
 CRAIGSLIST_FILTERS = {'max_price': 3100, 'min_price': 1000, 'has_image': True}
 CRAIGSLIST_CACHE_ENABLE = False
 CRAIGSLIST_CHECK_BBOX = True
+CRAIGSLIST_GEO_BACKEND = 'sql'
+CRAIGSLIST_COMPRESS_PAGES = False
+CRAIGSLIST_HTML_PARSER = 'html.parser'
+CRAIGSLIST_KEY_CACHE_SIZE = 10000
+CRAIGSLIST_SITE_REGISTRY_TTL = 300
 CRAIGSLIST_CACHE_PATH = 'data/cl/'
+CRAIGSLIST_BLOB_STORE = 'filesystem'
+CRAIGSLIST_BLOB_MAX_AGE = 365 * 24 * 60 * 60
+CRAIGSLIST_BLOB_ACCEL_PREFIX = None
 
 CRAIGSLIST_SCORE_TRANSIT = True
 CRAIGSLIST_SCORE_WORK_LAT = 37.876685
@@ -15,15 +23,42 @@ CRAIGSLIST_SCORE_WORK_LON = -122.261998
 CRAIGSLIST_SCORE_WORK_CLOSE = 10.0
 CRAIGSLIST_SCORE_WORK_MEDIUM = 20.0
 CRAIGSLIST_SCORE_STUDIO_PENALTY = -1500
+CRAIGSLIST_SCORE_BATCH_SIZE = 1000
 
 CRAIGSLIST_MAX_USER_SEARCHES = 5
 
+CRAIGSLIST_PAGINATION_MAX_PER_PAGE = 100
+CRAIGSLIST_PAGINATION_COUNT = 'cached'
+CRAIGSLIST_PAGINATION_COUNT_TTL = 300
+CRAIGSLIST_PAGINATION_COUNT_CACHE_SIZE = 1000
+
 CRAIGSLIST_MAX_MAIL = 10
 CRAIGSLIST_MAX_SCRAPE = 50
+CRAIGSLIST_INGEST_BATCH_SIZE = 100
 CRAIGSLIST_SEND_MAIL = True
 
 CRAIGSLIST_TASK_SKEW = 120
 
+CRAIGSLIST_RATE_LIMIT_ENABLE = True
+CRAIGSLIST_RATE_LIMIT_URL = None
+CRAIGSLIST_RATE_LIMIT_MAX_WAIT = 30
+CRAIGSLIST_RATE_LIMITS = {'default': (1.0, 5), 'images.craigslist.org': (10.0, 20)}
+
+CRAIGSLIST_HTTP_POOL_CONNECTIONS = 10
+CRAIGSLIST_HTTP_POOL_MAXSIZE = 4
+CRAIGSLIST_HTTP_POOL_BLOCK = True
+CRAIGSLIST_HTTP_CACHE_ENABLE = False
+CRAIGSLIST_SITES_CACHE_TTL = 24 * 60 * 60
+
+CRAIGSLIST_SITE_DISCOVERY_WORKERS = 8
+
+CRAIGSLIST_EXPIRATION_BATCH_SIZE = 500
+CRAIGSLIST_EXPIRATION_WORKERS = 8
+CRAIGSLIST_EXPIRATION_CHECK_RETENTION = 30
+
+CRAIGSLIST_IMAGE_FETCHER = 'celery'
+CRAIGSLIST_IMAGE_FETCH_CONCURRENCY = 8
+
 SCORE_TARGET_DATE = '2017-07-01'
 TIMEZONE = 'America/Los_Angeles'
 
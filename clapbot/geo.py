@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+SQL predicates for geographic filters on latitude and longitude columns.
+
+Every predicate is built from range comparisons which an index on ``(lat, lon)`` can
+serve. Distance filters also need a distance test, which is done with plain arithmetic
+by default, or with the PostgreSQL ``earthdistance`` extension when
+``CRAIGSLIST_GEO_BACKEND`` is ``'earthdistance'``.
+"""
+import math
+
+from flask import current_app as app
+from sqlalchemy import and_, or_, false, func
+
+from .spatial import EARTH_RADIUS_KM
+
+__all__ = ['in_bbox', 'in_any_bbox', 'within_km']
+
+#: Kilometers per degree of latitude.
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180.0
+
+
+def in_bbox(lat, lon, bbox):
+    """A predicate for a position inside a bounding box."""
+    return and_(lat.between(bbox.lat_min, bbox.lat_max), lon.between(bbox.lon_min, bbox.lon_max))
+
+
+def in_any_bbox(lat, lon, bboxes):
+    """A predicate for a position inside any of some bounding boxes. No boxes matches nothing."""
+    bboxes = list(bboxes)
+    if not bboxes:
+        return false()
+    return or_(*(in_bbox(lat, lon, bbox) for bbox in bboxes))
+
+
+def _degree_box(center_lat, center_lon, km):
+    """The ``(lat_min, lat_max, lon_min, lon_max)`` box which contains a circle around a position."""
+    dlat = km / KM_PER_DEGREE
+    coslat = math.cos(math.radians(min(abs(center_lat) + dlat, 90.0)))
+    dlon = 180.0 if coslat < 1e-6 else min(dlat / coslat, 180.0)
+    return (center_lat - dlat, center_lat + dlat, center_lon - dlon, center_lon + dlon)
+
+
+def _within_km_arithmetic(lat, lon, center_lat, center_lon, km):
+    # Equirectangular distance, which is accurate to well under 1% at city scales.
+    scale = math.cos(math.radians(center_lat))
+    dlat = lat - center_lat
+    dlon = (lon - center_lon) * scale
+    return dlat * dlat + dlon * dlon <= (km / KM_PER_DEGREE)**2
+
+
+def _within_km_earthdistance(lat, lon, center_lat, center_lon, km):
+    # earthdistance works in meters on a sphere of its own radius, so the box test is repeated
+    # with the extension's operators, which a GiST index on ll_to_earth(lat, lon) can serve.
+    center = func.ll_to_earth(center_lat, center_lon)
+    position = func.ll_to_earth(lat, lon)
+    radius = km * 1000.0
+    return and_(
+        func.earth_box(center, radius).op('@>')(position),
+        func.earth_distance(center, position) <= radius)
+
+
+GEO_BACKENDS = {
+    'sql': _within_km_arithmetic,
+    'earthdistance': _within_km_earthdistance,
+}
+
+
+def within_km(lat, lon, center_lat, center_lon, km, backend=None):
+    """A predicate for a position within some distance (in km) of a center.
+
+    The position is first restricted to a box around the circle, so that an index on
+    ``(lat, lon)`` narrows the rows before the distance test.
+    """
+    backend = backend or app.config['CRAIGSLIST_GEO_BACKEND']
+    lat_min, lat_max, lon_min, lon_max = _degree_box(center_lat, center_lon, km)
+    return and_(
+        lat.between(lat_min, lat_max), lon.between(lon_min, lon_max),
+        GEO_BACKENDS[backend](lat, lon, center_lat, center_lon, km))
@@ -1,26 +1,80 @@
-from .utils import coord_distance
+from flask import current_app as app
+from sqlalchemy import func
 
 from .core import db
 from .model import TransitStop
+from .cl.model.keys import upsert
+from .cl.utils import chunked
 from .search.model import BoundingBox
+from .search.model.location import boundingboxassociation
+from .search.model.search import housingsearchbboxes
+from .spatial import KDTree, BoxIndex, unit_vector, chord_to_km
 import pkg_resources
+import contextlib
 import csv
+import datetime as dt
 import io
+import os
+import zipfile
 
 
-def import_transit(agency):
-    """Import transit stops for a given agency."""
-    stream = io.TextIOWrapper(
-        pkg_resources.resource_stream(__name__, 'data/transit/{}.txt'.format(agency)), encoding='utf-8')
-    reader = csv.DictReader(stream)
+#: Columns of a GTFS ``stops.txt`` file, by transit stop attribute.
+GTFS_STOP_COLUMNS = {'stop_id': 'stop_id', 'name': 'stop_name', 'lat': 'stop_lat', 'lon': 'stop_lon'}
+
+
+@contextlib.contextmanager
+def open_gtfs_stops(agency, path=None):
+    """Open the GTFS stops for an agency as text.
+
+    ``path`` can be a ``stops.txt`` file or a GTFS zip file. Without a path, the stops
+    packaged with clapbot for the agency are used.
+    """
+    with contextlib.ExitStack() as stack:
+        if path is None:
+            stream = pkg_resources.resource_stream(__name__, 'data/transit/{}.txt'.format(agency))
+        elif zipfile.is_zipfile(path):
+            archive = stack.enter_context(zipfile.ZipFile(path))
+            names = [name for name in archive.namelist() if os.path.basename(name) == 'stops.txt']
+            if not names:
+                raise ValueError(f"No stops.txt in GTFS archive {path}")
+            stream = archive.open(names[0])
+        else:
+            stream = open(path, 'rb')
+        stack.enter_context(stream)
+        # GTFS files are often written with a byte order mark.
+        yield io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+
+def _stop_rows(agency, reader, now):
     for row in reader:
-        stop = TransitStop.query.filter_by(agency=agency, stop_id=row['stop_id']).one_or_none()
-        if stop is not None:
+        if not row.get('stop_lat') or not row.get('stop_lon'):
+            # Generic nodes and boarding areas don't need a location.
             continue
-        stop = TransitStop(
-            agency=agency, stop_id=row['stop_id'], name=row['stop_name'], lat=row['stop_lat'], lon=row['stop_lon'])
-        db.session.add(stop)
+        stop = {attribute: row[column] for attribute, column in GTFS_STOP_COLUMNS.items()}
+        stop['lat'], stop['lon'] = float(stop['lat']), float(stop['lon'])
+        stop['agency'] = agency
+        stop['updated_at'] = now
+        yield stop
+
+
+def import_transit(agency, path=None, batch_size=1000):
+    """Import transit stops for an agency, returning the number of stops added.
+
+    Stops are read from a GTFS ``stops.txt`` file or zip file (see :func:`open_gtfs_stops`)
+    in batches, and upserted by stop id, so importing a feed again updates moved or renamed
+    stops. The transit stop index is rebuilt once, after every batch is written. Every
+    imported stop gets a new change time, so other workers rebuild their indexes too.
+    """
+    count = TransitStop.query.filter_by(agency=agency).count
+    before = count()
+    now = dt.datetime.now()
+    with open_gtfs_stops(agency, path) as stream:
+        rows = _stop_rows(agency, csv.DictReader(stream), now)
+        for batch in chunked(rows, batch_size):
+            upsert(TransitStop.__table__, batch, ['agency', 'stop_id'], ['name', 'lat', 'lon', 'updated_at'])
     db.session.commit()
+    invalidate_transit_index()
+    return count() - before
 
 
 def import_bounding_boxes(stream):
@@ -36,6 +90,15 @@ def import_bounding_boxes(stream):
         bbox = BoundingBox(name=name, lat_min=lat_min, lat_max=lat_max, lon_min=lon_min, lon_max=lon_max)
         db.session.add(bbox)
     db.session.commit()
+    invalidate_bbox_index()
+
+
+def delete_bounding_boxes():
+    """Delete every bounding box, along with the listings and searches which refer to them."""
+    db.session.execute(boundingboxassociation.delete())
+    db.session.execute(housingsearchbboxes.delete())
+    BoundingBox.query.delete()
+    invalidate_bbox_index()
 
 
 def export_bounding_boxes(stream):
@@ -45,26 +108,139 @@ def export_bounding_boxes(stream):
         writer.writerow([bbox.name, bbox.lon_min, bbox.lat_min, bbox.lon_max, bbox.lat_max])
 
 
+class BoundingBoxIndex:
+    """A grid index of every bounding box, for point-in-box lookups.
+
+    The index holds only box ids and bounds. Its signature is the number of boxes and the
+    largest box id at build time, which changes whenever boxes are added or removed.
+    """
+
+    def __init__(self, boxes, signature=None):
+        self.signature = signature
+        self.index = BoxIndex(((lat_min, lat_max, lon_min, lon_max), bbox_id)
+                              for (bbox_id, lat_min, lat_max, lon_min, lon_max) in boxes)
+
+    def __len__(self):
+        return len(self.index)
+
+    @staticmethod
+    def current_signature():
+        """The signature of the bounding boxes currently in the database."""
+        return tuple(db.session.query(func.count(BoundingBox.id), func.max(BoundingBox.id)).one())
+
+    @classmethod
+    def build(cls):
+        """Build an index from all bounding boxes in the database."""
+        signature = cls.current_signature()
+        boxes = db.session.query(BoundingBox.id, BoundingBox.lat_min, BoundingBox.lat_max, BoundingBox.lon_min,
+                                 BoundingBox.lon_max)
+        return cls(boxes, signature=signature)
+
+
+def bbox_index():
+    """The bounding box index for this worker, rebuilt if boxes have changed."""
+    index = app.extensions.get('clapbot.bbox_index')
+    if index is None or index.signature != BoundingBoxIndex.current_signature():
+        index = app.extensions['clapbot.bbox_index'] = BoundingBoxIndex.build()
+    return index
+
+
+def invalidate_bbox_index():
+    """Drop this worker's bounding box index, so that it is rebuilt on next use."""
+    app.extensions.pop('clapbot.bbox_index', None)
+
+
 def check_inside_bboxes(listing):
     """Check that a listing is inside bboxes."""
     if listing.lat is None or listing.lon is None:
         return False
-    for bbox in BoundingBox.query:
-        if bbox.contains(listing.lat, listing.lon):
-            return True
-    else:
-        return False
+    return bbox_index().index.contains(listing.lat, listing.lon)
+
+
+def find_bboxes(listings):
+    """Find the bounding boxes containing a batch of listings at once.
+
+    Listings are given as ``(listing_id, lat, lon)`` rows. Returns a mapping of listing id
+    to the set of ids of boxes which contain it. Listings without a position are in no boxes.
+    """
+    listings = list(listings)
+    found = {listing_id: set() for (listing_id, _, _) in listings}
+    for listing_id, bbox_id in bbox_index().index.join((lat, lon, listing_id) for (listing_id, lat, lon) in listings):
+        found[listing_id].add(bbox_id)
+    return found
+
+
+def assign_bboxes(found):
+    """Replace the bounding boxes of listings, given a mapping of listing id to bbox ids.
+
+    The ``bboxes`` association rows are written in bulk. Returns the number of rows written.
+    """
+    if not found:
+        return 0
+    table = boundingboxassociation
+    rows = [{'listing_id': listing_id, 'bbox_id': bbox_id} for listing_id, bbox_ids in found.items()
+            for bbox_id in sorted(bbox_ids)]
+    for chunk in chunked(list(found), 500):
+        db.session.execute(table.delete().where(table.c.listing_id.in_(chunk)))
+    if rows:
+        db.session.execute(table.insert(), rows)
+    return len(rows)
+
+
+class TransitIndex:
+    """A k-d tree of transit stops, for nearest-stop lookups.
+
+    The index holds only stop ids and coordinates. Its signature is the number of stops,
+    the largest stop id and the latest change time at build time, which together change
+    whenever stops are added, deleted, moved or renamed.
+    """
+
+    def __init__(self, stops, signature=None):
+        self.signature = signature
+        self.tree = KDTree((unit_vector(lat, lon), stop_id) for (stop_id, lat, lon) in stops
+                           if lat is not None and lon is not None)
+
+    def __len__(self):
+        return len(self.tree)
+
+    @staticmethod
+    def current_signature():
+        """The signature of the transit stops currently in the database."""
+        return tuple(
+            db.session.query(func.count(TransitStop.id), func.max(TransitStop.id),
+                             func.max(TransitStop.updated_at)).one())
+
+    @classmethod
+    def build(cls):
+        """Build an index from all transit stops in the database."""
+        signature = cls.current_signature()
+        stops = db.session.query(TransitStop.id, TransitStop.lat, TransitStop.lon)
+        return cls(stops, signature=signature)
+
+    def nearest(self, lat, lon):
+        """Find the nearest stop to a position, returning ``(stop_id, distance_km)``."""
+        stop_id, chord = self.tree.nearest(unit_vector(lat, lon))
+        if stop_id is None:
+            return None, float('inf')
+        return stop_id, chord_to_km(chord)
+
+
+def transit_index():
+    """The transit stop index for this worker, rebuilt if stops have changed."""
+    index = app.extensions.get('clapbot.transit_index')
+    if index is None or index.signature != TransitIndex.current_signature():
+        index = app.extensions['clapbot.transit_index'] = TransitIndex.build()
+    return index
+
+
+def invalidate_transit_index():
+    """Drop this worker's transit stop index, so that it is rebuilt on next use."""
+    app.extensions.pop('clapbot.transit_index', None)
 
 
 def find_nearest_transit_stop(listing):
     """Find the nearest transit stop to a listing."""
     if listing.lat is None or listing.lon is None:
         return
-    distance = float('inf')
-    closest_stop = None
-    for stop in TransitStop.query.all():
-        new_distance = coord_distance(listing.lat, listing.lon, stop.lat, stop.lon)
-        if distance > new_distance:
-            closest_stop = stop
-            distance = new_distance
-    listing.transit_stop = closest_stop
+    stop_id, _ = transit_index().nearest(listing.lat, listing.lon)
+    listing.transit_stop = TransitStop.query.get(stop_id) if stop_id is not None else None
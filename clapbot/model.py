@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import datetime as dt
 
 from .core import db
 
@@ -14,6 +15,11 @@ class TransitStop(db.Model):
     lat = db.Column(db.Float)
     lon = db.Column(db.Float)
 
+    #: When this stop was added or last changed, so that workers can tell their transit index is stale.
+    updated_at = db.Column(db.DateTime, default=dt.datetime.now, onupdate=dt.datetime.now)
+
+    __table_args__ = (db.UniqueConstraint('agency', 'stop_id', name='uq_transitstop_agency_stop_id'), )
+
 
 class UserListingInfo(db.Model):
     """Listing help information from the user."""
@@ -28,6 +34,8 @@ class UserListingInfo(db.Model):
     score = db.Column(db.Integer, default=0)
     notes = db.Column(db.Text, default="")
 
+    __table_args__ = (db.Index('ix_userlistinginfo_listing_score', listing_id, score), )
+
 
 def init_db():
     """Initialize the database."""
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Keyset pagination for listing tables.
+
+Rather than an ``OFFSET``, each page seeks past the sort key of the last row on
+the previous page, so deep pages cost the same as the first. The position is
+carried between requests in an opaque, signed cursor token.
+"""
+import collections
+import datetime as dt
+import json
+import time
+
+from flask import current_app as app
+from flask import request, abort
+from itsdangerous import URLSafeSerializer, BadData
+from sqlalchemy import and_, or_, func
+
+from .core import db
+from .model import UserListingInfo
+from .cl.model import Listing
+
+__all__ = ['Keyset', 'KeysetPage', 'LISTING_KEYSET', 'paginate', 'count_query']
+
+#: Sort key which stands in for a missing creation time.
+EPOCH = dt.datetime(1970, 1, 1)
+
+#: Format for datetimes in cursor tokens.
+CURSOR_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class Keyset:
+    """A unique sort key over several columns, all sorted in descending order.
+
+    Columns must be non-null, so nullable columns should be wrapped in ``coalesce``.
+    The last column should be unique (usually a primary key) so that the key is a
+    total ordering.
+    """
+
+    def __init__(self, *columns):
+        self.columns = [column.label(f'_keyset_{i}') for i, column in enumerate(columns)]
+
+    def order_by(self, query, reverse=False):
+        """Order a query by this key."""
+        return query.order_by(None).order_by(*[column.asc() if reverse else column.desc() for column in self.columns])
+
+    def seek(self, values, reverse=False):
+        """A predicate which selects rows after (or before, when reversed) the given key values."""
+        predicate = None
+        for column, value in reversed(list(zip(self.columns, values))):
+            column = column.element
+            beyond = column > value if reverse else column < value
+            predicate = beyond if predicate is None else or_(beyond, and_(column == value, predicate))
+        return predicate
+
+    def serializer(self):
+        return URLSafeSerializer(app.secret_key, salt='clapbot.pagination')
+
+    def dumps(self, values):
+        """Encode key values as a cursor token."""
+        values = [
+            value.strftime(CURSOR_DATETIME_FORMAT) if isinstance(value, dt.datetime) else value for value in values
+        ]
+        return self.serializer().dumps(values)
+
+    def loads(self, token):
+        """Decode a cursor token into key values, aborting with a 400 for invalid tokens."""
+        try:
+            values = self.serializer().loads(token)
+            if len(values) != len(self.columns):
+                raise BadData("Cursor has the wrong number of values.")
+            return [
+                dt.datetime.strptime(value, CURSOR_DATETIME_FORMAT) if column.type.python_type is dt.datetime else value
+                for column, value in zip(self.columns, values)
+            ]
+        except (BadData, TypeError, ValueError):
+            abort(400, "Invalid pagination cursor.")
+
+
+#: The sort order for listing tables, highest score and then newest first.
+LISTING_KEYSET = Keyset(
+    func.coalesce(UserListingInfo.score, 0),
+    func.coalesce(Listing.created, EPOCH),
+    Listing.id,
+)
+
+
+class KeysetPage:
+    """A single page of results from :func:`paginate`."""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None, estimated=False):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.estimated = estimated
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def paginate(query, keyset=LISTING_KEYSET, per_page=None):
+    """Paginate a query by a keyset, using the ``after`` and ``before`` cursors from the request.
+
+    The query must include every table referenced by the keyset.
+    """
+    if per_page is None:
+        per_page = request.args.get('per_page', 20, type=int)
+    per_page = max(1, min(per_page, app.config['CRAIGSLIST_PAGINATION_MAX_PER_PAGE']))
+
+    after = request.args.get('after')
+    before = request.args.get('before')
+    reverse = before is not None and after is None
+    cursor = before if reverse else after
+
+    page = keyset.order_by(query.add_columns(*keyset.columns), reverse=reverse)
+    if cursor is not None:
+        page = page.filter(keyset.seek(keyset.loads(cursor), reverse=reverse))
+    rows = page.limit(per_page + 1).all()
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if reverse:
+        rows.reverse()
+    items = [row[0] for row in rows]
+    first, last = (keyset.dumps(row[1:]) for row in (rows[0], rows[-1])) if rows else (None, None)
+
+    # Moving forward from a cursor implies there is a page before, and vice-versa.
+    if reverse:
+        has_next, has_prev = True, more
+    else:
+        has_next, has_prev = more, cursor is not None
+    next_cursor = last if has_next else None
+    prev_cursor = first if has_prev else None
+
+    total, estimated = count_query(query)
+    return KeysetPage(items, per_page, next_cursor, prev_cursor, total, estimated)
+
+
+def count_query(query):
+    """Count the rows in a query, following ``CRAIGSLIST_PAGINATION_COUNT``.
+
+    Returns a tuple of ``(total, estimated)``. The modes are
+
+    - ``exact``: run ``COUNT(*)`` for every page.
+    - ``cached``: run ``COUNT(*)`` and reuse the result for ``CRAIGSLIST_PAGINATION_COUNT_TTL`` seconds.
+    - ``estimate``: use the query planner's row estimate (PostgreSQL only, otherwise ``cached``).
+    - ``none``: don't count, the total is ``None``.
+    """
+    mode = app.config['CRAIGSLIST_PAGINATION_COUNT']
+    query = query.order_by(None)
+
+    if mode == 'none':
+        return None, False
+
+    if mode == 'estimate':
+        estimate = _estimate_count(query)
+        if estimate is not None:
+            return estimate, True
+        mode = 'cached'
+
+    if mode == 'cached':
+        cache = app.extensions.setdefault('clapbot.pagination_counts', collections.OrderedDict())
+        compiled = query.statement.compile()
+        key = (str(compiled), repr(sorted(compiled.params.items())))
+        expires, total = cache.get(key, (0, None))
+        now = time.monotonic()
+        if expires < now:
+            total = query.count()
+            cache[key] = (now + app.config['CRAIGSLIST_PAGINATION_COUNT_TTL'], total)
+            cache.move_to_end(key)
+            _prune_counts(cache, now, app.config['CRAIGSLIST_PAGINATION_COUNT_CACHE_SIZE'])
+        return total, False
+
+    if mode != 'exact':
+        raise ValueError(f"Unknown pagination count mode {mode!r}")
+    return query.count(), False
+
+
+def _prune_counts(cache, now, maxsize):
+    """Drop expired counts, and the oldest counts beyond ``maxsize``.
+
+    Counts are kept in the order they were made, and they all live for the same time,
+    so the expired ones are always at the front.
+    """
+    while cache:
+        key, (expires, _) = next(iter(cache.items()))
+        if expires >= now and len(cache) <= maxsize:
+            break
+        del cache[key]
+
+
+def _estimate_count(query):
+    """Estimate the rows in a query from the PostgreSQL query planner."""
+    connection = db.session.connection()
+    if connection.dialect.name != 'postgresql':
+        return None
+
+    compiled = query.statement.compile(dialect=connection.dialect)
+    plan = connection.execute('EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
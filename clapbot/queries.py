@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Shared query options for views which render lists of listings.
+"""
+from sqlalchemy.orm import defer, selectinload
+
+from .cl.model import Listing
+
+__all__ = ['listing_list_options', 'listing_list_query']
+
+
+def listing_list_options():
+    """Query options for listing tables.
+
+    Listing tables never show the listing body or raw page, and render every
+    relationship in ``_entry.html``, so those are loaded up front, one query per
+    relationship for the whole page.
+    """
+    return (
+        defer(Listing.text),
+        defer(Listing.page),
+        selectinload(Listing.images),
+        selectinload(Listing.tags),
+        selectinload(Listing.site),
+        selectinload(Listing.area),
+        selectinload(Listing.transit_stop),
+    )
+
+
+def listing_list_query():
+    """A listing query for listing tables.
+
+    Options have to be applied before the query is wrapped with ``from_self``, so that
+    the inner query doesn't select deferred columns either.
+    """
+    return Listing.query.options(*listing_list_options())
@@ -169,7 +169,7 @@ def bd_ba(listing):
 @scorer
 def price(listing):
     """Score based on number of bedrooms."""
-    if listing.price is None:
+    if listing.price is None or listing.price <= 0:
         return -4000
     score = 0.0
     bedrooms = 1.0 if listing.bedrooms is None else listing.bedrooms
@@ -1,4 +1,3 @@
-import datetime as dt
 import logging
 
 from flask import Blueprint, redirect
@@ -11,6 +10,7 @@ from ..cl import model as m
 from ..cl import tasks as t
 
 from .model import HousingSearch, Status
+from .plan import plan_scrapes, active_searches
 
 bp = Blueprint("search.api", __name__)
 
@@ -22,16 +22,15 @@ def record_from_search(search):
     return m.scrape.Record(area=search.area, category=search.category)
 
 
-def get_scrape_records():
-    """Iterate over the scrape records for enabled housing searches."""
+def get_scrape_plans():
+    """Iterate over scrape plans for enabled housing searches, one per area and category."""
+    return plan_scrapes(active_searches())
 
-    # Select only areas/categories which appear in searches
-    query = HousingSearch.query.filter(HousingSearch.enabled == True,
-                                       HousingSearch.expiration_date >= dt.datetime.now())
 
-    for area, category in set(
-        (hs.area, hs.category) for hs in query if hs.status == Status.ACTIVE and hs.area.site.enabled):
-        yield m.scrape.Record(area=area, category=category)
+def get_scrape_records():
+    """Iterate over the scrape records for enabled housing searches."""
+    for plan in get_scrape_plans():
+        yield plan.record()
 
 
 @bp.route('/scrape')
@@ -39,11 +38,13 @@ def scrape():
     """Launch a CL scrape"""
 
     tasks = []
-    for record in get_scrape_records():
+    for plan in get_scrape_plans():
+        record = plan.record()
         db.session.add(record)
         db.session.flush()
-        logger.info(f"Setting up scrape for {record}")
-        tasks.append(t.scrape.s(record.id))
+        logger.info(f"Setting up scrape for {record} with filters {plan.filters}, "
+                    f"for searches {[search.id for search in plan.searches]}")
+        tasks.append(t.scrape.s(record.id, filters=plan.filters))
 
     db.session.commit()
 
@@ -71,7 +72,7 @@ def scrape_single(identifier):
     db.session.add(record)
     db.session.flush()
 
-    task = t.scrape.s(record.id)
+    task = t.scrape.s(record.id, filters=search.filters)
 
     db.session.commit()
 
@@ -1,6 +1,7 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField, DateField, TextAreaField, IntegerField, HiddenField, FormField, BooleanField
-from wtforms.validators import DataRequired, Email, EqualTo, ValidationError, NumberRange
+from wtforms import FloatField
+from wtforms.validators import DataRequired, Email, EqualTo, ValidationError, NumberRange, Optional
 from wtforms.ext.sqlalchemy.fields import QuerySelectField
 
 from ..cl.model import site
@@ -38,6 +39,8 @@ class HousingSearchEditForm(FlaskForm):
     price_min = IntegerField('Max Price ($)', validators=[NumberRange(min=0), DataRequired()])
     price_max = IntegerField('Min Price ($)', validators=[NumberRange(min=0), DataRequired()])
 
+    work_radius = FloatField('Distance to work (km)', validators=[Optional(), NumberRange(min=0)])
+
     area = QuerySelectField(
         'Area', query_factory=enabled_areas, allow_blank=True, blank_text='ALL - (Search all areas)')
     category = QuerySelectField('Category', validators=[DataRequired()], query_factory=enabled_categories)
@@ -62,13 +65,14 @@ class SelectBoundingBoxForm(FlaskForm):
     submit = SubmitField('Save')
 
     @classmethod
-    def make(cls, bboxes):
-        """Make a series of checkboxes for bboxes."""
+    def make(cls, bboxes, selected=()):
+        """Make a series of checkboxes for bboxes, checking those which are selected."""
 
         class Form(cls):
             pass
 
         for bbox in bboxes:
-            setattr(Form, _as_attr(bbox.name), BooleanField(label=bbox.name, render_kw={'data-bbox': bbox.id}))
+            field = BooleanField(label=bbox.name, default=bbox in selected, render_kw={'data-bbox': bbox.id})
+            setattr(Form, _as_attr(bbox.name), field)
 
         return Form
@@ -1,11 +1,19 @@
 import enum
 import datetime as dt
 
+from flask import current_app as app
 from sqlalchemy.orm import validates
 from sqlalchemy import and_
 
 from ...core import db
 from ...cl.model import site, Listing
+from ...geo import in_any_bbox, within_km
+
+housingsearchbboxes = db.Table(
+    'housingsearch_bboxes',
+    db.Column('housingsearch_id', db.Integer, db.ForeignKey('housingsearch.id'), primary_key=True),
+    db.Column('bbox_id', db.Integer, db.ForeignKey('boundingbox.id'), primary_key=True),
+)
 
 
 class Status(enum.Enum):
@@ -38,6 +46,12 @@ class HousingSearch(db.Model):
 
     require_images = db.Column(db.Boolean, default=True)
 
+    #: Only match listings within this distance (in km) of work.
+    work_radius = db.Column(db.Float)
+
+    #: Only match listings inside one of these bounding boxes, when there are any.
+    bboxes = db.relationship('BoundingBox', secondary=housingsearchbboxes, backref=db.backref('searches'))
+
     cl_site = db.Column(db.Integer(), db.ForeignKey('clsite.id'))
     site = db.relationship('site.Site', backref=db.backref("searches", uselist=True, lazy='dynamic'))
     cl_area = db.Column(db.Integer(), db.ForeignKey('clarea.id'))
@@ -55,7 +69,7 @@ class HousingSearch(db.Model):
         # pylint: disable=unused-argument
         if isinstance(value, site.Category):
             return value
-        value = site.Category.query.filter_by(name=value.lower()).one_or_none()
+        value = site.get_registry().category(value)
         if value is None:
             raise ValueError("Invalid craigslist category")
         return value
@@ -66,7 +80,7 @@ class HousingSearch(db.Model):
         # pylint: disable=unused-argument
         if isinstance(value, site.Site):
             return value
-        value = site.Site.query.filter_by(name=value.lower()).one_or_none()
+        value = site.get_registry().site(value)
         if value is None:
             raise ValueError("Invalid craigslist site")
         return value
@@ -98,10 +112,20 @@ class HousingSearch(db.Model):
 
     def query_predicate(self):
         """Return the listing predicate appropriate for this search."""
-        predicate = and_(
-            Listing.price.between(self.price_min, self.price_max), Listing.area == self.area,
-            Listing.category == self.category)
+        predicate = and_(Listing.area == self.area, Listing.category == self.category)
+        # Searches are scraped together with looser filters, so prices are checked here.
+        if self.price_min:
+            predicate = and_(predicate, Listing.price >= self.price_min)
+        if self.price_max:
+            predicate = and_(predicate, Listing.price <= self.price_max)
         if self.require_images:
             pass
             # TODO: This should actually ensure that images are included.
+        if self.bboxes:
+            predicate = and_(predicate, in_any_bbox(Listing.lat, Listing.lon, self.bboxes))
+        if self.work_radius:
+            predicate = and_(
+                predicate,
+                within_km(Listing.lat, Listing.lon, app.config['CRAIGSLIST_SCORE_WORK_LAT'],
+                          app.config['CRAIGSLIST_SCORE_WORK_LON'], self.work_radius))
         return predicate
@@ -0,0 +1,61 @@
+"""
+Plan craigslist scrapes for housing searches.
+
+Searches in the same area and category share one scrape. The scrape uses the
+loosest filters which still cover every search in the group, so craigslist is
+only asked for each feed once, and each search picks out its own listings from
+what was scraped with :meth:`~clapbot.search.model.HousingSearch.query_predicate`.
+"""
+import collections
+import datetime as dt
+from typing import NamedTuple, Any, Dict, List
+
+from ..cl.model.scrape import Record
+from .model import HousingSearch, Status
+
+__all__ = ['ScrapePlan', 'merge_filters', 'plan_scrapes', 'active_searches']
+
+
+def merge_filters(filters):
+    """The narrowest filters which accept everything accepted by any of some search filters.
+
+    A bound on price is only kept when every search has one, and images are only
+    required when every search requires them.
+    """
+    filters = list(filters)
+    merged = {}
+    if filters and all('min_price' in f for f in filters):
+        merged['min_price'] = min(f['min_price'] for f in filters)
+    if filters and all('max_price' in f for f in filters):
+        merged['max_price'] = max(f['max_price'] for f in filters)
+    if filters and all(f.get('has_image') for f in filters):
+        merged['has_image'] = True
+    return merged
+
+
+class ScrapePlan(NamedTuple):
+    """A single scrape of an area and category, on behalf of some searches."""
+    area: Any
+    category: Any
+    filters: Dict[str, Any]
+    searches: List[HousingSearch]
+
+    def record(self):
+        """A new scrape record for this plan."""
+        return Record(area=self.area, category=self.category)
+
+
+def plan_scrapes(searches):
+    """Group searches by area and category, with one scrape plan for each group."""
+    groups = collections.OrderedDict()
+    for search in searches:
+        groups.setdefault((search.cl_area, search.cl_category), []).append(search)
+    for group in groups.values():
+        yield ScrapePlan(group[0].area, group[0].category, merge_filters(search.filters for search in group), group)
+
+
+def active_searches():
+    """Searches which should be scraped now."""
+    query = HousingSearch.query.filter(HousingSearch.enabled.is_(True),
+                                       HousingSearch.expiration_date >= dt.datetime.now())
+    return [hs for hs in query if hs.status == Status.ACTIVE and hs.area.site.enabled]
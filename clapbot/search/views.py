@@ -2,7 +2,7 @@ import datetime as dt
 import io
 
 from flask import Blueprint, render_template, current_app
-from flask import redirect, url_for, flash
+from flask import redirect, url_for, flash, abort
 
 from flask_login import current_user, login_required
 
@@ -10,6 +10,10 @@ from sqlalchemy import or_
 
 from ..core import db
 from ..cl.model import Listing, scrape
+from ..model import UserListingInfo
+from ..queries import listing_list_query
+from ..pagination import paginate
+from .. import location
 from .model import HousingSearch
 from .model.location import BoundingBox, export_bboxes, iter_bboxes
 from .forms import HousingSearchCreate, HousingSearchEditForm, BoundingBoxEditor, SelectBoundingBoxForm
@@ -83,12 +87,13 @@ def view(identifier):
     """View the results of a single search"""
 
     hs = HousingSearch.query.get_or_404(identifier)
-    listings = Listing.query.filter(hs.query_predicate()).order_by(Listing.created.desc())
+    listings = listing_list_query().outerjoin(UserListingInfo, UserListingInfo.listing_id == Listing.id)
+    listings = listings.filter(hs.query_predicate())
 
     record = scrape.Record.query.filter(scrape.Record.area == hs.area, scrape.Record.category == hs.category).order_by(
         scrape.Record.created_at, scrape.Record.status != scrape.Status.pending).first()
 
-    return render_template('search/view.html', search=hs, listings=listings, record=record)
+    return render_template('search/view.html', search=hs, pagination=paginate(listings), record=record)
 
 
 @bp.route('/')
@@ -100,9 +105,10 @@ def home():
     for hs in HousingSearch.query.filter(HousingSearch.owner == current_user):
         predicates.append(hs.query_predicate())
 
-    listings = Listing.query.filter(or_(*predicates)).order_by(Listing.created.desc())
+    listings = listing_list_query().outerjoin(UserListingInfo, UserListingInfo.listing_id == Listing.id)
+    listings = listings.filter(or_(*predicates))
 
-    return render_template('search/home.html', listings=listings)
+    return render_template('search/home.html', pagination=paginate(listings))
 
 
 @bp.route('/bbox/create', methods=['GET', 'POST'])
@@ -120,6 +126,7 @@ def create_bbox():
             db.session.add(bbox)
 
         db.session.commit()
+        location.invalidate_bbox_index()
         return redirect(url_for('user.profile', username=current_user.username))
 
     else:
@@ -139,14 +146,21 @@ def set_bbox(identifier):
     """A view for setting the bboxes which belong to a search"""
 
     hs = HousingSearch.query.get_or_404(identifier)
+    if hs.owner != current_user:
+        abort(404)
 
     bboxes = BoundingBox.query.filter(BoundingBox.user == current_user).all()
 
-    form = SelectBoundingBoxForm.make(bboxes)
+    form = SelectBoundingBoxForm.make(bboxes, selected=hs.bboxes)()
 
     if form.validate_on_submit():
 
         selected = []
-        for field in form.fields:
+        for field in form:
             if field.type == "BooleanField" and field.data:
                 selected.append(BoundingBox.query.get_or_404(field.render_kw['data-bbox']))
+        hs.bboxes = selected
+        db.session.commit()
+        return redirect(url_for('search.view', identifier=hs.id))
+
+    return render_template('search/bboxes.html', form=form, search=hs)
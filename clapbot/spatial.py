@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Spatial indexes for geographic lookups.
+"""
+import collections
+import itertools
+import math
+
+__all__ = ['EARTH_RADIUS_KM', 'unit_vector', 'chord_to_km', 'KDTree', 'BoxIndex']
+
+#: Earth radius (in km) used for all distance calculations.
+EARTH_RADIUS_KM = 6367
+
+
+def unit_vector(lat, lon):
+    """Convert a latitude and longitude (in degrees) to a point on the unit sphere."""
+    lat, lon = math.radians(lat), math.radians(lon)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def chord_to_km(chord):
+    """Convert a chord length on the unit sphere to a great-circle distance in km."""
+    return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2.0, 1.0))
+
+
+class KDTree:
+    """A static k-d tree over points on the unit sphere.
+
+    Points are given as ``(vector, payload)`` pairs, where vectors come from
+    :func:`unit_vector`. Chord distance orders points the same way as great-circle
+    distance, so nearest-neighbor queries in 3D are exact on the sphere.
+    """
+
+    def __init__(self, points):
+        points = list(points)
+        self._size = len(points)
+        self._root = self._build(points, 0)
+
+    def __len__(self):
+        return self._size
+
+    @classmethod
+    def _build(cls, points, depth):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda point: point[0][axis])
+        median = len(points) // 2
+        vector, payload = points[median]
+        left = cls._build(points[:median], depth + 1)
+        right = cls._build(points[median + 1:], depth + 1)
+        return (vector, payload, axis, left, right)
+
+    def nearest(self, vector):
+        """Find the nearest point to a vector, returning ``(payload, chord)``.
+
+        Returns ``(None, inf)`` when the tree is empty.
+        """
+        best = [None, float('inf')]
+
+        def search(node):
+            if node is None:
+                return
+            point, payload, axis, left, right = node
+            distance = sum((a - b)**2 for a, b in zip(vector, point))
+            if distance < best[1]:
+                best[:] = [payload, distance]
+            diff = vector[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            search(near)
+            if diff * diff < best[1]:
+                search(far)
+
+        search(self._root)
+        return best[0], math.sqrt(best[1])
+
+
+class BoxIndex:
+    """A uniform grid over latitude and longitude boxes, for point-in-box queries.
+
+    Boxes are given as ``((lat_min, lat_max, lon_min, lon_max), payload)`` pairs. Each box
+    is listed in every grid cell it overlaps, so a point is only tested against the boxes in
+    its own cell. Boxes which would cover more than ``max_cells`` cells are tested against
+    every point instead.
+    """
+
+    def __init__(self, boxes, cell_size=0.1, max_cells=1024):
+        self.cell_size = cell_size
+        self._size = 0
+        self._large = []
+        cells = collections.defaultdict(list)
+        for (lat_min, lat_max, lon_min, lon_max), payload in boxes:
+            if None in (lat_min, lat_max, lon_min, lon_max):
+                continue
+            self._size += 1
+            box = (lat_min, lat_max, lon_min, lon_max, payload)
+            rows = range(self._cell(lat_min), self._cell(lat_max) + 1)
+            columns = range(self._cell(lon_min), self._cell(lon_max) + 1)
+            if len(rows) * len(columns) > max_cells:
+                self._large.append(box)
+                continue
+            for cell in itertools.product(rows, columns):
+                cells[cell].append(box)
+        self._cells = dict(cells)
+
+    def __len__(self):
+        return self._size
+
+    def _cell(self, value):
+        return math.floor(value / self.cell_size)
+
+    def query(self, lat, lon):
+        """Payloads of every box containing a point."""
+        candidates = self._cells.get((self._cell(lat), self._cell(lon)), ())
+        return [
+            payload for (lat_min, lat_max, lon_min, lon_max, payload) in itertools.chain(candidates, self._large)
+            if lat_min <= lat <= lat_max and lon_min <= lon <= lon_max
+        ]
+
+    def contains(self, lat, lon):
+        """Whether any box contains a point."""
+        return bool(self.query(lat, lon))
+
+    def join(self, points):
+        """Match ``(lat, lon, payload)`` points against the boxes.
+
+        Yields ``(point_payload, box_payload)`` for every box containing each point. Points
+        without a position are skipped.
+        """
+        for lat, lon, payload in points:
+            if lat is None or lon is None:
+                continue
+            for box in self.query(lat, lon):
+                yield payload, box
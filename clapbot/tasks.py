@@ -62,6 +62,26 @@ def location_info(listing_id):
     db.session.commit()
 
 
+@celery.task(ignore_result=True)
+def location_info_batch(listing_ids):
+    """Find the nearest stop and the bounding boxes for a batch of listings.
+
+    Listings outside every bounding box are deleted when ``CRAIGSLIST_CHECK_BBOX`` is set.
+    """
+    listings = Listing.query.filter(Listing.id.in_(listing_ids)).all()
+    found = location.find_bboxes((listing.id, listing.lat, listing.lon) for listing in listings)
+    bbox_flag = app.config['CRAIGSLIST_CHECK_BBOX']
+    for listing in listings:
+        if bbox_flag and not found[listing.id]:
+            db.session.delete(listing)
+            del found[listing.id]
+        else:
+            location.find_nearest_transit_stop(listing)
+    db.session.flush()
+    location.assign_bboxes(found)
+    db.session.commit()
+
+
 @celery.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
     # pylint: disable=unused-argument
@@ -70,3 +90,8 @@ def setup_periodic_tasks(sender, **kwargs):
         crontab(minute=0, hour='0-5,12-23'),
         notify.s(),
     )
+    # Compact old expiration checks once a day, overnight.
+    sender.add_periodic_task(
+        crontab(minute=30, hour=3),
+        tasks.compact_expiration_checks.s(),
+    )
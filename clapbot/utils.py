@@ -4,6 +4,8 @@ import math
 from flask import url_for, redirect, request
 from werkzeug.urls import url_parse
 
+from .spatial import EARTH_RADIUS_KM
+
 
 def coord_distance(lat1, lon1, lat2, lon2):
     """Finds the distance between two pairs of latitude and longitude."""
@@ -12,7 +14,7 @@ def coord_distance(lat1, lon1, lat2, lon2):
     dlat = lat2 - lat1
     a = math.sin(dlat / 2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2)**2
     c = 2 * math.asin(math.sqrt(a))
-    km = 6367 * c
+    km = EARTH_RADIUS_KM * c
     return km
 
 
@@ -5,8 +5,9 @@ import datetime as dt
 from functools import wraps
 from sqlalchemy import or_
 
-from flask import Blueprint, render_template, send_file, redirect, session, request, url_for, jsonify
+from flask import Blueprint, render_template, redirect, session, request, url_for, jsonify
 from flask import current_app as app
+from werkzeug.exceptions import NotFound
 
 from flask_login import login_required
 
@@ -14,10 +15,12 @@ import redis
 
 from .core import db, bcrypt
 from .model import UserListingInfo
-from .search.model import BoundingBox
 from .cl.model import Listing
 from .cl.model.image import Image
+from .cl.blobstore import send_blob
 from . import location
+from .queries import listing_list_query
+from .pagination import paginate
 
 bp = Blueprint('core', __name__)
 
@@ -63,34 +66,30 @@ def mailer():
 @login_required
 def latest():
     """Render the latest few as if they were to be emailed."""
-    listings = Listing.query.order_by(Listing.created.desc()).limit(20)
-    listings = filter_rejected(listings)
-    listings = listings.order_by(UserListingInfo.score.desc())
-    return render_template("home.html", listings=listings)
+    latest = db.session.query(Listing.id).order_by(Listing.created.desc()).limit(20).subquery()
+    listings = filter_rejected(listing_list_query().filter(Listing.id.in_(latest)))
+    return render_template("home.html", pagination=paginate(listings))
 
 
 @bp.route("/")
 @login_required
 def home():
     """Homepage"""
-    listings = Listing.query.order_by(Listing.created.desc())
-    listings = filter_rejected(listings)
-    listings = listings.order_by(UserListingInfo.score.desc())
-    return render_template("home.html", listings=listings)
+    listings = filter_rejected(listing_list_query())
+    return render_template("home.html", pagination=paginate(listings))
 
 
 def filter_rejected(listings):
     """Filter out rejected listings"""
-    joined = listings.from_self().join(UserListingInfo, isouter=True)
+    joined = listings.outerjoin(UserListingInfo, UserListingInfo.listing_id == Listing.id)
     return joined.filter(or_(~UserListingInfo.rejected, UserListingInfo.rejected == None))
 
 
 @bp.route("/mobile/")
 def mobile_start():
     """Mobile start page"""
-    listings = Listing.query.order_by(Listing.created.desc())
-    listings = filter_rejected(listings)
-    listing = listings.order_by(UserListingInfo.score.desc()).first()
+    listings = filter_rejected(listing_list_query())
+    listing = listings.order_by(UserListingInfo.score.desc(), Listing.created.desc()).first()
     return redirect(url_for("mobile", identifier=listing.id))
 
 
@@ -98,9 +97,9 @@ def mobile_start():
 def mobile(identifier):
     """A mobile view, for a single listing."""
     listing = Listing.query.get_or_404(identifier)
-    prev_lisitng = Listing.query.filter(Listing.created < listing.created).order_by(Listing.created.desc())
+    prev_lisitng = listing_list_query().filter(Listing.created < listing.created).order_by(Listing.created.desc())
     prev_lisitng = prev_lisitng.limit(1).one_or_none()
-    next_lisitng = Listing.query.filter(Listing.created > listing.created).order_by(Listing.created.asc())
+    next_lisitng = listing_list_query().filter(Listing.created > listing.created).order_by(Listing.created.asc())
     next_lisitng = next_lisitng.limit(1).one_or_none()
     return render_template("mobile.html", listing=listing, previous_listing=prev_lisitng, next_listing=next_lisitng)
 
@@ -116,32 +115,32 @@ def mobile_starred(identifier):
 def image(identifier):
     """Serve an image from the local database."""
     img = Image.query.get_or_404(identifier)
-    if img.full is not None:
-        return send_file(io.BytesIO(img.full), mimetype='image/jpeg')
-    else:
-        return redirect(img.url)
+    if img.full_digest is not None:
+        try:
+            return send_blob(img.full_digest, mimetype='image/jpeg')
+        except NotFound:
+            pass
+    return redirect(img.url)
 
 
 @bp.route("/image/<int:identifier>/thumbnail.jpg")
 def thumbnail(identifier):
     """docstring for thumbnail"""
     img = Image.query.get_or_404(identifier)
-    if img.thumbnail is not None and len(img.thumbnail):
-        return send_file(io.BytesIO(img.thumbnail), mimetype='image/jpeg')
-    else:
-        return redirect(img.thumbnail_url)
+    if img.thumbnail_digest is not None and img.thumbnail_size:
+        try:
+            return send_blob(img.thumbnail_digest, mimetype='image/jpeg')
+        except NotFound:
+            pass
+    return redirect(img.thumbnail_url)
 
 
 @bp.route("/listing/starred")
 @login_required
 def starred():
     """Starred lisitngs"""
-    listings = Listing.query.order_by(Listing.created.desc())
-    listings = listings.from_self().join(
-        UserListingInfo, isouter=True).filter(
-            or_(~UserListingInfo.rejected, UserListingInfo.rejected == None), UserListingInfo.starred == True)
-    listings = listings.order_by(UserListingInfo.score.desc())
-    return render_template("home.html", listings=listings, title='Starred', active_page='starred')
+    listings = filter_rejected(listing_list_query()).filter(UserListingInfo.starred == True)
+    return render_template("home.html", pagination=paginate(listings), title='Starred', active_page='starred')
 
 
 @bp.route("/listing/<int:id>/star", methods=['POST'])
@@ -204,9 +203,9 @@ def bboxes():
     """Update the bounding boxes."""
     if request.method == 'POST':
         bboxes = io.StringIO(request.form.get('bboxes', ''))
-        BoundingBox.query.delete()
+        location.delete_bounding_boxes()
         location.import_bounding_boxes(bboxes)
-    return redirect(url_for('settings'))
+    return redirect(url_for('core.settings'))
 
 
 @bp.route("/settings/")
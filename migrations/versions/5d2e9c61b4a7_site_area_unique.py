@@ -0,0 +1,45 @@
+"""Unique site and area names
+
+Revision ID: 5d2e9c61b4a7
+Revises: bc3c752aa2d8
+Create Date: 2026-10-18 16:12:44.208319
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '5d2e9c61b4a7'
+down_revision = 'bc3c752aa2d8'
+branch_labels = None
+depends_on = None
+
+
+#: Columns which refer to sites and areas, and must be moved to the row which is kept for each duplicate.
+SITE_REFERENCES = [('clarea', 'site_id'), ('listing', 'cl_site'), ('housingsearch', 'cl_site')]
+AREA_REFERENCES = [('listing', 'cl_area'), ('housingsearch', 'cl_area'), ('scraperecord', 'cl_area')]
+
+
+def _deduplicate(table, columns, references):
+    """Keep the oldest row for each value of some columns, moving references to the others onto it."""
+    same = ' AND '.join(f'k.{column} = d.{column}' for column in columns)
+    keep = f'(SELECT min(k.id) FROM {table} k WHERE {same})'
+    duplicates = f'SELECT d.id FROM {table} d WHERE d.id > {keep}'
+    for referrer, column in references:
+        op.execute(f"""
+            UPDATE {referrer} SET {column} = (SELECT {keep} FROM {table} d WHERE d.id = {referrer}.{column})
+            WHERE {column} IN ({duplicates})
+        """)
+    op.execute(f"DELETE FROM {table} WHERE id IN (SELECT id FROM ({duplicates}) AS duplicates)")
+
+
+def upgrade():
+    # Sites first, since merging sites can make their areas into duplicates.
+    _deduplicate('clsite', ['name'], SITE_REFERENCES)
+    _deduplicate('clarea', ['site_id', 'name'], AREA_REFERENCES)
+    op.create_unique_constraint('uq_clsite_name', 'clsite', ['name'])
+    op.create_unique_constraint('uq_clarea_site_id_name', 'clarea', ['site_id', 'name'])
+
+
+def downgrade():
+    op.drop_constraint('uq_clarea_site_id_name', 'clarea', type_='unique')
+    op.drop_constraint('uq_clsite_name', 'clsite', type_='unique')
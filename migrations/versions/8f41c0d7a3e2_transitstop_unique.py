@@ -0,0 +1,31 @@
+"""Unique transit stops per agency
+
+Revision ID: 8f41c0d7a3e2
+Revises: 5d2e9c61b4a7
+Create Date: 2026-10-18 17:03:19.551872
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '8f41c0d7a3e2'
+down_revision = '5d2e9c61b4a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Importing a feed twice could insert the same stop twice. Keep the oldest row for each
+    # stop, moving listings onto it, before the constraint is created.
+    keep = "(SELECT min(k.id) FROM transitstop k WHERE k.agency = d.agency AND k.stop_id = d.stop_id)"
+    duplicates = f"SELECT d.id FROM transitstop d WHERE d.id > {keep}"
+    op.execute(f"""
+        UPDATE listing SET transit_stop_id = (SELECT {keep} FROM transitstop d WHERE d.id = listing.transit_stop_id)
+        WHERE transit_stop_id IN ({duplicates})
+    """)
+    op.execute(f"DELETE FROM transitstop WHERE id IN (SELECT id FROM ({duplicates}) AS duplicates)")
+    op.create_unique_constraint('uq_transitstop_agency_stop_id', 'transitstop', ['agency', 'stop_id'])
+
+
+def downgrade():
+    op.drop_constraint('uq_transitstop_agency_stop_id', 'transitstop', type_='unique')
@@ -0,0 +1,48 @@
+"""Geographic filters for housing searches
+
+Revision ID: a7c3e5f19d42
+Revises: 8f41c0d7a3e2
+Create Date: 2026-10-18 17:48:31.027716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e5f19d42'
+down_revision = '8f41c0d7a3e2'
+branch_labels = None
+depends_on = None
+
+
+def _has_earthdistance():
+    """Whether the earthdistance extension can be installed on this server."""
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return False
+    return bind.execute(sa.text("SELECT 1 FROM pg_available_extensions WHERE name = 'earthdistance'")).scalar()
+
+
+def upgrade():
+    op.add_column('housingsearch', sa.Column('work_radius', sa.Float(), nullable=True))
+    op.create_table(
+        'housingsearch_bboxes',
+        sa.Column('housingsearch_id', sa.Integer(), nullable=False),
+        sa.Column('bbox_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['bbox_id'], ['boundingbox.id'], ),
+        sa.ForeignKeyConstraint(['housingsearch_id'], ['housingsearch.id'], ),
+        sa.PrimaryKeyConstraint('housingsearch_id', 'bbox_id'))
+    op.create_index('ix_listing_lat_lon', 'listing', ['lat', 'lon'])
+
+    # Used when CRAIGSLIST_GEO_BACKEND = 'earthdistance'.
+    if _has_earthdistance():
+        op.execute("CREATE EXTENSION IF NOT EXISTS cube")
+        op.execute("CREATE EXTENSION IF NOT EXISTS earthdistance")
+        op.execute("CREATE INDEX ix_listing_earth ON listing USING gist (ll_to_earth(lat, lon))")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_listing_earth")
+    op.drop_index('ix_listing_lat_lon', table_name='listing')
+    op.drop_table('housingsearch_bboxes')
+    op.drop_column('housingsearch', 'work_radius')
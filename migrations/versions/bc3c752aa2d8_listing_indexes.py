@@ -0,0 +1,40 @@
+"""Indexes for listing queries
+
+Revision ID: bc3c752aa2d8
+Revises: eab3b2aa71f7
+Create Date: 2026-10-18 11:40:02.571904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'bc3c752aa2d8'
+down_revision = 'eab3b2aa71f7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_listing_created', 'listing', ['created'])
+    op.create_index('ix_listing_area_category_price', 'listing', ['cl_area', 'cl_category', 'price'])
+    op.create_index('ix_listing_unexpired', 'listing', ['id'], postgresql_where=sa.text('expired IS NULL'))
+    op.create_index(
+        'ix_listing_unnotified_created',
+        'listing', ['created'],
+        postgresql_where=sa.text('NOT notified AND transit_stop_id IS NOT NULL'))
+    op.create_index('ix_listingexpirationcheck_listing_created', 'listingexpirationcheck', ['listing_id', 'created'])
+    op.create_index('ix_userlistinginfo_listing_score', 'userlistinginfo', ['listing_id', 'score'])
+    op.create_index('ix_tags_listing_id', 'tags', ['listing_id'])
+    op.create_index('ix_images_listing_id', 'images', ['listing_id'])
+
+
+def downgrade():
+    op.drop_index('ix_images_listing_id', table_name='images')
+    op.drop_index('ix_tags_listing_id', table_name='tags')
+    op.drop_index('ix_userlistinginfo_listing_score', table_name='userlistinginfo')
+    op.drop_index('ix_listingexpirationcheck_listing_created', table_name='listingexpirationcheck')
+    op.drop_index('ix_listing_unnotified_created', table_name='listing')
+    op.drop_index('ix_listing_unexpired', table_name='listing')
+    op.drop_index('ix_listing_area_category_price', table_name='listing')
+    op.drop_index('ix_listing_created', table_name='listing')
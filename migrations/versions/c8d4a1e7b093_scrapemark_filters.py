@@ -0,0 +1,31 @@
+"""Scrape marks for each set of filters
+
+Revision ID: c8d4a1e7b093
+Revises: f3b8d06a4c21
+Create Date: 2026-10-18 22:31:19.442870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c8d4a1e7b093'
+down_revision = 'f3b8d06a4c21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing marks could have been moved by scrapes with any filters, so scrapes start again without them.
+    op.execute("DELETE FROM scrapemark")
+    op.drop_constraint('uq_scrapemark_area_category', 'scrapemark', type_='unique')
+    op.add_column('scrapemark', sa.Column('filters', sa.String(length=255), nullable=False))
+    op.create_unique_constraint('uq_scrapemark_area_category_filters', 'scrapemark',
+                                ['cl_area', 'cl_category', 'filters'])
+
+
+def downgrade():
+    op.execute("DELETE FROM scrapemark")
+    op.drop_constraint('uq_scrapemark_area_category_filters', 'scrapemark', type_='unique')
+    op.drop_column('scrapemark', 'filters')
+    op.create_unique_constraint('uq_scrapemark_area_category', 'scrapemark', ['cl_area', 'cl_category'])
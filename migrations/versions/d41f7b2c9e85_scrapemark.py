@@ -0,0 +1,43 @@
+"""Scrape high-water marks
+
+Revision ID: d41f7b2c9e85
+Revises: a7c3e5f19d42
+Create Date: 2026-10-18 18:21:07.664215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'd41f7b2c9e85'
+down_revision = 'a7c3e5f19d42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'scrapemark',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('cl_area', sa.Integer(), nullable=False),
+        sa.Column('cl_category', sa.Integer(), nullable=False),
+        sa.Column('cl_id', sa.BigInteger(), nullable=False),
+        sa.Column('posted_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['cl_area'], ['clarea.id'], ),
+        sa.ForeignKeyConstraint(['cl_category'], ['clcategory.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('cl_area', 'cl_category', name='uq_scrapemark_area_category'))
+
+    # Start from the newest listing already stored in each area and category.
+    op.execute("""
+        INSERT INTO scrapemark (cl_area, cl_category, cl_id, posted_at, updated_at)
+        SELECT DISTINCT ON (cl_area, cl_category) cl_area, cl_category, cl_id, created, now()
+        FROM listing
+        WHERE cl_area IS NOT NULL AND cl_category IS NOT NULL AND cl_id IS NOT NULL AND created IS NOT NULL
+        ORDER BY cl_area, cl_category, created DESC, cl_id DESC
+    """)
+
+
+def downgrade():
+    op.drop_table('scrapemark')
@@ -0,0 +1,54 @@
+"""Latest expiration check on listings, and expiration check summaries
+
+Revision ID: e5a9c27d1f36
+Revises: d41f7b2c9e85
+Create Date: 2026-10-18 19:42:15.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e5a9c27d1f36'
+down_revision = 'd41f7b2c9e85'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('listing', sa.Column('last_checked_at', sa.DateTime(), nullable=True))
+    op.add_column('listing', sa.Column('last_status', sa.Integer(), nullable=True))
+    op.create_table(
+        'listingexpirationsummary',
+        sa.Column('listing_id', sa.Integer(), nullable=False),
+        sa.Column('first_checked_at', sa.DateTime(), nullable=True),
+        sa.Column('last_checked_at', sa.DateTime(), nullable=True),
+        sa.Column('checks', sa.Integer(), nullable=True),
+        sa.Column('missing', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['listing_id'], ['listing.id'], ),
+        sa.PrimaryKeyConstraint('listing_id'))
+
+    # Copy the latest check of each listing from the check history.
+    op.execute("""
+        UPDATE listing SET
+            last_checked_at = (
+                SELECT max(c.created) FROM listingexpirationcheck c WHERE c.listing_id = listing.id),
+            last_status = (
+                SELECT c.response_status FROM listingexpirationcheck c WHERE c.listing_id = listing.id
+                ORDER BY c.created DESC LIMIT 1)
+        WHERE EXISTS (SELECT 1 FROM listingexpirationcheck c WHERE c.listing_id = listing.id)
+    """)
+
+    op.drop_index('ix_listing_unexpired', table_name='listing')
+    op.create_index(
+        'ix_listing_unexpired_last_checked',
+        'listing', [sa.text('(last_checked_at IS NOT NULL)'), 'last_checked_at'],
+        postgresql_where=sa.text('expired IS NULL'))
+
+
+def downgrade():
+    op.drop_index('ix_listing_unexpired_last_checked', table_name='listing')
+    op.create_index('ix_listing_unexpired', 'listing', ['id'], postgresql_where=sa.text('expired IS NULL'))
+    op.drop_table('listingexpirationsummary')
+    op.drop_column('listing', 'last_status')
+    op.drop_column('listing', 'last_checked_at')
@@ -0,0 +1,31 @@
+"""Image blob store digests
+
+Revision ID: eab3b2aa71f7
+Revises: 6665b177a29e
+Create Date: 2026-10-18 09:12:41.218733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'eab3b2aa71f7'
+down_revision = '6665b177a29e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The legacy 'full' and 'thumbnail' columns are kept until
+    # `flask migrate-images` has moved their data to the blob store.
+    op.add_column('image', sa.Column('full_digest', sa.String(length=64), nullable=True))
+    op.add_column('image', sa.Column('full_size', sa.Integer(), nullable=True))
+    op.add_column('image', sa.Column('thumbnail_digest', sa.String(length=64), nullable=True))
+    op.add_column('image', sa.Column('thumbnail_size', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('image', 'thumbnail_size')
+    op.drop_column('image', 'thumbnail_digest')
+    op.drop_column('image', 'full_size')
+    op.drop_column('image', 'full_digest')
@@ -0,0 +1,23 @@
+"""Transit stop change times
+
+Revision ID: f3b8d06a4c21
+Revises: e5a9c27d1f36
+Create Date: 2026-10-18 21:05:43.180372
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8d06a4c21'
+down_revision = 'e5a9c27d1f36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('transitstop', sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('transitstop', 'updated_at')
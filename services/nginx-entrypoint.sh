@@ -16,6 +16,9 @@ USE_STATIC_URL=${STATIC_URL:-'/static'}
 USE_STATIC_PATH=${STATIC_PATH:-'/app/static'}
 # Get the listen port for Nginx, default to 80
 USE_LISTEN_PORT=${LISTEN_PORT:-80}
+# Get the internal URL and path for image blobs sent with X-Accel-Redirect
+USE_BLOB_URL=${BLOB_URL:-'/_blobs'}
+USE_BLOB_PATH=${BLOB_PATH:-'/app/data/cl/blobs'}
 
 # Generate Nginx config first part using the environment variables
 echo "server {
@@ -29,6 +32,10 @@ echo "server {
     }
     location $USE_STATIC_URL {
         alias $USE_STATIC_PATH;
+    }
+    location $USE_BLOB_URL/ {
+        internal;
+        alias $USE_BLOB_PATH/;
     }" > /etc/nginx/conf.d/nginx.conf
 
 # If STATIC_INDEX is 1, serve / with /static/index.html directly (or the static URL configured)
@@ -4,7 +4,8 @@ import pytest
 
 from celery.result import AsyncResult, GroupResult
 
-from clapbot.cl import tasks
+from clapbot.cl import tasks, model
+from clapbot.cl.blobstore import get_blob_store
 
 # pylint: disable=unused-argument
 
@@ -30,6 +31,43 @@ def test_image(client, craigslist, image):
     assert response.status_code == 200
 
 
+def test_image_missing_blob(client, craigslist, image, app):
+    tasks.download_image(image)
+
+    # The image has digests, but the files behind them are gone.
+    with app.app_context():
+        store = get_blob_store()
+        img = model.Image.query.get(image)
+        for digest in {img.full_digest, img.thumbnail_digest}:
+            store.path(digest).unlink()
+
+    for path in ('full.jpg', 'thumbnail.jpg'):
+        response = client.get(f'{URL_PREFIX}/image/{image}/{path}')
+        assert response.status_code == 302
+        assert 'images.craigslist.org' in response.headers['Location']
+        response = client.get(f'/image/{image}/{path}')
+        assert response.status_code == 302
+
+
+def test_image_conditional(client, craigslist, image):
+
+    tasks.download_image(image)
+
+    response = client.get(f'{URL_PREFIX}/image/{image}/full.jpg')
+    assert response.status_code == 200
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age > 0
+    etag, weak = response.get_etag()
+    assert etag and not weak
+
+    response = client.get(f'{URL_PREFIX}/image/{image}/full.jpg', headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304
+    assert not response.data
+
+    response = client.get(f'/image/{image}/thumbnail.jpg', headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304
+
+
 @pytest.mark.celery
 def test_scrape(client, auth, craigslist, celery_worker, celery_app, celery_timeout):
     auth.login()
@@ -46,4 +84,16 @@ def test_download(client, auth, craigslist, celery_worker, celery_timeout):
     response = client.get(f'{URL_PREFIX}/download-all')
     assert response.status_code == 302
     result = AsyncResult(response.headers['X-result-token'])
-    result.get(timeout=celery_timeout)
\ No newline at end of file
+    result.get(timeout=celery_timeout)
+
+
+def test_image_accel_redirect(app, client, craigslist, image, monkeypatch):
+
+    tasks.download_image(image)
+    monkeypatch.setitem(app.config, 'CRAIGSLIST_BLOB_ACCEL_PREFIX', '/_blobs/')
+
+    response = client.get(f'{URL_PREFIX}/image/{image}/full.jpg')
+    assert response.status_code == 200
+    assert not response.data
+    etag, _ = response.get_etag()
+    assert response.headers['X-Accel-Redirect'] == f'/_blobs/{etag[:2]}/{etag[2:4]}/{etag}'
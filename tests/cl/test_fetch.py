@@ -0,0 +1,80 @@
+import pytest
+
+from clapbot.core import db
+from clapbot.cl import model
+from clapbot.cl.fetch import fetch_images, ImageFetchError
+
+# pylint: disable=redefined-outer-name,unused-argument
+
+IMAGE_URL = "https://images.craigslist.org/00E0E_fUsmqInrJw{}_600x450.jpg"
+
+
+class FakeResponse:
+    """Stands in for an aiohttp response."""
+
+    def __init__(self, content, status=200):
+        self.content = content
+        self.status = status
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise ValueError(f"HTTP {self.status}")
+
+    async def read(self):
+        return self.content
+
+
+class FakeSession:
+    """Stands in for an aiohttp client session, serving image data for each URL."""
+
+    def __init__(self, missing=()):
+        self.missing = set(missing)
+        self.requested = []
+
+    def get(self, url):
+        self.requested.append(url)
+        if url in self.missing:
+            return FakeResponse(b"Missing", status=404)
+        return FakeResponse(url.encode('utf-8'))
+
+
+@pytest.fixture
+def images(app_context, socket_enabled):
+    """Images to download. The event loop needs sockets, but the fake session never connects."""
+    images = [model.Image(url=IMAGE_URL.format(i)) for i in range(5)]
+    db.session.add_all(images)
+    db.session.commit()
+    return images
+
+
+def test_fetch_images(app_context, images):
+    session = FakeSession()
+    assert fetch_images(images, session=session) == 10
+    assert sorted(session.requested) == sorted([image.url for image in images] +
+                                               [image.thumbnail_url for image in images])
+
+    for image in model.Image.query:
+        assert image.full == image.url.encode('utf-8')
+        assert image.thumbnail == image.thumbnail_url.encode('utf-8')
+
+    session = FakeSession()
+    assert fetch_images(model.Image.query.all(), session=session) == 0
+    assert not session.requested
+
+
+def test_fetch_images_partial_failure(app_context, images):
+    session = FakeSession(missing=[images[0].url])
+    with pytest.raises(ImageFetchError) as excinfo:
+        fetch_images(images, session=session)
+    assert [url for url, _ in excinfo.value.failures] == [images[0].url]
+
+    image = model.Image.query.get(images[0].id)
+    assert image.full_digest is None
+    assert image.thumbnail_digest is not None
+    assert all(image.full_digest is not None for image in model.Image.query.filter(model.Image.id != images[0].id))
@@ -0,0 +1,110 @@
+import os
+from pathlib import Path
+
+import pytest
+from httmock import HTTMock, all_requests
+
+from clapbot.cl import http, httpcache, tasks
+from clapbot.cl.model import Listing
+
+# pylint: disable=unused-argument,redefined-outer-name
+
+PAGE = b'<html><section id="postingbody">A listing</section></html>'
+
+
+def test_session_reused(app_context, craigslist):
+    session = http.get_session()
+    assert http.get_session() is session
+
+    adapter = session.get_adapter('https://images.craigslist.org/')
+    assert adapter._pool_maxsize == app_context.config['CRAIGSLIST_HTTP_POOL_MAXSIZE']
+    assert adapter._pool_block == app_context.config['CRAIGSLIST_HTTP_POOL_BLOCK']
+
+    response = http.get('https://sfbay.craigslist.org/eby/apa/1.html')
+    assert response.status_code == 200
+    assert craigslist['https://sfbay.craigslist.org/eby/apa/1.html'] == 1
+
+
+def test_session_not_shared_after_fork(app_context, monkeypatch):
+    session = http.get_session()
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+    assert http.get_session() is not session
+
+
+def test_pool_stats(app_context):
+    assert http.pool_stats() == {}
+
+    adapter = http.get_session().get_adapter('https://images.craigslist.org/')
+    pool = adapter.poolmanager.connection_from_url('https://images.craigslist.org/')
+    pool.num_requests, pool.num_connections = 5, 2
+
+    assert http.pool_stats() == {'https://images.craigslist.org:443': {'requests': 5, 'hits': 3, 'misses': 2}}
+
+
+@pytest.fixture
+def revalidating(app_context, monkeypatch):
+    """A server which answers conditional requests, and records the requests it gets."""
+    monkeypatch.setitem(app_context.config, 'CRAIGSLIST_HTTP_CACHE_ENABLE', True)
+    requests = []
+
+    @all_requests
+    def page(url, request):
+        requests.append(request)
+        if request.headers.get('If-None-Match') == '"v1"':
+            return {'status_code': 304, 'content': b''}
+        return {'status_code': 200, 'content': PAGE, 'headers': {'ETag': '"v1"'}}
+
+    with HTTMock(page):
+        yield requests
+
+
+def test_conditional_revalidation(app_context, revalidating, tmpdir):
+    path = Path(tmpdir) / 'page.html'
+    url = 'https://sfbay.craigslist.org/eby/apa/1.html'
+
+    response = httpcache.get(url, path)
+    assert response.status_code == 200
+    assert path.read_bytes() == PAGE
+    assert 'If-None-Match' not in revalidating[-1].headers
+
+    response = httpcache.get(url, path)
+    assert isinstance(response, httpcache.CachedPage)
+    assert response.status_code == 304
+    assert response.content == PAGE
+    assert revalidating[-1].headers['If-None-Match'] == '"v1"'
+
+    # Callers which only need the status code don't read the stored body.
+    response = httpcache.get(url, path, read_body=False)
+    assert response == (None, 304)
+
+
+def test_cache_ttl(app_context, revalidating):
+    url = 'https://www.craigslist.org/about/sites'
+    assert httpcache.get(url, ttl=60).status_code == 200
+    assert httpcache.get(url, ttl=60).status_code == 200
+    assert len(revalidating) == 1
+    assert httpcache.get(url, ttl=0).status_code == 304
+    assert len(revalidating) == 2
+
+
+def test_download_listing_unchanged(app_context, listing, revalidating, monkeypatch):
+    app_context.config['CRAIGSLIST_CACHE_ENABLE'] = False
+    tasks.download_listing(listing, force=True)
+    parsed = []
+    monkeypatch.setattr(Listing, 'parse_html', lambda self, content: parsed.append(content))
+    tasks.download_listing(listing, force=True)
+    assert parsed == []
+    assert [request.headers.get('If-None-Match') for request in revalidating] == [None, '"v1"']
+
+
+def test_cache_disabled(app_context, tmpdir):
+    path = Path(tmpdir) / 'page.html'
+    assert not app_context.config['CRAIGSLIST_HTTP_CACHE_ENABLE']
+
+    @all_requests
+    def page(url, request):
+        return {'status_code': 200, 'content': PAGE, 'headers': {'ETag': '"v1"'}}
+
+    with HTTMock(page):
+        assert httpcache.get('https://sfbay.craigslist.org/eby/apa/1.html', path).content == PAGE
+    assert not path.exists()
@@ -3,8 +3,16 @@ import json
 import os
 import base64
 
+import sqlalchemy as sa
+
 from clapbot.cl import tasks, model
+from clapbot.cl.model.types import CompressedText
+from clapbot.queries import listing_list_query
 from clapbot.core import db
+from clapbot.cl.blobstore import get_blob_store
+from clapbot.cl.model.keys import get_cache, get_or_create_ids
+from clapbot.cl.model.site import get_registry
+from clapbot.cl import sites as cl_sites
 
 
 def test_listing_from_json(app, listing_json):
@@ -26,6 +34,58 @@ def test_listing_parse_html(app_context, listing, listing_html):
     assert len(listing.tags) == 5
 
 
+def count_queries(func):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    sa.event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        func()
+    finally:
+        sa.event.remove(db.engine, 'before_cursor_execute', record)
+    return len(statements)
+
+
+def test_listing_parse_html_queries(app_context, listing_json, listing_html):
+    """Parsing costs the same number of queries however many tags and images are found."""
+    first = model.Listing.from_result(listing_json)
+    db.session.add(first)
+    db.session.commit()
+    created = count_queries(lambda: first.parse_html(listing_html))
+    db.session.commit()
+
+    listing_json = dict(listing_json, id=str(int(listing_json['id']) + 1), url=listing_json['url'] + '?2')
+    second = model.Listing.from_result(listing_json)
+    db.session.add(second)
+    db.session.commit()
+    cached = count_queries(lambda: second.parse_html(listing_html))
+    db.session.commit()
+
+    assert created <= 16
+    assert cached < created
+    assert {tag.id for tag in first.tags} == {tag.id for tag in second.tags}
+    assert [image.id for image in first.images] == [image.id for image in second.images]
+
+    # Parsing again doesn't duplicate tags or images.
+    second.parse_html(listing_html)
+    assert len(second.tags) == 5
+    assert len(second.images) == 1
+
+
+def test_key_cache_rollback(app_context):
+    ids = get_or_create_ids(model.listing.Tag, model.listing.Tag.name, ['pool', 'garden'])
+    assert set(ids) == {'pool', 'garden'}
+    db.session.rollback()
+    assert not get_cache(model.listing.Tag).get(['pool', 'garden'])
+    assert model.listing.Tag.query.count() == 0
+
+    ids = get_or_create_ids(model.listing.Tag, model.listing.Tag.name, ['pool'])
+    db.session.commit()
+    assert get_cache(model.listing.Tag).get(['pool']) == ids
+
+
 def test_image_encode(app, image, craigslist):
 
     tasks.download_image(image)
@@ -34,3 +94,106 @@ def test_image_encode(app, image, craigslist):
         img = model.Image.query.get(image)
         assert base64.b64decode(img.fullb64) == img.full
         assert base64.b64decode(img.thumbb64) == img.thumbnail
+
+
+def test_image_blob_store(app, image, craigslist, image_data):
+
+    tasks.download_image(image)
+
+    with app.app_context():
+        img = model.Image.query.get(image)
+        assert img.full_digest == img.thumbnail_digest
+        assert img.full_size == len(image_data)
+
+        store = get_blob_store()
+        assert store.exists(img.full_digest)
+        assert store.get(img.full_digest) == image_data
+        assert store.path(img.full_digest).parent.parent.parent == store.root
+
+
+def test_listing_compressed_page(app, listing, listing_html):
+    app.config['CRAIGSLIST_COMPRESS_PAGES'] = True
+
+    with app.app_context():
+        model.Listing.query.get(listing).parse_html(listing_html)
+        db.session.commit()
+
+        raw = db.session.execute("SELECT page FROM listing").scalar()
+        assert raw.startswith(CompressedText.marker)
+        assert len(raw) < len(listing_html)
+
+    with app.app_context():
+        listing = model.Listing.query.get(listing)
+        assert 'page' in sa.inspect(listing).unloaded
+        assert listing.page == listing_html
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_listing_page_bytes(app, listing, listing_html, compress):
+    app.config['CRAIGSLIST_COMPRESS_PAGES'] = compress
+
+    # Pages are downloaded as bytes.
+    with app.app_context():
+        model.Listing.query.get(listing).parse_html(listing_html.encode('utf-8'))
+        db.session.commit()
+
+    with app.app_context():
+        assert model.Listing.query.get(listing).page == listing_html
+
+    # Rows which were stored as bytes are read as text too.
+    with app.app_context():
+        db.session.execute(sa.text("UPDATE listing SET page = :page"), {'page': listing_html.encode('utf-8')})
+        db.session.commit()
+        assert model.Listing.query.get(listing).page == listing_html
+
+
+def test_listing_list_query(app_context, listing, listing_html):
+    model.Listing.query.get(listing).parse_html(listing_html)
+    db.session.commit()
+    db.session.expunge_all()
+
+    listing = listing_list_query().first()
+    assert {'text', 'page'} <= sa.inspect(listing).unloaded
+
+
+def test_site_registry(app_context, listing_json):
+    registry = get_registry()
+    assert get_registry() is registry
+
+    # Resolving names doesn't query the database once the registry is loaded.
+    listings = []
+    queries = count_queries(lambda: listings.append(model.Listing.from_result(listing_json)))
+    assert queries == 0
+
+    listing, = listings
+    assert listing.site.name == 'sfbay'
+    assert listing.area.name == 'eby'
+    assert listing.category.name == 'apa'
+    db.session.add(listing)
+    db.session.commit()
+
+    with pytest.raises(ValueError):
+        model.Listing.from_result(dict(listing_json, category='nope'))
+    db.session.rollback()
+
+    # New rows are found, and reload the registry.
+    db.session.add(model.site.Category(name='roo', description='rooms & shares'))
+    db.session.commit()
+    assert get_registry().category('roo').name == 'roo'
+    assert get_registry() is not registry
+
+
+def test_site_registry_invalidate(app, craigslist):
+    with app.app_context():
+        registry = get_registry()
+        cl_sites.get_all_sites()
+        assert get_registry() is not registry
+
+        # Categories are only imported into an empty table.
+        assert cl_sites.import_categories() == 0
+        model.site.Category.query.delete()
+        db.session.commit()
+        registry = get_registry()
+        assert cl_sites.import_categories() > 0
+        assert get_registry() is not registry
+        assert get_registry().category('apa') is not None
@@ -0,0 +1,58 @@
+import datetime as dt
+
+import pytest
+from bs4 import BeautifulSoup
+
+from clapbot.cl import parse
+
+# pylint: disable=redefined-outer-name
+
+THUMBS_HTML = """<!DOCTYPE html>
+<html><head><meta charset="UTF-8"></head><body>
+<section class="body">
+  <div class="gallery"><img src="https://images.craigslist.org/gallery_600x450.jpg"></div>
+  <div id="thumbs">
+    <a class="thumb" href="https://images.craigslist.org/a_600x450.jpg"><img src="a_50x50c.jpg"></a>
+    <a class="thumb" href="https://images.craigslist.org/b_600x450.jpg"><img src="b_50x50c.jpg"></a>
+    <a class="thumb" href="https://images.craigslist.org/a_600x450.jpg"><img src="a_50x50c.jpg"></a>
+  </div>
+  <div class="mapAndAttrs">
+    <div class="mapbox"><div id="map" data-latitude="37.8716" data-longitude="-122.2727"></div></div>
+    <p class="attrgroup"><span><b>2BR</b> / <b>1.5Ba</b></span> <span>no smoking</span> <span>no smoking</span></p>
+  </div>
+  <section id="postingbody">Café nearby. <b>Sunny</b> rooms.</section>
+</section>
+</body></html>
+"""
+
+BACKENDS = ['html.parser', pytest.param('lxml', marks=pytest.mark.skipif(parse.lxml is None, reason="needs lxml"))]
+
+
+@pytest.mark.parametrize('parser', BACKENDS)
+@pytest.mark.parametrize('page', ['listing_html', 'thumbs_html'])
+def test_parser_parity(request, parser, page):
+    """Every backend should extract the same fields as parsing the full tree."""
+    content = THUMBS_HTML if page == 'thumbs_html' else request.getfixturevalue(page)
+    expected = parse.parse_soup(BeautifulSoup(content, 'html.parser'))
+    assert parse.parse_listing(content, parser) == expected
+
+
+@pytest.mark.parametrize('parser', BACKENDS)
+def test_parse_fields(listing_html, parser):
+    fields = parse.parse_listing(listing_html, parser)
+    assert fields.bedrooms == 1
+    assert fields.bathrooms == 1
+    assert fields.size == 642
+    assert fields.available == dt.date(2017, 5, 5)
+    assert fields.tags == ['cats are OK - purrr', 'dogs are OK - wooof', 'apartment', 'w/d in unit', 'carport']
+    assert len(fields.gallery) == 1
+    assert fields.text
+
+    fields = parse.parse_listing(THUMBS_HTML, parser)
+    assert (fields.lat, fields.lon) == (37.8716, -122.2727)
+    assert fields.thumbnails == [
+        "https://images.craigslist.org/a_600x450.jpg", "https://images.craigslist.org/b_600x450.jpg"
+    ]
+    assert (fields.bedrooms, fields.bathrooms) == (2, 1.5)
+    assert fields.tags == ['no smoking']
+    assert fields.text == "Café nearby. Sunny rooms."
@@ -0,0 +1,71 @@
+import pytest
+
+from clapbot.cl import ratelimit
+
+# pylint: disable=redefined-outer-name,unused-argument
+
+
+class FakeRedis:
+    """Records calls to the token bucket script, returning pre-set waits."""
+
+    def __init__(self, waits):
+        self.waits = list(waits)
+        self.calls = []
+
+    def register_script(self, script):
+        assert script == ratelimit.TOKEN_BUCKET_SCRIPT
+
+        def call(keys, args):
+            self.calls.append((keys, args))
+            return self.waits.pop(0)
+
+        return call
+
+
+@pytest.fixture
+def limiter():
+    limits = {'default': (1.0, 5), 'images.craigslist.org': (10.0, 20)}
+    return ratelimit.TokenBucketLimiter(FakeRedis([b'0', b'0.25']), limits)
+
+
+def test_buckets(limiter):
+    assert limiter.bucket('https://images.craigslist.org/00E0E_fUsmqInrJwB_600x450.jpg') == 'images.craigslist.org'
+    assert limiter.bucket('https://sfbay.craigslist.org/eby/apa/1.html') == 'default'
+    assert limiter.bucket('http://www.craigslist.org/about/sites') == 'default'
+
+
+def test_acquire_waits_for_reservation(limiter, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(ratelimit.time, 'sleep', sleeps.append)
+
+    assert limiter.acquire('https://images.craigslist.org/a.jpg') == 0
+    assert limiter.acquire('https://images.craigslist.org/b.jpg') == 0.25
+    assert sleeps == [0.25]
+
+    (keys, args), _ = limiter.client.calls
+    assert keys == ['clapbot:ratelimit:images.craigslist.org']
+    assert args[:2] == [10.0, 20]
+
+
+def test_acquire_gives_up_long_waits(limiter, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(ratelimit.time, 'sleep', sleeps.append)
+    limiter.client.waits = [b'0', b'45', b'0']
+
+    assert limiter.acquire('https://sfbay.craigslist.org/eby/apa/1.html', max_wait=30) == 0
+    with pytest.raises(ratelimit.RateLimited) as excinfo:
+        limiter.acquire('https://sfbay.craigslist.org/eby/apa/2.html', max_wait=30)
+    assert excinfo.value.wait == 45
+    assert sleeps == []
+
+    # The reservation is given back, so it doesn't hold up other requests.
+    _, (_, reserved), (keys, released) = limiter.client.calls
+    assert keys == ['clapbot:ratelimit:default']
+    assert reserved[3] == 1
+    assert released[3] == -1
+
+
+def test_disabled(app_context):
+    assert not app_context.config['CRAIGSLIST_RATE_LIMIT_ENABLE']
+    assert ratelimit.get_limiter() is None
+    assert ratelimit.acquire('https://sfbay.craigslist.org/eby/apa/1.html') == 0
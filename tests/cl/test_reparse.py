@@ -0,0 +1,39 @@
+from clapbot.core import db
+from clapbot.cl import model
+from clapbot.cl.reparse import reparse_listings
+
+# pylint: disable=unused-argument
+
+
+def test_reparse_listings(app_context, listing, listing_html):
+    stale = model.Listing.query.get(listing)
+    stale.page = listing_html
+    stale.tags = ['stale tag']
+    db.session.commit()
+
+    progress = []
+    assert reparse_listings(batch_size=1, processes=2, progress=progress.append) == 1
+    assert progress == [1]
+
+    db.session.expire_all()
+    listing = model.Listing.query.get(listing)
+    assert listing.bedrooms == 1
+    assert listing.bathrooms == 1
+    assert listing.size == 642
+    assert listing.text
+    assert sorted(tag.name for tag in listing.tags) == sorted(
+        ['cats are OK - purrr', 'dogs are OK - wooof', 'apartment', 'w/d in unit', 'carport'])
+    assert len(listing.images) == 1
+
+
+def test_reparse_from_cache(app_context, listing, listing_html):
+    listing = model.Listing.query.get(listing)
+    (listing.cache_path / f"{listing.cl_id}.html").write_text(listing_html)
+
+    assert reparse_listings(processes=1) == 0
+    assert reparse_listings(processes=1, from_cache=True) == 1
+
+    db.session.expire_all()
+    listing = model.Listing.query.get(listing.id)
+    assert listing.page == listing_html
+    assert listing.bedrooms == 1
@@ -1,9 +1,15 @@
+import sys
+import types
+import datetime as dt
+
 import pytest
 
 from celery.result import AsyncResult
 
-from clapbot.cl import scrape
+from clapbot.core import db
+from clapbot.cl import scrape, tasks
 from clapbot.cl import utils
+from clapbot.cl.model.scrape import Record, ScrapeMark
 
 # pylint: disable=redefined-outer-name,unused-argument
 
@@ -55,6 +61,101 @@ def test_iter_scraped(app, housing, nointernet, listing_json):
     assert listings == [listing_json]
 
 
+@pytest.fixture
+def pages(monkeypatch, listing_json):
+    """A craigslist module which serves pages of results, newest first, and counts the pages fetched."""
+    newest = dt.datetime(2017, 4, 22, 9, 26)
+    results = [
+        dict(listing_json,
+             id=str(6095797900 - i),
+             url=f"https://sfbay.craigslist.org/eby/apa/{6095797900 - i}.html",
+             datetime=(newest - dt.timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M')) for i in range(50)
+    ]
+    fetched = []
+
+    class CraigslistHousing:
+        def __init__(self, site, area, category, filters=None):
+            pass
+
+        def get_results(self, limit=None, **kwargs):
+            for start in range(0, len(results), 10):
+                fetched.append(start)
+                yield from results[start:start + 10]
+
+    module = types.ModuleType('craigslist')
+    module.CraigslistHousing = CraigslistHousing
+    monkeypatch.setitem(sys.modules, 'craigslist', module)
+    return results, fetched
+
+
+def test_incremental_scrape(app_context, pages):
+    results, fetched = pages
+    record = Record(area='eby', site='sfbay', category='apa')
+    db.session.add(record)
+    db.session.commit()
+    record_id, area, category = record.id, record.cl_area, record.cl_category
+
+    def scraped(**kwargs):
+        # Tasks remove the session when they finish, so the record is loaded again.
+        return list(Record.query.get(record_id).scraper(**kwargs))
+
+    def advance(result, filters=None):
+        tasks.advance_scrape_mark(area, category, filters, result['datetime'], int(result['id']))
+
+    def since(filters=None):
+        return ScrapeMark.since(area, category, scrape.filters_key(filters))
+
+    def position(result):
+        return dt.datetime.strptime(result['datetime'], '%Y-%m-%d %H:%M'), int(result['id'])
+
+    # Without a mark, everything up to the limit is scraped, and a mark can be started.
+    record = Record.query.get(record_id)
+    ingested = list(record.scraper(limit=25))
+    assert len(ingested) == 25
+    assert fetched == [0, 10, 20]
+    assert record.mark == position(results[0])
+
+    # Ingesting pages doesn't move the mark, only the end of the whole scrape does.
+    tasks.ingest_listings(ingested)
+    assert since() is None
+    advance(results[5])
+    assert since() == position(results[5])
+
+    # Only the listings newer than the mark are scraped, from the first page.
+    del fetched[:]
+    record = Record.query.get(record_id)
+    assert [result['id'] for result in record.scraper(limit=25)] == [result['id'] for result in results[:5]]
+    assert fetched == [0]
+    assert record.mark == position(results[0])
+
+    # A scrape which stops at the limit before reaching the mark can't move it,
+    # and neither can a scrape which ignores the mark.
+    record = Record.query.get(record_id)
+    assert len(list(record.scraper(limit=3))) == 3
+    assert record.mark is None
+    record = Record.query.get(record_id)
+    assert len(list(record.scraper(limit=25, incremental=False))) == 25
+    assert record.mark is None
+
+    # Older listings don't move the mark back.
+    advance(results[30])
+    assert since() == position(results[5])
+
+    advance(results[0])
+    assert since() == position(results[0])
+    assert scraped(limit=25) == []
+    assert len(scraped(limit=25, incremental=False)) == 25
+
+    # Scrapes with other filters have their own marks, so narrower scrapes don't hide listings from wider ones.
+    narrow = {'max_price': 2000}
+    assert scrape.filters_key(narrow) != scrape.filters_key(None)
+    assert since(narrow) is None
+    advance(results[10], {'max_price': 2000})
+    assert since(narrow) == position(results[10])
+    assert since() == position(results[0])
+    assert len(scraped(limit=25, filters=narrow)) == 10
+
+
 @pytest.mark.celery
 def test_scrape_single(client, auth, craigslist, celery_worker, celery_timeout):
 
@@ -0,0 +1,69 @@
+from httmock import HTTMock, urlmatch
+
+from clapbot.core import db
+from clapbot.cl import sites, tasks
+from clapbot.cl.model.site import Site, Area
+
+# pylint: disable=unused-argument
+
+SITES_HTML = """
+<html><body>
+<div class="box"><a href="https://sfbay.craigslist.org/">SF bay area</a>
+<a href="https://seattle.craigslist.org/">seattle</a></div>
+<div class="box"><a href="https://portland.craigslist.org/">portland</a></div>
+</body></html>
+"""
+
+AREAS_HTML = {
+    'sfbay': ['sfc', 'eby', 'pen'],
+    'atlanta': ['atl', 'nat'],
+    'seattle': ['see', 'est'],
+}
+
+
+def areas_html(areas):
+    links = "".join(f'<li><a href="/{area}/">{area}</a></li>' for area in areas)
+    return f'<html><body><ul class="sublinks">{links}</ul></body></html>'
+
+
+@urlmatch(netloc=r'www\.craigslist\.org$', path=r'/about/sites')
+def sites_page(url, request):
+    return SITES_HTML
+
+
+@urlmatch(netloc=r'(\w+)\.craigslist\.org$')
+def site_page(url, request):
+    site = url.netloc.split('.')[0]
+    if site not in AREAS_HTML:
+        return {'status_code': 404}
+    return areas_html(AREAS_HTML[site])
+
+
+def test_get_all_sites(app_context):
+    with HTTMock(sites_page):
+        assert sites.get_all_sites() == 2
+        assert sites.get_all_sites() == 0
+
+    assert sorted(name for (name, ) in db.session.query(Site.name)) == ['atlanta', 'portland', 'seattle', 'sfbay']
+
+
+def test_get_all_areas(app_context):
+    with HTTMock(site_page):
+        assert sites.get_all_areas('sfbay') == 1
+        assert sites.get_all_areas('SFBAY') == 0
+
+    sfbay = Site.query.filter_by(name='sfbay').one()
+    assert sorted(area.name for area in sfbay.areas) == ['eby', 'pen', 'sfc']
+
+
+def test_get_all_areas_for_enabled_sites(app_context):
+    db.session.add_all([Site(name='seattle', enabled=True), Site(name='portland', enabled=True)])
+    db.session.commit()
+
+    with HTTMock(site_page):
+        # Portland fails, but doesn't stop discovery for the other sites.
+        assert tasks.get_all_areas_for_enabled_sites() == 3
+
+    areas = set(db.session.query(Site.name, Area.name).join(Area.site))
+    assert {('sfbay', 'pen'), ('seattle', 'see'), ('seattle', 'est')} <= areas
+    assert ('atlanta', 'nat') not in areas
@@ -1,10 +1,14 @@
 import json
+import time
+import datetime as dt
 
 import pytest
 
 from celery.result import GroupResult
+from httmock import HTTMock, all_requests
 
 from clapbot.cl import tasks, model
+from clapbot.cl.expiration import check_listings, compact_checks
 from clapbot.core import db
 # pylint: disable=unused-argument
 
@@ -146,7 +150,15 @@ def test_scrape(app, craigslist, scrape_record, celery_app, celery_worker, celer
         img = model.Image.query.first()
         assert img.full is not None
 
-    result = tasks.scrape.s(scrape_record).delay().get(timeout=celery_timeout)
+    # The mark moves past the scraped listing once the whole scrape is ingested, so there's nothing new.
+    deadline = time.monotonic() + celery_timeout
+    with app.app_context():
+        while not model.scrape.ScrapeMark.query.count() and time.monotonic() < deadline:
+            db.session.remove()
+            time.sleep(0.1)
+    assert tasks.scrape.s(scrape_record).delay().get(timeout=celery_timeout) is None
+
+    result = tasks.scrape.s(scrape_record, force=True).delay().get(timeout=celery_timeout)
     results = GroupResult.restore(result, app=celery_app).get(timeout=celery_timeout)
 
 
@@ -193,6 +205,67 @@ def test_check_expirations(app, craigslist, scrape_record, celery_app, celery_wo
     result = tasks.check_expirations.delay().get(timeout=celery_timeout)
 
 
+def test_check_listings(app_context, monkeypatch):
+    listings = [
+        model.Listing(cl_id=i, url=f"https://sfbay.craigslist.org/eby/apa/{i}.html", site='sfbay', area='eby',
+                      category='apa') for i in range(6)
+    ]
+    db.session.add_all(listings)
+    db.session.commit()
+    listing_ids = [listing.id for listing in listings]
+
+    requests = []
+
+    @all_requests
+    def listing_page(url, request):
+        requests.append((request.method, url.path))
+        cl_id = int(url.path.rsplit('/', 1)[1].split('.')[0])
+        if cl_id == 0:
+            raise ConnectionError("Can't connect")
+        if cl_id == 1 and request.method == 'HEAD':
+            return {'status_code': 405, 'content': b''}
+        if cl_id % 2:
+            return {'status_code': 404, 'content': b''}
+        return {'status_code': 200, 'content': b''}
+
+    with HTTMock(listing_page):
+        expired, deferred, _ = check_listings(listing_ids, workers=3)
+    expired = set(expired)
+
+    assert deferred == []
+
+    assert expired == set(listing_ids[1::2])
+    assert ('GET', '/eby/apa/1.html') in requests
+    assert all(method == 'HEAD' for method, path in requests if path != '/eby/apa/1.html')
+
+    check = model.listing.ListingExpirationCheck
+    checks = dict(db.session.query(check.listing_id, check.response_status))
+    # The listing which couldn't be reached is checked again next time.
+    assert checks == {listing_id: (404 if i % 2 else 200) for i, listing_id in enumerate(listing_ids) if i}
+    assert {listing.id for listing in model.Listing.query.filter(model.Listing.expired.isnot(None))} == expired
+    last_status = dict(db.session.query(model.Listing.id, model.Listing.last_status))
+    assert last_status == {listing_ids[0]: None, **checks}
+
+
+def test_compact_checks(app_context, listing):
+    check = model.listing.ListingExpirationCheck
+    now = dt.datetime.now()
+    db.session.add_all([
+        check(listing_id=listing, created=now - dt.timedelta(days=days), response_status=status)
+        for days, status in [(60, 200), (45, 200), (40, 404), (1, 200)]
+    ])
+    db.session.commit()
+
+    assert compact_checks(now - dt.timedelta(days=50)) == 1
+    assert compact_checks(now - dt.timedelta(days=30)) == 2
+
+    summary = model.listing.ListingExpirationSummary.query.get(listing)
+    assert (summary.checks, summary.missing) == (3, 1)
+    assert summary.first_checked_at == now - dt.timedelta(days=60)
+    assert summary.last_checked_at == now - dt.timedelta(days=40)
+    assert [created for (created, ) in db.session.query(check.created)] == [now - dt.timedelta(days=1)]
+
+
 @pytest.mark.celery
 def test_expire_listing(app, listing, missingpages, celery_app, celery_worker, celery_timeout):
 
@@ -203,3 +276,46 @@ def test_expire_listing(app, listing, missingpages, celery_app, celery_worker, c
         listing = model.Listing.query.first()
 
         assert listing.expired is not None
+
+
+def test_ingest_listings(app_context, listing_json):
+    """Test ingesting a page of listings at once."""
+    listing_ids = tasks.ingest_listings([listing_json, dict(listing_json)])
+    assert len(listing_ids) == 1
+
+    listing = model.Listing.query.get(listing_ids[0])
+    assert listing.cl_id == int(listing_json['id'])
+    assert listing.price == 3029.0
+    assert listing.area.name == 'eby'
+    assert listing.category.name == 'apa'
+    assert listing.lat == listing_json['geotag'][0]
+
+    assert tasks.ingest_listings([listing_json]) == []
+    assert tasks.ingest_listings([listing_json], force=True) == listing_ids
+
+
+def test_ingest_listings_overlapping(app_context, listing_json, monkeypatch):
+    """A listing inserted by an overlapping scrape, after the page was checked, doesn't fail the page."""
+    mapping_from_result = model.Listing.mapping_from_result
+
+    def racing(result, registry):
+        mapping = mapping_from_result(result, registry)
+        if not model.Listing.query.filter_by(cl_id=mapping['cl_id']).count():
+            db.session.execute(model.Listing.__table__.insert().values(**mapping))
+        return mapping
+
+    monkeypatch.setattr(model.Listing, 'mapping_from_result', racing)
+    other = dict(listing_json, id='6095797876', url='https://sfbay.craigslist.org/eby/apa/6095797876.html')
+    listing_ids = tasks.ingest_listings([listing_json, other])
+    assert set(listing_ids) == {listing.id for listing in model.Listing.query}
+    assert len(listing_ids) == 2
+
+
+def test_ingest_listings_without_area(app_context, listing_json):
+    result = dict(listing_json, id='6095797876', url='http://sfbay.craigslist.org/apa/6095797876.html')
+    del result['area']
+    listing_ids = tasks.ingest_listings([result, dict(listing_json, area=None)])
+    assert len(listing_ids) == 2
+    for listing in model.Listing.query.filter(model.Listing.id.in_(listing_ids)):
+        assert listing.area is None
+        assert listing.site.name == 'sfbay'
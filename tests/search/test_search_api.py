@@ -21,7 +21,7 @@ def test_get_scrape_requests(app):
 
 def test_scrape(client, auth, monkeypatch):
 
-    monkeypatch.setattr('clapbot.search.api.get_scrape_records', list)
+    monkeypatch.setattr('clapbot.search.api.get_scrape_plans', list)
 
     auth.login()
     response = client.get(f'/api/hs/v1/scrape')
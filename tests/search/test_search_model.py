@@ -0,0 +1,69 @@
+import random
+import datetime as dt
+
+from clapbot.core import db
+from clapbot.cl.model import Listing
+from clapbot.search.model import HousingSearch, BoundingBox
+from clapbot.geo import within_km
+from clapbot.utils import coord_distance
+
+# pylint: disable=unused-argument
+
+WORK = (37.876685, -122.261998)
+
+
+def add_listings(points):
+    listings = [
+        Listing(cl_id=i, url=f'http://sfbay.craigslist.org/eby/apa/{i}.html', site='sfbay', area='eby',
+                category='apa', price=2000.0, lat=lat, lon=lon) for i, (lat, lon) in enumerate(points)
+    ]
+    db.session.add_all(listings)
+    db.session.commit()
+    return listings
+
+
+def test_within_km(app_context):
+    rng = random.Random(3)
+    points = [(WORK[0] + rng.uniform(-0.3, 0.3), WORK[1] + rng.uniform(-0.3, 0.3)) for _ in range(200)]
+    listings = add_listings(points)
+
+    for km in (1.0, 5.0, 20.0):
+        found = {
+            listing_id
+            for (listing_id, ) in db.session.query(Listing.id).filter(within_km(Listing.lat, Listing.lon, *WORK, km))
+        }
+        expected = {listing.id for listing in listings if coord_distance(listing.lat, listing.lon, *WORK) <= km}
+        # The distance test is approximate right at the edge of the circle.
+        edge = {
+            listing.id
+            for listing in listings if abs(coord_distance(listing.lat, listing.lon, *WORK) - km) < km * 0.01
+        }
+        assert found - edge == expected - edge
+
+
+def test_query_predicate_geo(app_context):
+    near, far, boxed = add_listings([(37.87, -122.26), (37.5, -122.0), (37.80, -122.41)])
+    hs = HousingSearch(
+        name='geo', site='sfbay', area='eby', category='apa', price_min=1000, price_max=3000,
+        expiration_date=dt.datetime.now() + dt.timedelta(days=7))
+    db.session.add(hs)
+    db.session.commit()
+
+    def matches():
+        return {listing.id for listing in Listing.query.filter(hs.query_predicate())}
+
+    assert matches() == {near.id, far.id, boxed.id}
+
+    hs.work_radius = 5.0
+    assert matches() == {near.id}
+
+    hs.work_radius = None
+    hs.bboxes = [
+        BoundingBox(name='sf', lat_min=37.70, lat_max=37.82, lon_min=-122.52, lon_max=-122.35),
+        BoundingBox(name='south', lat_min=37.40, lat_max=37.60, lon_min=-122.10, lon_max=-121.90),
+    ]
+    db.session.commit()
+    assert matches() == {far.id, boxed.id}
+
+    hs.work_radius = 30.0
+    assert matches() == {boxed.id}
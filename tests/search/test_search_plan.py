@@ -0,0 +1,48 @@
+import datetime as dt
+
+from clapbot.core import db
+from clapbot.search.model import HousingSearch
+from clapbot.search.plan import merge_filters, plan_scrapes, active_searches
+
+# pylint: disable=unused-argument
+
+
+def test_merge_filters():
+    assert merge_filters([]) == {}
+    assert merge_filters([{
+        'min_price': 1000,
+        'max_price': 2000,
+        'has_image': True
+    }, {
+        'min_price': 1500,
+        'max_price': 3000,
+        'has_image': True
+    }]) == {
+        'min_price': 1000,
+        'max_price': 3000,
+        'has_image': True
+    }
+    # An open bound, or a search which doesn't need images, widens the scrape.
+    assert merge_filters([{'min_price': 1000, 'max_price': 2000, 'has_image': True}, {'max_price': 3000}]) == {
+        'max_price': 3000
+    }
+
+
+def test_plan_scrapes(app_context):
+    expires = dt.datetime.now() + dt.timedelta(days=30)
+    for name, price_min, price_max, require_images in [('Cheap', 1000, 2000, True), ('Pricey', 2500, 4000, False)]:
+        db.session.add(
+            HousingSearch(name=name, site='sfbay', area='eby', category='apa', expiration_date=expires,
+                          price_min=price_min, price_max=price_max, require_images=require_images))
+    db.session.commit()
+
+    plans = {(plan.area.name, plan.category.name): plan for plan in plan_scrapes(active_searches())}
+    assert set(plans) == {('eby', 'apa'), ('eby', 'hhh')}
+
+    plan = plans['eby', 'apa']
+    assert {search.name for search in plan.searches} == {'Test 1', 'Cheap', 'Pricey'}
+    # 'Test 1' has no price range, so the scrape can't be narrowed.
+    assert plan.filters == {}
+
+    plan = plan._replace(searches=[search for search in plan.searches if search.name != 'Test 1'])
+    assert next(plan_scrapes(plan.searches)).filters == {'min_price': 1000, 'max_price': 4000}
@@ -3,8 +3,10 @@ import datetime as dt
 
 from helpers import assert_redirect
 
+from clapbot.core import db
 from clapbot.cl.model import site
-from clapbot.search.model import HousingSearch
+from clapbot.search.model import HousingSearch, BoundingBox
+from clapbot.users.model import User
 
 
 @pytest.fixture
@@ -92,3 +94,36 @@ def test_search_crud(client, app, formdata):
 
     response = client.delete(f'/search/{hs_id}/delete')
     assert_redirect(response, f'/users/profile/test')
+
+
+def test_set_bbox(client, app):
+    with app.app_context():
+        test, other = User.query.filter_by(username='test').one(), User.query.filter_by(username=None).one()
+        boxes = [
+            BoundingBox(name='North Berkeley', lat_min=37.87, lat_max=37.89, lon_min=-122.28, lon_max=-122.26,
+                        user=test),
+            BoundingBox(name='Rockridge', lat_min=37.83, lat_max=37.85, lon_min=-122.26, lon_max=-122.24,
+                        user=test),
+        ]
+        expires = dt.datetime.now() + dt.timedelta(days=30)
+        mine = HousingSearch(name='Mine', site=site.Site.query.filter_by(name='sfbay').one(), owner=test,
+                             expiration_date=expires)
+        theirs = HousingSearch(name='Theirs', site=mine.site, owner=other, expiration_date=expires)
+        db.session.add_all(boxes + [mine, theirs])
+        db.session.commit()
+        mine_id, theirs_id, box_id = mine.id, theirs.id, boxes[1].id
+
+    response = client.get(f'/search/{mine_id}/bbox/')
+    assert response.status_code == 200
+    assert 'North Berkeley' in response.get_data(as_text=True)
+
+    response = client.post(f'/search/{mine_id}/bbox/', data={'Rockridge': 'y'})
+    assert_redirect(response, f'/search/{mine_id}')
+    with app.app_context():
+        assert [bbox.id for bbox in HousingSearch.query.get(mine_id).bboxes] == [box_id]
+
+    # Other users' searches can't be seen or changed.
+    assert client.get(f'/search/{theirs_id}/bbox/').status_code == 404
+    assert client.post(f'/search/{theirs_id}/bbox/', data={'Rockridge': 'y'}).status_code == 404
+    with app.app_context():
+        assert HousingSearch.query.get(theirs_id).bboxes == []
@@ -0,0 +1,142 @@
+import random
+import zipfile
+
+from clapbot import location, tasks
+from clapbot.core import db
+from clapbot.model import TransitStop
+from clapbot.cl.model import Listing
+from clapbot.spatial import KDTree, BoxIndex, unit_vector, chord_to_km
+from clapbot.search.model import BoundingBox
+from clapbot.utils import coord_distance
+
+# pylint: disable=unused-argument
+
+
+def test_kdtree_nearest():
+    rng = random.Random(42)
+    points = [(rng.uniform(37.0, 38.5), rng.uniform(-123.0, -121.5)) for _ in range(500)]
+    tree = KDTree((unit_vector(lat, lon), i) for i, (lat, lon) in enumerate(points))
+    assert len(tree) == len(points)
+
+    for _ in range(50):
+        lat, lon = rng.uniform(37.0, 38.5), rng.uniform(-123.0, -121.5)
+        expected = min(range(len(points)), key=lambda i: coord_distance(lat, lon, *points[i]))
+        index, chord = tree.nearest(unit_vector(lat, lon))
+        assert index == expected
+        assert abs(chord_to_km(chord) - coord_distance(lat, lon, *points[index])) < 1e-6
+
+
+def test_kdtree_empty():
+    assert KDTree([]).nearest(unit_vector(37.0, -122.0)) == (None, float('inf'))
+
+
+def test_find_nearest_transit_stop(app_context):
+    location.import_transit('BART')
+
+    listing = Listing(lat=37.876685, lon=-122.261998)
+    location.find_nearest_transit_stop(listing)
+
+    expected = min(TransitStop.query.all(),
+                   key=lambda stop: coord_distance(listing.lat, listing.lon, stop.lat, stop.lon))
+    assert listing.transit_stop.id == expected.id
+
+    # Adding a stop should invalidate the cached index.
+    stop = TransitStop(agency='TEST', stop_id='HERE', name='Right here', lat=listing.lat, lon=listing.lon)
+    db.session.add(stop)
+    db.session.commit()
+
+    location.find_nearest_transit_stop(listing)
+    assert listing.transit_stop.id == stop.id
+
+    # So should moving or deleting one, which other workers only see through the signature.
+    stop.lat, stop.lon = 0.0, 0.0
+    db.session.commit()
+    location.find_nearest_transit_stop(listing)
+    assert listing.transit_stop.id == expected.id
+
+    stop.lat, stop.lon = listing.lat, listing.lon
+    db.session.commit()
+    location.find_nearest_transit_stop(listing)
+    db.session.delete(stop)
+    db.session.commit()
+    location.find_nearest_transit_stop(listing)
+    assert listing.transit_stop.id == expected.id
+
+
+def test_import_transit_gtfs_zip(app_context, tmpdir):
+    added = location.import_transit('BART')
+    assert added == TransitStop.query.count() > 0
+    assert location.import_transit('BART') == 0
+
+    stops = "\ufeffstop_id,stop_name,stop_lat,stop_lon,location_type\n" \
+        "12TH,12th St. Oakland City Center,37.9,-122.3,0\n" \
+        "NEW,New Station,37.5,-122.0,0\n" \
+        "NODE,Generic node,,,3\n"
+    path = str(tmpdir.join('gtfs.zip'))
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('gtfs/stops.txt', stops.encode('utf-8'))
+
+    assert location.import_transit('BART', path=path, batch_size=1) == 1
+    assert TransitStop.query.count() == added + 1
+    moved = TransitStop.query.filter_by(agency='BART', stop_id='12TH').one()
+    assert (moved.lat, moved.lon) == (37.9, -122.3)
+
+    # The transit index is rebuilt with the new stop.
+    listing = Listing(lat=37.5, lon=-122.0)
+    location.find_nearest_transit_stop(listing)
+    assert listing.transit_stop.stop_id == 'NEW'
+
+    # Other workers see stops which were only moved through the signature.
+    index = location.transit_index()
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('stops.txt', "stop_id,stop_name,stop_lat,stop_lon\nNEW,New Station,37.6,-122.1\n")
+    assert location.import_transit('BART', path=path) == 0
+    assert index.signature != location.TransitIndex.current_signature()
+
+
+def test_box_index():
+    rng = random.Random(7)
+    boxes = []
+    for i in range(200):
+        lat, lon = rng.uniform(37.0, 38.5), rng.uniform(-123.0, -121.5)
+        boxes.append(((lat, lat + rng.uniform(0.0, 0.3), lon, lon + rng.uniform(0.0, 0.3)), i))
+    # A box covering the whole region is checked against every point.
+    boxes.append(((30.0, 45.0, -130.0, -115.0), 'all'))
+    index = BoxIndex(boxes, cell_size=0.05, max_cells=100)
+    assert len(index) == len(boxes)
+
+    points = [(rng.uniform(37.0, 38.5), rng.uniform(-123.0, -121.5), i) for i in range(300)]
+    expected = {(i, payload)
+                for (lat, lon, i) in points for ((lat_min, lat_max, lon_min, lon_max), payload) in boxes
+                if lat_min <= lat <= lat_max and lon_min <= lon <= lon_max}
+    assert set(index.join(points)) == expected
+    assert not index.contains(0.0, 0.0)
+
+
+def test_find_bboxes(app_context):
+    inside = BoundingBox(name='berkeley', lat_min=37.85, lat_max=37.90, lon_min=-122.30, lon_max=-122.24)
+    db.session.add(inside)
+    db.session.commit()
+
+    here = Listing(lat=37.876685, lon=-122.261998)
+    away = Listing(lat=37.5, lon=-122.0)
+    assert location.check_inside_bboxes(here)
+    assert not location.check_inside_bboxes(away)
+
+    # Adding a box should invalidate the cached index.
+    outside = BoundingBox(name='fremont', lat_min=37.4, lat_max=37.6, lon_min=-122.1, lon_max=-121.9)
+    db.session.add(outside)
+    db.session.commit()
+    assert location.check_inside_bboxes(away)
+
+    found = location.find_bboxes([(1, here.lat, here.lon), (2, away.lat, away.lon), (3, None, None)])
+    assert found == {1: {inside.id}, 2: {outside.id}, 3: set()}
+
+    # A batch of listings is located at once, and listings outside every box are removed.
+    db.session.add_all([here, away, Listing(lat=0.0, lon=0.0)])
+    db.session.commit()
+    ids = {'here': here.id, 'away': away.id, 'inside': inside.id, 'outside': outside.id}
+    tasks.location_info_batch([listing_id for (listing_id, ) in db.session.query(Listing.id)])
+    assert Listing.query.count() == 2
+    assert [bbox.id for bbox in Listing.query.get(ids['here']).bboxes] == [ids['inside']]
+    assert [bbox.id for bbox in Listing.query.get(ids['away']).bboxes] == [ids['outside']]
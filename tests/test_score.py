@@ -0,0 +1,97 @@
+import datetime as dt
+
+import pytest
+
+from clapbot import batchscore
+from clapbot.core import db
+from clapbot.model import UserListingInfo, TransitStop
+from clapbot.cl.model import Listing
+from clapbot.score import score_info
+
+# pylint: disable=redefined-outer-name,unused-argument
+
+IMAGE_URL = "https://images.craigslist.org/00E0E_fUsmqInrJw{}_600x450.jpg"
+
+
+@pytest.fixture
+def listings(app_context):
+    stop = TransitStop(agency='TEST', stop_id='A', name='A', lat=37.87, lon=-122.27)
+    db.session.add(stop)
+    today = dt.datetime.combine(dt.date.today(), dt.time(12, 0))
+    listings = [
+        Listing(
+            site='sfbay',
+            area='eby',
+            category='apa',
+            cl_id=1,
+            name='Sunny house',
+            price='$2500',
+            created=today,
+            available=dt.date(2017, 6, 1),
+            bedrooms=2,
+            bathrooms=1,
+            lat=37.86,
+            lon=-122.26,
+            transit_stop=stop,
+            images=[IMAGE_URL.format(i) for i in range(5)],
+            tags=['w/d in unit', 'house', 'no smoking']),
+        Listing(
+            site='sfbay',
+            area='eby',
+            category='apa',
+            cl_id=2,
+            name='Big STUDIO',
+            price='$1200',
+            created=today - dt.timedelta(days=5),
+            available=dt.date(2017, 8, 1),
+            bathrooms=3,
+            size=400.0,
+            lat=37.5,
+            lon=-122.0,
+            images=[IMAGE_URL.format('a')],
+            tags=['furnished', 'laundry on site', 'condo']),
+        Listing(
+            site='sfbay',
+            area='eby',
+            category='apa',
+            cl_id=3,
+            name='Old listing',
+            price='$900',
+            created=today - dt.timedelta(days=20),
+            bedrooms=4,
+            bathrooms=3),
+        Listing(
+            site='sfbay',
+            area='eby',
+            category='apa',
+            cl_id=4,
+            name='Price on request',
+            price='$0',
+            created=today - dt.timedelta(days=1),
+            bedrooms=2),
+    ]
+    db.session.add_all(listings)
+    db.session.commit()
+    return [listing.id for listing in listings]
+
+
+def test_batch_matches_scalar(app_context, listings):
+    columns = batchscore.load_columns(listings)
+    info = batchscore.score_columns(columns)
+    for i, listing_id in enumerate(columns.ids):
+        expected = score_info(Listing.query.get(int(listing_id)))
+        for name, value in expected.items():
+            assert info[name][i] == pytest.approx(value), f"Mismatch for {name} on listing {listing_id}"
+
+
+def test_score_listings(app_context, listings):
+    db.session.add(UserListingInfo(listing_id=listings[0], score=0))
+    db.session.commit()
+
+    assert batchscore.score_listings(listings) == len(listings)
+    db.session.commit()
+
+    for listing_id in listings:
+        info = UserListingInfo.query.filter_by(listing_id=listing_id).one()
+        expected = sum(score_info(Listing.query.get(listing_id)).values())
+        assert info.score == round(expected)
@@ -0,0 +1,157 @@
+import contextlib
+import datetime as dt
+import re
+import time
+
+import pytest
+from sqlalchemy import event
+
+from clapbot import location, tasks
+from clapbot.core import db
+from clapbot.model import TransitStop, UserListingInfo
+from clapbot.cl.model import Listing
+from clapbot.search.model import BoundingBox, HousingSearch
+from clapbot.search.model.location import boundingboxassociation
+from clapbot.search.model.search import housingsearchbboxes
+from clapbot.pagination import count_query
+
+# pylint: disable=redefined-outer-name,unused-argument
+
+IMAGE_URL = "https://images.craigslist.org/{:05d}_fUsmqInrJwB_600x450.jpg"
+
+
+@pytest.fixture
+def client(auth, client):
+    auth.login()
+    yield client
+    auth.logout()
+
+
+@contextlib.contextmanager
+def count_queries(engine):
+    """Count the queries executed against an engine."""
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        queries.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield queries
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def add_listings(n):
+    stop = TransitStop(agency='TEST', stop_id='A', name='A', lat=37.87, lon=-122.27)
+    db.session.add(stop)
+    for i in range(n):
+        listing = Listing(
+            site='sfbay',
+            area='eby',
+            category='apa',
+            cl_id=i,
+            url=f'http://sfbay.craigslist.org/eby/apa/{i}.html',
+            name=f'Listing {i}',
+            price='$2000',
+            created=dt.datetime.now() - dt.timedelta(hours=i),
+            lat=37.86,
+            lon=-122.26,
+            transit_stop=stop,
+            images=[IMAGE_URL.format(i * 3 + j) for j in range(3)],
+            tags=['house', f'tag {i}'])
+        db.session.add(listing)
+    db.session.commit()
+
+
+@pytest.mark.parametrize('path', ['/', '/latest', '/search/'])
+def test_listing_table_queries(app, client, path):
+    """Rendering a page of listings should take a fixed number of queries."""
+    with app.app_context():
+        add_listings(20)
+        engine = db.engine
+
+    with count_queries(engine) as queries:
+        response = client.get(path)
+    assert response.status_code == 200
+    assert response.data.count(b"class='listing-links'") == 20
+    assert len(queries) <= 10
+
+
+def page_ids(response):
+    return [int(i) for i in re.findall(rb"<tr id='listing-(\d+)'>", response.data)]
+
+
+def page_cursor(response, direction):
+    match = re.search(rf'href="[^"]*[?&]{direction}=([^"&]+)"'.encode(), response.data)
+    return match.group(1).decode() if match else None
+
+
+def test_keyset_pagination(app, client):
+    with app.app_context():
+        add_listings(45)
+        scores = {listing.id: (listing.id % 3) * 100 for listing in Listing.query}
+        db.session.add_all(UserListingInfo(listing_id=listing_id, score=score) for listing_id, score in scores.items())
+        db.session.commit()
+        expected = [
+            listing.id for listing in sorted(Listing.query.all(),
+                                             key=lambda listing: (scores[listing.id], listing.created, listing.id),
+                                             reverse=True)
+        ]
+
+    pages, cursor = [], None
+    while True:
+        response = client.get('/', query_string={'after': cursor} if cursor else {})
+        assert response.status_code == 200
+        assert b"of 45 items" in response.data
+        pages.append(page_ids(response))
+        cursor = page_cursor(response, 'after')
+        if cursor is None:
+            break
+
+    assert [len(page) for page in pages] == [20, 20, 5]
+    assert sum(pages, []) == expected
+
+    cursor = page_cursor(response, 'before')
+    response = client.get('/', query_string={'before': cursor})
+    assert page_ids(response) == pages[1]
+
+
+def test_keyset_pagination_invalid_cursor(client):
+    assert client.get('/', query_string={'after': 'not-a-cursor'}).status_code == 400
+
+
+def test_count_cache_bounded(app_context, monkeypatch):
+    monkeypatch.setitem(app_context.config, 'CRAIGSLIST_PAGINATION_COUNT', 'cached')
+    monkeypatch.setitem(app_context.config, 'CRAIGSLIST_PAGINATION_COUNT_CACHE_SIZE', 2)
+    for price in range(5):
+        assert count_query(Listing.query.filter(Listing.price > price)) == (0, False)
+    assert len(app_context.extensions['clapbot.pagination_counts']) == 2
+
+    # Expired counts are dropped when the next count is made.
+    later = time.monotonic() + app_context.config['CRAIGSLIST_PAGINATION_COUNT_TTL'] + 1
+    monkeypatch.setattr(time, 'monotonic', lambda: later)
+    count_query(Listing.query.filter(Listing.price > 10))
+    assert len(app_context.extensions['clapbot.pagination_counts']) == 1
+
+
+def test_replace_bboxes(app, client):
+    with app.app_context():
+        bbox = BoundingBox(name='berkeley', lat_min=37.85, lat_max=37.90, lon_min=-122.30, lon_max=-122.24)
+        listing = Listing(lat=37.876685, lon=-122.261998)
+        search = HousingSearch.query.filter_by(name='Test 1').first()
+        search.bboxes = [bbox]
+        db.session.add_all([bbox, listing])
+        db.session.commit()
+        tasks.location_info_batch([listing.id])
+        assert db.session.query(boundingboxassociation).count() == 1
+        assert len(location.bbox_index()) == 1
+
+    response = client.post('/bboxes/', data={'bboxes': 'oakland,-122.30,37.78,-122.20,37.85\n'})
+    assert response.status_code == 302
+
+    with app.app_context():
+        assert [bbox.name for bbox in BoundingBox.query] == ['oakland']
+        assert db.session.query(boundingboxassociation).count() == 0
+        assert db.session.query(housingsearchbboxes).count() == 0
+        assert 'clapbot.bbox_index' not in app.extensions